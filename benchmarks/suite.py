@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+the benchmark suite, on the simulated kernel so it runs anywhere.
+
+    python -m benchmarks --save baseline.json
+    python -m benchmarks --compare baseline.json
+
+parse: decode_notify_buffer throughput on bursts of the event mix.
+pool: a WinDirectoryWatcher (both backends) fed by simkernel.queue_changes,
+    the events per second and the latency from the queue_changes to each
+    event delivered by pool.
+observe: the same for a DirWatcher on a generated tree (classification and
+    tree updates included).
+tree: the serial and parallel tree builds of the generated tree, its size
+    in memory and the load of its snapshot.
+
+every benchmark runs --repeat times, a value is the median of the runs
+and its spread the median absolute deviation (relative to the median).
+the short operations (parse, tree) are looped for at least --min-time
+seconds per run, a few milliseconds are mostly timer and scheduler noise.
+
+with --compare the exit status is 1 when a value is worse than the saved
+one by more than its noise band: --noise times the spreads of both runs,
+at least --tolerance. the band needs a spread, --compare needs at least
+MIN_COMPARE_REPEAT runs.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from winwatcher.events import monotonic
+from winwatcher.fs_tree import build_tree_state, build_tree_state_parallel
+from winwatcher.notify_buffers import MAX_BUFFER_SIZE
+from winwatcher.notify_parser import decode_notify_buffer, encode_notify_records
+from winwatcher.object_watcher import (WinDirectoryWatcher, BACKEND_WFMO,
+                                       BACKEND_IOCP)
+from winwatcher.simkernel import SimulatedKernel
+from winwatcher.snapshot import save_snapshot, load_snapshot
+from winwatcher.watcher import DirWatcher
+
+from .tree_builder import make_tree
+from .workloads import EventMix, DEFAULT_MIX, parse_mix, event_count
+
+HIGHER = 'higher'
+LOWER = 'lower'
+
+BENCHMARKS = ('parse', 'pool', 'observe', 'tree')
+#how long a benchmark waits for an event before giving up.
+DELIVERY_TIMEOUT = 5.0
+DEFAULT_REPEAT = 7
+MIN_COMPARE_REPEAT = 3
+DEFAULT_MIN_TIME = 0.05
+#a regression is a change beyond NOISE_FACTOR times the spreads, and
+#beyond DEFAULT_TOLERANCE for the values without spread (the counts).
+NOISE_FACTOR = 4.0
+DEFAULT_TOLERANCE = 0.05
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def spread(values):
+    """the median absolute deviation of values, relative to their median."""
+    center = median(values)
+    if not center:
+        return 0.0
+    deviation = median([abs(value - center) for value in values])
+    return deviation / float(abs(center))
+
+
+def timed(operation, min_time=DEFAULT_MIN_TIME):
+    """the seconds per call of operation, called for at least min_time."""
+    calls = 0
+    start = monotonic()
+    while True:
+        operation()
+        calls += 1
+        elapsed = monotonic() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def deep_size(obj):
+    """the bytes held by obj and everything it references, once each."""
+    seen = set()
+    pending = [obj]
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.iterkeys())
+            pending.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        else:
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if hasattr(obj, slot):
+                        pending.append(getattr(obj, slot))
+            if hasattr(obj, '__dict__'):
+                pending.append(obj.__dict__)
+    return size
+
+
+class Options(object):
+    def __init__(self, events=5000, burst=256, mix=DEFAULT_MIX, seed=0,
+                 depth=3, fanout=4, files=10, workers=4,
+                 repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+        self.events = events
+        self.burst = burst
+        self.mix = mix
+        self.seed = seed
+        self.depth = depth
+        self.fanout = fanout
+        self.files = files
+        self.workers = workers
+        self.repeat = repeat
+        self.min_time = min_time
+
+    def event_mix(self):
+        return EventMix(self.mix, self.depth, self.fanout, self.files,
+                        self.seed)
+
+
+#benchmarks, each returns {name: (value, better)}
+
+def bench_parse(options, directory):
+    mix = options.event_mix()
+    buffers = []
+    for records in mix.bursts(options.events, options.burst):
+        data = encode_notify_records(records)
+        buffers.append((bytearray(data), len(data)))
+    events = [0]
+
+    def decode_all():
+        events[0] = 0
+        for buf, nbytes in buffers:
+            events[0] += len(decode_notify_buffer(buf, nbytes, 0, 1, 0.0))
+
+    elapsed = timed(decode_all, options.min_time)
+    return {'parse_events_per_second': (events[0] / elapsed, HIGHER)}
+
+
+def _drain(watcher, deliver, records, latencies):
+    """queue records, deliver the events and time them, the events count."""
+    expected = event_count(records)
+    start = monotonic()
+    watcher._kernel.queue_changes(watcher._file_handle, records)
+    delivered = 0
+    while delivered < expected:
+        event = deliver(DELIVERY_TIMEOUT)
+        latencies.append(monotonic() - start)
+        delivered += 1
+        if event[0] == 'Overflow':
+            #the rest of the burst was dropped with it.
+            break
+    return delivered
+
+
+def _feed(options, watcher, deliver, prefix):
+    latencies = []
+    events = 0
+    start = monotonic()
+    for records in options.event_mix().bursts(options.events,
+                                              options.burst):
+        events += _drain(watcher, deliver, records, latencies)
+    elapsed = monotonic() - start
+    return {
+        prefix + '_events_per_second': (events / elapsed, HIGHER),
+        prefix + '_latency_p50': (percentile(latencies, 0.5), LOWER),
+        prefix + '_latency_p99': (percentile(latencies, 0.99), LOWER),
+        prefix + '_overflows': (watcher.overflows, LOWER),
+    }
+
+
+def bench_pool(options, directory):
+    results = {}
+    for backend in (BACKEND_WFMO, BACKEND_IOCP):
+        watcher = WinDirectoryWatcher(directory, kernel=SimulatedKernel(),
+                                      backend=backend,
+                                      buffer_size=MAX_BUFFER_SIZE)
+        watcher.start_watching()
+        try:
+            results.update(_feed(options, watcher, watcher.pool,
+                                 'pool_' + backend))
+        finally:
+            watcher.stop_watching()
+    return results
+
+
+def bench_observe(options, directory):
+    watcher = DirWatcher(directory, kernel=SimulatedKernel(),
+                         background_tree=False, tree_workers=options.workers,
+                         buffer_size=MAX_BUFFER_SIZE)
+    watcher.start_watching()
+    try:
+        results = _feed(options, watcher, watcher.observe, 'observe')
+        results['observe_stat_calls'] = (watcher.stat_calls, LOWER)
+    finally:
+        watcher.stop_watching()
+    return results
+
+
+def bench_tree(options, directory):
+    tree = build_tree_state(directory)
+    serial = timed(lambda: build_tree_state(directory), options.min_time)
+    parallel = timed(lambda: build_tree_state_parallel(
+            directory, workers=options.workers), options.min_time)
+
+    snapshot_directory = tempfile.mkdtemp(prefix='winwatcher_bench_')
+    try:
+        snapshot_path = os.path.join(snapshot_directory, 'tree.snapshot')
+        save_snapshot(snapshot_path, tree, directory)
+        snapshot = timed(lambda: load_snapshot(snapshot_path, directory),
+                         options.min_time)
+    finally:
+        shutil.rmtree(snapshot_directory)
+
+    return {
+        'tree_directories': (len(tree), None),
+        'tree_build_seconds': (serial, LOWER),
+        'tree_build_parallel_seconds': (parallel, LOWER),
+        'tree_snapshot_load_seconds': (snapshot, LOWER),
+        'tree_bytes': (deep_size(tree), LOWER),
+    }
+
+
+BENCHMARK_FUNCTIONS = {
+    'parse': bench_parse,
+    'pool': bench_pool,
+    'observe': bench_observe,
+    'tree': bench_tree,
+}
+
+
+def run(options, names=BENCHMARKS):
+    """
+    {metric: {'value': ..., 'spread': ..., 'better': ...}} of the given
+    benchmarks.
+    """
+    directory = tempfile.mkdtemp(prefix='winwatcher_bench_').decode('utf-8')
+    try:
+        make_tree(directory, options.depth, options.fanout, options.files)
+        samples = {}
+        kinds = {}
+        for name in names:
+            function = BENCHMARK_FUNCTIONS[name]
+            for i in xrange(options.repeat):
+                for metric, (value, better) in function(options,
+                                                        directory).items():
+                    samples.setdefault(metric, []).append(value)
+                    kinds[metric] = better
+        return dict((metric, {'value': median(values),
+                              'spread': spread(values),
+                              'better': kinds[metric]})
+                    for metric, values in samples.iteritems())
+    finally:
+        shutil.rmtree(directory)
+
+
+def noise_band(result, base, noise=NOISE_FACTOR,
+               tolerance=DEFAULT_TOLERANCE):
+    """the relative change of a metric that is still noise."""
+    return max(tolerance, noise * (result.get('spread', 0.0) +
+                                   base.get('spread', 0.0)))
+
+
+def compare(results, baseline, noise=NOISE_FACTOR,
+            tolerance=DEFAULT_TOLERANCE):
+    """
+    the metrics worse than baseline by more than their noise band, as
+    (metric, baseline value, value, band).
+    """
+    regressions = []
+    for metric, result in sorted(results.items()):
+        base = baseline.get(metric)
+        if base is None:
+            continue
+        better, value, base_value = result['better'], result['value'], \
+                base['value']
+        band = noise_band(result, base, noise, tolerance)
+        if better == HIGHER and value < base_value * (1 - band):
+            regressions.append((metric, base_value, value, band))
+        elif better == LOWER and value > base_value * (1 + band):
+            regressions.append((metric, base_value, value, band))
+    return regressions
+
+
+def report(results, baseline=None, out=sys.stdout):
+    for metric, result in sorted(results.items()):
+        line = '%-40s %14.6g  +-%5.1f%%' % (metric, result['value'],
+                                            result['spread'] * 100)
+        if baseline is not None and metric in baseline:
+            base_value = baseline[metric]['value']
+            if base_value:
+                change = (result['value'] - base_value) / float(base_value)
+                line += '   %+7.1f%%' % (change * 100,)
+        out.write(line + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog='python -m benchmarks',
+            description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help="%s, all of them by default"
+                             % ', '.join(BENCHMARKS))
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--burst', type=int, default=256,
+                        help="the changes queued at once")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="weights of the actions, e.g. "
+                             "added=3,modified=5,removed=1,renamed=1")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help="the runs of every benchmark, the values are "
+                             "their medians")
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                        help="the seconds the short operations are looped "
+                             "for in a run")
+    parser.add_argument('--save', help="write the results to this file")
+    parser.add_argument('--compare', help="the results of an earlier --save")
+    parser.add_argument('--noise', type=float, default=NOISE_FACTOR,
+                        help="a regression is a change beyond this many "
+                             "spreads")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="the smallest change that is a regression")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %r" % (name,))
+    if args.compare and args.repeat < MIN_COMPARE_REPEAT:
+        parser.error("--compare needs --repeat %d or more, the noise band "
+                     "comes from the spread of the runs"
+                     % (MIN_COMPARE_REPEAT,))
+
+    options = Options(args.events, args.burst, args.mix, args.seed,
+                      args.depth, args.fanout, args.files, args.workers,
+                      args.repeat, args.min_time)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = run(options, args.benchmarks or BENCHMARKS)
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'options': vars(options), 'results': results}, f,
+                      indent=2, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.noise,
+                              args.tolerance)
+        for metric, base_value, value, band in regressions:
+            sys.stderr.write('regression: %s %g -> %g (noise band %.1f%%)\n'
+                             % (metric, base_value, value, band * 100))
+        if regressions:
+            return 1
+    return 0
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+tree building benchmark on a generated tree, it runs anywhere.
+
+    python -m benchmarks.tree_builder --depth 4 --fanout 8 --files 20
+
+builds the DirWatcher tree state of a synthetic tree serially and with the
+parallel builder for every --workers count, best of --repeat runs.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from winwatcher.fs_tree import build_tree_state, build_tree_state_parallel
+
+
+def make_tree(root, depth, fanout, files):
+    """fanout directories per level, files in every directory."""
+    directories = 0
+    pending = [(root, depth)]
+    while pending:
+        current, level = pending.pop()
+        directories += 1
+        for i in range(files):
+            open(os.path.join(current, 'file%d.txt' % i), 'w').close()
+        if not level:
+            continue
+        for i in range(fanout):
+            child = os.path.join(current, 'dir%d' % i)
+            os.mkdir(child)
+            pending.append((child, level - 1))
+    return directories
+
+
+def best_of(repeat, build):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        build()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(root, workers, repeat):
+    results = [('serial', best_of(repeat,
+                                  lambda: build_tree_state(root)))]
+    for count in workers:
+        build = lambda: build_tree_state_parallel(root, workers=count)
+        results.append(('%d workers' % count, best_of(repeat, build)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--root', help="an existing tree instead of a "
+                                       "generated one")
+    args = parser.parse_args(argv)
+
+    root = args.root
+    if root is None:
+        root = tempfile.mkdtemp(prefix='winwatcher_bench_').decode('utf-8')
+        directories = make_tree(root, args.depth, args.fanout, args.files)
+        print '%d directories, %d files' % (directories,
+                                            directories * args.files)
+    try:
+        for name, elapsed in run(root, args.workers, args.repeat):
+            print '%-12s %8.3fs' % (name, elapsed)
+    finally:
+        if args.root is None:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
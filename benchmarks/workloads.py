@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+deterministic event mixes for the benchmarks.
+
+the paths are the ones of benchmarks.tree_builder.make_tree (dir<n> for
+the directories, file<n>.txt for the files), so the modified, removed and
+renamed entries are known to a DirWatcher of that tree and the added ones
+are new. the same seed gives the same records.
+"""
+
+import os
+import random
+
+from winwatcher.win32_constants import (FILE_ACTION_ADDED,
+                                        FILE_ACTION_REMOVED,
+                                        FILE_ACTION_MODIFIED,
+                                        FILE_ACTION_RENAMED_OLD_NAME,
+                                        FILE_ACTION_RENAMED_NEW_NAME)
+
+DEFAULT_MIX = {'added': 3, 'modified': 5, 'removed': 1, 'renamed': 1}
+MIX_ACTIONS = ('added', 'modified', 'removed', 'renamed')
+
+
+def parse_mix(text):
+    """'added=3,modified=5' to a mix, the missing actions weigh 0."""
+    mix = dict((action, 0) for action in MIX_ACTIONS)
+    for item in text.split(','):
+        action, sep, weight = item.partition('=')
+        action = action.strip()
+        if action not in mix or not sep:
+            raise ValueError, "invalid mix item %r" % (item,)
+        mix[action] = int(weight)
+    if not any(mix.values()):
+        raise ValueError, "the mix is empty"
+    return mix
+
+
+class EventMix(object):
+    def __init__(self, mix=DEFAULT_MIX, depth=2, fanout=4, files=10,
+                 seed=0):
+        self.depth = depth
+        self.fanout = fanout
+        self.files = files
+        self._random = random.Random(seed)
+        self._choices = []
+        for action in MIX_ACTIONS:
+            self._choices.extend([action] * mix.get(action, 0))
+        self._new = 0
+
+    def _directory(self):
+        choice = self._random.randrange
+        #the kernel reports \\, the tree of the watcher uses os.sep.
+        return os.sep.join(u'dir%d' % choice(self.fanout)
+                           for i in range(choice(self.depth + 1)))
+
+    def _join(self, directory, name):
+        return directory + os.sep + name if directory else name
+
+    def _existing(self):
+        name = u'file%d.txt' % self._random.randrange(self.files)
+        return self._join(self._directory(), name)
+
+    def _created(self):
+        self._new += 1
+        return self._join(self._directory(), u'new%d.txt' % self._new)
+
+    def records(self, count):
+        """count changes as (action, name) records, a rename is two."""
+        records = []
+        choice = self._random.choice
+        for i in xrange(count):
+            action = choice(self._choices)
+            if action == 'added':
+                records.append((FILE_ACTION_ADDED, self._created()))
+            elif action == 'modified':
+                records.append((FILE_ACTION_MODIFIED, self._existing()))
+            elif action == 'removed':
+                records.append((FILE_ACTION_REMOVED, self._existing()))
+            else:
+                old = self._existing()
+                records.append((FILE_ACTION_RENAMED_OLD_NAME, old))
+                records.append((FILE_ACTION_RENAMED_NEW_NAME,
+                                old[:-len(u'.txt')] + u'.bak'))
+        return records
+
+    def bursts(self, total, burst):
+        """records for total changes, in bursts of burst changes."""
+        while total > 0:
+            count = min(burst, total)
+            total -= count
+            yield self.records(count)
+
+
+def event_count(records):
+    """the events decoded from records, the renamed pairs are one."""
+    return len(records) - sum(1 for action, name in records
+                              if action == FILE_ACTION_RENAMED_OLD_NAME)
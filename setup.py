@@ -6,7 +6,8 @@ setup(
         version='0.1.0',
         author='Marcelo A. Caetano',
         author_email='marcelo.caetano@titansgroup.com.br',
-        packages=find_packages(),
+        packages=find_packages(exclude=['benchmarks', 'tests', 'tests.*']),
+        install_requires=['scandir', 'futures'],
         url='http://github.com/caetanus/windows-file-changes-notify'
         )            
 
@@ -35,15 +35,17 @@ class TestWFMOIntegrationTestCase(TestCase):
         self.assertIn(handle, wfmo._handles)
         self.assertIn(handle, wfmo._lphandles[0][:])
 
-    def test_wfmo_register_many_lphandles_should_pass(self):
+    def test_wfmo_unregister_should_keep_the_other_slots(self):
         wfmo = WaitForMultipleObjectsPool()
-        handles = range(1, 513)
-        wfmo._handles = handles
-        out = []
-        wfmo._update_lphandles()
-        for handle in wfmo._lphandles:
-            out += handle[:]
-        self.assertListEqual(out, handles)
+        handles = range(1, 130)
+        map(wfmo.register_handle, handles)
+        slots = dict(wfmo._slots)
+        wfmo.unregister_handle(10)
+        for handle in handles:
+            if handle != 10:
+                self.assertEqual(wfmo._slots[handle], slots[handle])
+        wfmo.register_handle(1000)
+        self.assertEqual(wfmo._slots[1000], slots[10])
 
     def test_wfmo_register_many_handles_update_lphandles_correcly(self):
         wfmo = WaitForMultipleObjectsPool()
@@ -66,19 +68,18 @@ class TestWFMOIntegrationTestCase(TestCase):
         handle = FindFirstChangeNotification(self.directory)
         FindCloseChangeNotification(handle)
 
-    def test__update_handles(self):
+    def test_lphandles(self):
         wfmo = WaitForMultipleObjectsPool()
-        wfmo._handles = [4, 3, 2, 9]
-        wfmo._update_lphandles()
+        map(wfmo.register_handle, [4, 3, 2, 9])
         self.assertEqual(wfmo._lphandles[0][:], wfmo._handles)
 
-    def test__update_handles_splited(self):
-        handles = range(256)
+    def test_lphandles_splited(self):
+        handles = range(1, 257)
         wfmo = WaitForMultipleObjectsPool()
-        wfmo._handles = handles
-        wfmo._update_lphandles()
+        map(wfmo.register_handle, handles)
         out = reduce(lambda x, y: x + y, wfmo._lphandles)
         self.assertEqual(out, handles)
+        self.assertEqual(map(len, wfmo._lphandles), [63, 63, 63, 63, 4])
 
     def test_wfmo_should_return_handlers(self):
         def create_file_inside_directory(foo_file):
@@ -206,3 +206,44 @@ class Test_WinDirectoryObjectWatcherTestCase(TestCase):
 
 
 
+
+    def test_pool_batch_should_return_all_the_queued_events(self):
+        watcher = WinDirectoryWatcher(self.directory)
+        watcher.start_watching()
+        for i in range(16):
+            open(os.path.join(self.directory, "foo%d.bar" % i), "w").close()
+
+        out = []
+        while len(out) < 16:
+            out += [i for i in watcher.pool_batch(timeout=1)
+                    if i[0] == 'Added']
+        watcher.stop_watching()
+        self.assertListEqual(out, [('Added', u'foo%d.bar' % i)
+                                   for i in range(16)])
+
+    def test_pool_batch_should_respect_max_events(self):
+        watcher = WinDirectoryWatcher(self.directory)
+        watcher.start_watching()
+        for i in range(8):
+            open(os.path.join(self.directory, "foo%d.bar" % i), "w").close()
+
+        self.assertTrue(len(watcher.pool_batch(2, 1)) <= 2)
+        watcher.stop_watching()
+
+    def test_iter_events_should_stop_on_timeout(self):
+        watcher = WinDirectoryWatcher(self.directory)
+        watcher.start_watching()
+        open(os.path.join(self.directory, "foo.bar"), "w").close()
+
+        out = list(watcher.iter_events(0.5))
+        watcher.stop_watching()
+        self.assertIn(('Added', u'foo.bar'), out)
+
+    def test_iocp_backend_should_return_the_object_added_to_dir(self):
+        watcher = WinDirectoryWatcher(self.directory, backend='iocp')
+        watcher.start_watching()
+        open(os.path.join(self.directory, "foo.bar"), "w").close()
+
+        result = watcher.pool(1)
+        watcher.stop_watching()
+        self.assertEquals(result, ('Added', u'foo.bar'))
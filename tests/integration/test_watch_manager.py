@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+from unittest import TestCase
+from winwatcher import WatchManager, WatchManagerError, TimeoutError
+
+import tempfile
+import shutil
+
+
+class Test_WatchManagerTestCase(TestCase):
+
+    def setUp(self):
+        self.directories = [tempfile.mkdtemp().decode('utf-8')
+                            for i in range(3)]
+        self.manager = WatchManager()
+
+    def tearDown(self):
+        self.manager.close()
+        for directory in self.directories:
+            shutil.rmtree(directory.encode('utf-8'))
+
+    def test_events_are_tagged_with_their_root(self):
+        for directory in self.directories:
+            self.manager.add_root(directory)
+        for directory in self.directories:
+            open(os.path.join(directory, "foo.bar"), "w").close()
+
+        out = set()
+        for root, event in self.manager.iter_events(1):
+            if event[0] == 'Added':
+                out.add((root, event.path))
+        self.assertEqual(out, set((d, u'foo.bar') for d in self.directories))
+
+    def test_roots_share_the_pool_threads(self):
+        for directory in self.directories:
+            self.manager.add_root(directory)
+        self.assertRaises(TimeoutError, self.manager.poll, 0.1)
+        self.assertEqual(len(self.manager._pool._groups), 1)
+
+    def test_removed_root_is_not_reported(self):
+        first, second = self.directories[:2]
+        self.manager.add_root(first)
+        self.manager.add_root(second)
+        self.manager.remove_root(first)
+        open(os.path.join(first, "foo.bar"), "w").close()
+        open(os.path.join(second, "foo.bar"), "w").close()
+
+        roots = set(root for root, event in self.manager.iter_events(1))
+        self.assertEqual(roots, set([second]))
+        self.assertEqual(self.manager.roots, [second])
+
+    def test_root_should_be_added_once(self):
+        self.manager.add_root(self.directories[0])
+        self.assertRaises(WatchManagerError, self.manager.add_root,
+                          self.directories[0])
+        self.assertRaises(WatchManagerError, self.manager.remove_root,
+                          self.directories[1])
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase, skipIf
+import shutil
+import tempfile
+import threading
+import time
+
+from winwatcher import aio
+from winwatcher.errors import TimeoutError
+from winwatcher.object_watcher import WinDirectoryWatcher
+from winwatcher.simkernel import SimulatedKernel
+from winwatcher.win32_constants import FILE_ACTION_ADDED
+
+
+class FakeWatcher(object):
+    """pools its batches like a DirWatcher."""
+
+    def __init__(self, batches=()):
+        self.batches = list(batches)
+        self._watching = False
+        self.stopped = 0
+        self._mutex = threading.Lock()
+
+    def start_watching(self):
+        self._watching = True
+
+    def stop_watching(self):
+        self._watching = False
+        self.stopped += 1
+
+    def _next_batch(self, timeout):
+        with self._mutex:
+            if self.batches:
+                return self.batches.pop(0)
+        time.sleep(timeout)
+        raise TimeoutError
+
+
+class FakeProactor(object):
+    """signals the first wait at once, the next ones never."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.waits = 0
+
+    def wait_for_handle(self, handle, timeout):
+        future = aio.asyncio.Future(loop=self.loop)
+        if not self.waits:
+            future.set_result(True)
+        self.waits += 1
+        return future
+
+
+@skipIf(aio.asyncio is None, "asyncio is not available")
+class TestAsyncEventStreamTestCase(TestCase):
+
+    def setUp(self):
+        self.loop = aio.asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _stream(self, watcher):
+        return aio.AsyncEventStream(watcher, self.loop, aio.BRIDGE_THREAD,
+                                    0.01)
+
+    def _run_callbacks(self):
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def test_batches_are_delivered_in_order(self):
+        watcher = FakeWatcher([[1, 2], [3]])
+        with self._stream(watcher) as stream:
+            out = [self.loop.run_until_complete(stream.get())
+                   for i in range(3)]
+        self.assertEqual(out, [1, 2, 3])
+
+    def test_closing_stops_the_owned_watcher_and_the_bridge(self):
+        watcher = FakeWatcher()
+        stream = self._stream(watcher)
+        self.assertTrue(watcher._watching)
+        stream.close()
+        stream._thread.join(1)
+        self.assertFalse(stream._thread.is_alive())
+        self.assertEqual(watcher.stopped, 1)
+        self.assertRaises(aio.StreamClosed,
+                          self.loop.run_until_complete, stream.get())
+
+    def test_watcher_already_watching_is_not_stopped(self):
+        watcher = FakeWatcher()
+        watcher.start_watching()
+        stream = self._stream(watcher)
+        stream.close()
+        stream._thread.join(1)
+        self.assertEqual(watcher.stopped, 0)
+
+    def test_invalid_bridge_should_stop_the_watcher(self):
+        watcher = FakeWatcher()
+        self.assertRaises(ValueError, aio.AsyncEventStream, watcher,
+                          self.loop, 'select')
+        self.assertEqual(watcher.stopped, 1)
+
+    def test_cancelled_get_keeps_the_stream(self):
+        watcher = FakeWatcher()
+        with self._stream(watcher) as stream:
+            stream.get().cancel()
+            self._run_callbacks()
+            self.assertFalse(stream.closed)
+            watcher.batches.append([1])
+            self.assertEqual(self.loop.run_until_complete(stream.get()), 1)
+
+    def test_proactor_retries_a_pending_read(self):
+        directory = tempfile.mkdtemp().decode('ascii')
+        self.addCleanup(shutil.rmtree, directory)
+        self.loop._proactor = FakeProactor(self.loop)
+        watcher = WinDirectoryWatcher(directory, kernel=SimulatedKernel())
+        with aio.AsyncEventStream(watcher, self.loop,
+                                  aio.BRIDGE_PROACTOR) as stream:
+            #signaled, but the read isn't done, the loop isn't blocked.
+            self._run_callbacks()
+            self.assertIsInstance(stream._wait, aio.asyncio.TimerHandle)
+            watcher._kernel.queue_changes(watcher._file_handle,
+                                          [(FILE_ACTION_ADDED, u'a')])
+            event = self.loop.run_until_complete(stream.get())
+            self.assertEqual(tuple(event), ('Added', u'a'))
+            self.assertEqual(watcher.stats()['wakes'], 1)
+        self.assertFalse(watcher._watching)
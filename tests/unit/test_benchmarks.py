@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from benchmarks.suite import (compare, median, spread, timed, HIGHER,
+                              LOWER)
+from benchmarks.workloads import EventMix, parse_mix, event_count
+from winwatcher.events import monotonic
+
+
+def _result(value, better, spread=0.0):
+    return {'value': value, 'better': better, 'spread': spread}
+
+
+class TestCompareTestCase(TestCase):
+
+    def test_median_and_spread(self):
+        self.assertEqual(median([3, 1, 2]), 2)
+        self.assertEqual(median([4, 1, 2, 3]), 2.5)
+        self.assertEqual(spread([10, 10, 10]), 0.0)
+        self.assertEqual(spread([9, 10, 12]), 0.1)
+        self.assertEqual(spread([0, 0, 1]), 0.0)
+
+    def test_changes_inside_the_noise_band_pass(self):
+        baseline = {'rate': _result(100.0, HIGHER, 0.05),
+                    'seconds': _result(1.0, LOWER, 0.05)}
+        #4 times the spreads of both runs: 40%.
+        results = {'rate': _result(61.0, HIGHER, 0.05),
+                   'seconds': _result(1.39, LOWER, 0.05)}
+        self.assertEqual(compare(results, baseline), [])
+
+    def test_changes_beyond_the_noise_band_fail(self):
+        baseline = {'rate': _result(100.0, HIGHER, 0.05),
+                    'seconds': _result(1.0, LOWER, 0.05)}
+        results = {'rate': _result(59.0, HIGHER, 0.05),
+                   'seconds': _result(1.41, LOWER, 0.05)}
+        self.assertEqual([(m, b, v) for m, b, v, band
+                          in compare(results, baseline)],
+                         [('rate', 100.0, 59.0), ('seconds', 1.0, 1.41)])
+
+    def test_improvements_pass(self):
+        baseline = {'rate': _result(100.0, HIGHER),
+                    'seconds': _result(1.0, LOWER)}
+        results = {'rate': _result(200.0, HIGHER),
+                   'seconds': _result(0.5, LOWER)}
+        self.assertEqual(compare(results, baseline), [])
+
+    def test_the_tolerance_without_spread(self):
+        baseline = {'bytes': _result(1000, LOWER)}
+        self.assertEqual(compare({'bytes': _result(1040, LOWER)}, baseline),
+                         [])
+        regressions = compare({'bytes': _result(1060, LOWER)}, baseline)
+        self.assertEqual(regressions, [('bytes', 1000, 1060, 0.05)])
+        self.assertEqual(compare({'bytes': _result(1060, LOWER)}, baseline,
+                                 tolerance=0.1), [])
+
+    def test_unknown_and_informative_metrics_are_skipped(self):
+        baseline = {'directories': _result(85, None)}
+        results = {'directories': _result(1000, None),
+                   'new_rate': _result(1.0, HIGHER)}
+        self.assertEqual(compare(results, baseline), [])
+
+    def test_timed_runs_for_min_time(self):
+        calls = []
+        start = monotonic()
+        per_call = timed(lambda: calls.append(None), 0.02)
+        elapsed = monotonic() - start
+        self.assertTrue(elapsed >= 0.02)
+        self.assertTrue(len(calls) > 1)
+        self.assertTrue(per_call <= elapsed / len(calls) * 1.01)
+
+
+class TestEventMixTestCase(TestCase):
+
+    def _bursts(self, seed, mix=None):
+        mix = EventMix(mix or parse_mix('added=3,modified=5,removed=1,'
+                                        'renamed=1'),
+                       depth=2, seed=seed)
+        return list(mix.bursts(100, 16))
+
+    def test_the_same_seed_gives_the_same_records(self):
+        self.assertEqual(self._bursts(1), self._bursts(1))
+        self.assertNotEqual(self._bursts(1), self._bursts(2))
+
+    def test_bursts_cover_the_total(self):
+        bursts = self._bursts(0)
+        self.assertEqual([event_count(records) for records in bursts],
+                         [16] * 6 + [4])
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('added=1'),
+                         {'added': 1, 'modified': 0, 'removed': 0,
+                          'renamed': 0})
+        self.assertRaises(ValueError, parse_mix, 'copied=1')
+        self.assertRaises(ValueError, parse_mix, 'added=0')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+
+from winwatcher import classify
+from winwatcher.classify import EntryCache
+
+
+class TestEntryCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='winwatcher_').decode('utf-8')
+        os.mkdir(os.path.join(self.directory, u'a'))
+        os.mkdir(os.path.join(self.directory, u'a', u'sub'))
+        for i in range(8):
+            with open(os.path.join(self.directory, u'a', u'f%d' % i), 'w') as f:
+                f.write('x' * i)
+        self.scanned = []
+        self._real_scandir = classify.scandir
+        self.addCleanup(setattr, classify, 'scandir', classify.scandir)
+        classify.scandir = self._scandir
+        self.cache = EntryCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _scandir(self, path):
+        self.scanned.append(path)
+        return self._real_scandir(path)
+
+    def _paths(self, *names):
+        return [os.path.join(u'a', name) for name in names]
+
+    def test_one_scan_per_directory(self):
+        paths = self._paths(u'sub', *[u'f%d' % i for i in range(8)])
+        self.cache.prefetch(paths)
+        self.assertEqual(len(self.scanned), 1)
+        self.assertTrue(self.cache.is_dir(paths[0]))
+        self.assertFalse(any(self.cache.is_dir(p) for p in paths[1:]))
+        self.assertEqual(self.cache.stats, 0)
+
+        #still fresh, not listed again.
+        self.cache.prefetch(paths)
+        self.assertEqual(self.cache.scans, 1)
+
+    def test_small_groups_are_stated(self):
+        paths = self._paths(u'sub', u'f0')
+        self.cache.prefetch(paths)
+        self.assertEqual(self.scanned, [])
+        self.assertTrue(self.cache.is_dir(paths[0]))
+        self.assertEqual(self.cache.stats, 1)
+
+    def test_new_and_forgotten_entries_are_stated(self):
+        paths = self._paths(u'f0', u'f1', u'f2', u'f3')
+        self.cache.prefetch(paths)
+        os.mkdir(os.path.join(self.directory, u'a', u'new'))
+        self.assertTrue(self.cache.is_dir(os.path.join(u'a', u'new')))
+        self.assertEqual(self.cache.stats, 1)
+
+        os.remove(os.path.join(self.directory, u'a', u'f0'))
+        os.mkdir(os.path.join(self.directory, u'a', u'f0'))
+        self.cache.forget(paths[0])
+        self.assertTrue(self.cache.is_dir(paths[0]))
+        self.cache.forget(u'a')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_links_to_directories_are_files(self):
+        if not hasattr(os, 'symlink'):
+            self.skipTest("no symlinks")
+        for name in (u'l0', u'l1', u'l2', u'l3'):
+            os.symlink(os.path.join(self.directory, u'a', u'sub'),
+                       os.path.join(self.directory, u'a', name))
+        paths = self._paths(u'l0', u'l1', u'l2', u'l3')
+        self.cache.prefetch(paths)
+        self.assertFalse(any(self.cache.is_dir(p) for p in paths))
+        classify.scandir = None
+        self.cache.clear()
+        self.assertFalse(self.cache.is_dir(paths[0]))
+        self.assertEqual(self.cache.stats, 1)
+
+    def test_listings_expire(self):
+        self.cache.ttl = 0
+        paths = self._paths(u'f0', u'f1', u'f2', u'f3')
+        self.cache.prefetch(paths)
+        self.assertIsNone(self.cache.entry(paths[0]))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_without_scandir(self):
+        classify.scandir = None
+        self.cache.prefetch(self._paths(u'f0', u'f1', u'f2', u'f3'))
+        self.assertFalse(self.cache.is_dir(self._paths(u'f0')[0]))
+        self.assertEqual(self.cache.stats, 1)
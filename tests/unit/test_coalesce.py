@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from winwatcher.coalesce import EventCoalescer
+from winwatcher.events import Event, ACTION_CODES
+
+
+class TestEventCoalescerTestCase(TestCase):
+
+    def setUp(self):
+        self.coalescer = EventCoalescer(0.5)
+
+    def _events(self, events):
+        return [Event(ACTION_CODES[e[0]], e[-1], e[1] if len(e) == 3 else None)
+                for e in events]
+
+    def _coalesce(self, events):
+        self.coalescer.extend(self._events(events), 0)
+        return self.coalescer.ready(1)
+
+    def test_events_are_held_for_the_window(self):
+        self.coalescer.add(Event(ACTION_CODES['Modified'], u'a'), 10)
+        self.assertEqual(self.coalescer.next_deadline(), 10.5)
+        self.assertEqual(self.coalescer.ready(10.2), [])
+        self.assertEqual(self.coalescer.ready(10.5), [('Modified', u'a')])
+        self.assertIsNone(self.coalescer.next_deadline())
+
+    def test_repeated_modified_are_merged(self):
+        self.assertEqual(self._coalesce([('Modified', u'a'),
+                                         ('Modified', u'b'),
+                                         ('Modified', u'a'),
+                                         ('Modified', u'a')]),
+                         [('Modified', u'a'), ('Modified', u'b')])
+
+    def test_added_then_removed_cancel(self):
+        self.assertEqual(self._coalesce([('Added', u'a.tmp'),
+                                         ('Modified', u'a.tmp'),
+                                         ('Removed', u'a.tmp')]), [])
+
+    def test_rename_chain_is_folded(self):
+        self.assertEqual(self._coalesce([('Moved', u'a', u'b'),
+                                         ('Moved', u'b', u'c')]),
+                         [('Moved', u'a', u'c')])
+        self.assertEqual(self._coalesce([('Moved', u'a', u'b'),
+                                         ('Moved', u'b', u'a')]), [])
+
+    def test_safe_save_becomes_a_single_modified(self):
+        self.assertEqual(self._coalesce([('Added', u'doc.tmp'),
+                                         ('Modified', u'doc.tmp'),
+                                         ('Removed', u'doc'),
+                                         ('Moved', u'doc.tmp', u'doc')]),
+                         [('Modified', u'doc')])
+
+    def test_moved_then_removed_is_removed(self):
+        self.assertEqual(self._coalesce([('Moved', u'a', u'b'),
+                                         ('Removed', u'b')]),
+                         [('Removed', u'a')])
+
+    def test_overflow_passes_through_and_flush(self):
+        self.coalescer.extend(self._events([('Overflow', u''), ('Added', u'a')]),
+                              0)
+        self.assertEqual(self.coalescer.flush(),
+                         [('Overflow', u''), ('Added', u'a')])
+        self.assertEqual(len(self.coalescer), 0)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import threading
+
+from winwatcher.completion import CompletionPortEngine
+from winwatcher.errors import TimeoutError, IoCompletionPortError
+from winwatcher.notify_buffers import NotifyBufferRing
+from winwatcher.notify_parser import decode_notify_buffer
+from winwatcher.simkernel import SimulatedKernel
+from winwatcher.win32_constants import FILE_ACTION_ADDED
+
+
+class TestCompletionPortEngineTestCase(TestCase):
+
+    def setUp(self):
+        self.kernel = SimulatedKernel()
+        self.engine = CompletionPortEngine(self.kernel)
+
+    def tearDown(self):
+        self.engine.close()
+
+    def _watch(self, number):
+        rings = []
+        for i in range(number):
+            directory = self.kernel.CreateFileDirectory(u'c:\\sim%d' % i)
+            ring = NotifyBufferRing(self.kernel, directory, True, 0, 1)
+            key = self.engine.register(directory, ring)
+            ring.arm()
+            rings.append((directory, key, ring))
+        return rings
+
+    def test_pool_should_timeout_without_completions(self):
+        self._watch(1)
+        self.assertRaises(TimeoutError, self.engine.pool, 0)
+        self.assertRaises(TimeoutError, self.engine.pool, 0.05)
+
+    def test_completions_are_dispatched_by_key(self):
+        rings = self._watch(1000)
+        for directory, key, ring in rings[::97]:
+            self.kernel.queue_changes(directory, [(FILE_ACTION_ADDED, u'a')])
+
+        served = []
+        for i in range(len(rings[::97])):
+            ring = self.engine.pool(0)
+            buf, nbytes = ring.complete()
+            self.assertEqual(decode_notify_buffer(buf, nbytes),
+                             [('Added', u'a')])
+            served.append(ring)
+        self.assertEqual(served, [ring for d, k, ring in rings[::97]])
+        self.assertRaises(TimeoutError, self.engine.pool, 0)
+        #a single waiter, no matter how many directories.
+        self.assertEqual(threading.active_count(), 1)
+
+    def test_completions_of_unregistered_keys_are_dropped(self):
+        (first, first_key, first_ring), (second, key, ring) = self._watch(2)
+        self.kernel.queue_changes(first, [(FILE_ACTION_ADDED, u'a')])
+        self.kernel.queue_changes(second, [(FILE_ACTION_ADDED, u'b')])
+        self.engine.unregister(first_key)
+
+        self.assertTrue(self.engine.pool(0) is ring)
+        self.assertEqual(self.engine.dropped, 1)
+        self.assertEqual(len(self.engine), 1)
+
+    def test_close_should_wake_the_waiter(self):
+        self._watch(1)
+        errors = []
+
+        def waiter():
+            try:
+                self.engine.pool()
+            except IoCompletionPortError, e:
+                errors.append(e)
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        self.engine.close()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
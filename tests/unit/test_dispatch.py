@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import threading
+import time
+
+from winwatcher.dispatch import (Dispatcher, DispatcherError, POLICY_DROP,
+                                 POLICY_COALESCE)
+from winwatcher.errors import TimeoutError
+
+
+class FakeWatcher(object):
+    def __init__(self, batches=()):
+        self.batches = list(batches)
+        self._watching = False
+        self._mutex = threading.Lock()
+
+    def start_watching(self):
+        self._watching = True
+
+    def stop_watching(self):
+        self._watching = False
+
+    def _next_batch(self, timeout):
+        with self._mutex:
+            if self.batches:
+                batch = self.batches.pop(0)
+                if isinstance(batch, Exception):
+                    raise batch
+                return batch
+        time.sleep(timeout)
+        raise TimeoutError
+
+
+class ThreadExecutor(object):
+    """a thread per task, enough for the tests."""
+
+    def __init__(self):
+        self.threads = []
+
+    def submit(self, fn, *args):
+        thread = threading.Thread(target=fn, args=args)
+        thread.start()
+        self.threads.append(thread)
+
+    def shutdown(self, wait=True):
+        for thread in self.threads:
+            thread.join()
+
+
+class TestDispatcherTestCase(TestCase):
+
+    def _dispatcher(self, batches, **options):
+        options.setdefault('interval', 0.01)
+        dispatcher = Dispatcher(FakeWatcher(batches), ThreadExecutor(),
+                                **options)
+        self.addCleanup(dispatcher.stop)
+        return dispatcher
+
+    def _blocked(self, dispatcher):
+        release = threading.Event()
+        dispatcher.register(lambda event: release.wait())
+        self.addCleanup(release.set)
+        return release
+
+    def test_handlers_are_matched_by_type_and_pattern(self):
+        dispatcher = self._dispatcher([[('FileAdded', u'a.py'),
+                                        ('FileAdded', u'a.txt'),
+                                        ('FileRemoved', u'b.py'),
+                                        ('FileMoved', u'c.txt', u'c.py')]])
+        added, python = [], []
+        dispatcher.register(added.append, ('FileAdded',))
+
+        @dispatcher.on(pattern=u'*.py')
+        def on_python(event):
+            python.append(event)
+
+        dispatcher.start()
+        time.sleep(0.1)
+        dispatcher.stop()
+        self.assertEqual(sorted(added), [('FileAdded', u'a.py'),
+                                         ('FileAdded', u'a.txt')])
+        self.assertEqual(sorted(python), [('FileAdded', u'a.py'),
+                                          ('FileMoved', u'c.txt', u'c.py'),
+                                          ('FileRemoved', u'b.py')])
+        self.assertEqual(dispatcher.dispatched, 5)
+
+    def test_slow_handlers_dont_stop_the_reader(self):
+        events = [('FileAdded', u'%d' % i) for i in range(10)]
+        dispatcher = self._dispatcher([events], max_in_flight=2)
+        release = self._blocked(dispatcher)
+        dispatcher.start()
+        time.sleep(0.1)
+        self.assertEqual(dispatcher.in_flight, 2)
+        self.assertEqual(dispatcher.queue_depth, 8)
+        self.assertEqual(dispatcher._watcher.batches, [])
+        release.set()
+        dispatcher.stop()
+        self.assertEqual(dispatcher.in_flight, 0)
+        self.assertEqual(dispatcher.dispatched, 10)
+
+    def test_full_queue_drops_with_drop_policy(self):
+        events = [('FileAdded', u'%d' % i) for i in range(10)]
+        dispatcher = self._dispatcher([events], max_queue=3, max_in_flight=1,
+                                      policy=POLICY_DROP)
+        release = self._blocked(dispatcher)
+        dispatcher.start()
+        time.sleep(0.1)
+        #the first event may be taken before or after the queue fills.
+        self.assertTrue(dispatcher.queue_depth in (2, 3))
+        self.assertEqual(dispatcher.in_flight, 1)
+        self.assertEqual(dispatcher.dropped + dispatcher.queue_depth +
+                         dispatcher.in_flight, 10)
+        release.set()
+        dispatcher.stop()
+        self.assertEqual(dispatcher.dispatched, 10 - dispatcher.dropped)
+
+    def test_full_queue_coalesces_repeated_events(self):
+        events = [('FileModified', u'%d' % (i % 2)) for i in range(10)]
+        dispatcher = self._dispatcher([events], max_queue=2, max_in_flight=1,
+                                      policy=POLICY_COALESCE)
+        release = self._blocked(dispatcher)
+        dispatcher.start()
+        time.sleep(0.1)
+        self.assertTrue(dispatcher.queue_depth in (1, 2))
+        self.assertEqual(dispatcher.coalesced + dispatcher.queue_depth +
+                         dispatcher.in_flight, 10)
+        release.set()
+        dispatcher.stop()
+
+    def test_handler_errors_are_counted(self):
+        dispatcher = self._dispatcher([[('FileAdded', u'a')]])
+        failures = []
+        dispatcher.error_handler = lambda *args: failures.append(args)
+        dispatcher.register(lambda event: 1 / 0)
+        dispatcher.start()
+        time.sleep(0.1)
+        dispatcher.stop()
+        self.assertEqual(dispatcher.errors, 1)
+        self.assertEqual(len(failures), 1)
+
+    def test_watcher_errors_stop_the_reading(self):
+        error = IOError('gone')
+        dispatcher = self._dispatcher([[('FileAdded', u'a')], error,
+                                       [('FileAdded', u'b')]])
+        failures, events = [], []
+        dispatcher.error_handler = lambda *args: failures.append(args)
+        dispatcher.register(events.append)
+        dispatcher.start()
+        time.sleep(0.1)
+        self.assertIs(dispatcher.error, error)
+        self.assertEqual(dispatcher.errors, 1)
+        self.assertEqual(failures, [(None, None, error)])
+        self.assertEqual(events, [('FileAdded', u'a')])
+        dispatcher.stop()
+
+        #started again, it reads on.
+        dispatcher.start()
+        time.sleep(0.1)
+        dispatcher.stop()
+        self.assertIsNone(dispatcher.error)
+        self.assertEqual(events, [('FileAdded', u'a'), ('FileAdded', u'b')])
+
+    def test_invalid_policy_should_raise(self):
+        self.assertRaises(DispatcherError, Dispatcher, FakeWatcher(),
+                          policy='spill')
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+
+from winwatcher.event_queue import (BoundedEventQueue, QUEUE_DROP_NEWEST,
+                                    QUEUE_RESCAN_MARKER, QUEUE_SPILL,
+                                    event_size)
+from winwatcher.events import Event, ACTION_MOVED
+from winwatcher.win32_constants import FILE_ACTION_ADDED
+
+
+def added(number):
+    return [Event(FILE_ACTION_ADDED, u'f%d' % i, None, 7) for i in
+            range(number)]
+
+
+def drain(queue):
+    out = []
+    while queue:
+        out.append(queue.popleft())
+    return out
+
+
+class TestBoundedEventQueueTestCase(TestCase):
+
+    def test_drop_oldest_keeps_the_newest(self):
+        queue = BoundedEventQueue(max_events=3)
+        queue.extend(added(5))
+        self.assertEqual(drain(queue), added(5)[2:])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_drop_newest_keeps_the_oldest(self):
+        queue = BoundedEventQueue(max_events=3, policy=QUEUE_DROP_NEWEST)
+        queue.extend(added(5))
+        self.assertEqual(drain(queue), added(3))
+        self.assertEqual(queue.dropped, 2)
+
+    def test_bytes_limit(self):
+        events = added(4)
+        queue = BoundedEventQueue(max_bytes=2 * event_size(events[0]))
+        queue.extend(events)
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.bytes, 2 * event_size(events[0]))
+        drain(queue)
+        self.assertEqual(queue.bytes, 0)
+
+    def test_rescan_marker_replaces_the_queue(self):
+        queue = BoundedEventQueue(max_events=3, policy=QUEUE_RESCAN_MARKER,
+                                  watch_id=7)
+        queue.extend(added(6))
+        marker, = drain(queue)
+        self.assertEqual(marker, ('Overflow', u''))
+        self.assertEqual(marker.watch_id, 7)
+        self.assertEqual(queue.collapsed, 6)
+        #the marker was consumed, the queue fills again.
+        queue.extend(added(2))
+        self.assertEqual(drain(queue), added(2))
+
+    def test_spill_keeps_the_order(self):
+        events = added(10) + [Event(ACTION_MOVED, u'b', u'a', 7),
+                              ('FileAdded', u'c')]
+        queue = BoundedEventQueue(max_events=3, policy=QUEUE_SPILL)
+        queue.extend(events[:8])
+        self.assertEqual(len(queue), 8)
+        self.assertEqual(queue.popleft(), events[0])
+        queue.extend(events[8:])
+        self.assertEqual(list(queue), events[1:])
+        out = drain(queue)
+        self.assertEqual(out, events[1:])
+        self.assertEqual(out[-2].old_path, u'a')
+        self.assertEqual(queue.spilled, 9)
+        self.assertEqual(len(queue._events), 0)
+
+    def test_spill_path_is_removed_on_close(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'spill')
+        queue = BoundedEventQueue(max_events=1, policy=QUEUE_SPILL,
+                                  spill_path=path)
+        queue.extend(added(3))
+        self.assertTrue(os.path.exists(path))
+        queue.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(len(queue), 0)
+
+    def test_invalid_policy_should_raise(self):
+        self.assertRaises(ValueError, BoundedEventQueue, 1, None, 'spin')
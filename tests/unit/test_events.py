@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from winwatcher import events
+from winwatcher.events import Event, ACTION_MOVED, ACTION_OVERFLOW
+from winwatcher.win32_constants import FILE_ACTION_ADDED
+
+
+class TestEventTestCase(TestCase):
+
+    def test_event_unpacks_like_a_tuple(self):
+        evt, name = Event(FILE_ACTION_ADDED, u'foo.bar')
+        self.assertEqual((evt, name), ('Added', u'foo.bar'))
+        evt, old, new = Event(ACTION_MOVED, u'new', u'old')
+        self.assertEqual((evt, old, new), ('Moved', u'old', u'new'))
+
+    def test_event_compares_with_tuples(self):
+        self.assertEqual(Event(ACTION_OVERFLOW, u''), ('Overflow', u''))
+        self.assertNotEqual(Event(FILE_ACTION_ADDED, u'a'), ('Added', u'b'))
+        self.assertIn(Event(FILE_ACTION_ADDED, u'a'), [('Added', u'a')])
+        self.assertEqual(len(Event(ACTION_MOVED, u'b', u'a')), 3)
+        self.assertEqual(Event(ACTION_MOVED, u'b', u'a')[1], u'a')
+
+    def test_directories_are_shared_between_events(self):
+        first = Event(FILE_ACTION_ADDED, u''.join([u'dir\\sub\\', u'foo']))
+        second = Event(FILE_ACTION_ADDED, u''.join([u'dir\\sub\\', u'bar']))
+        self.assertIs(first.directory, second.directory)
+        self.assertEqual(first.directory.path, u'dir\\sub')
+        self.assertEqual(first.path, u'dir\\sub\\foo')
+        self.assertEqual(second.path, u'dir\\sub\\bar')
+
+    def test_subdirectories_share_the_parent_node(self):
+        first = Event(FILE_ACTION_ADDED, u'dir\\a\\foo')
+        second = Event(ACTION_MOVED, u'dir\\b\\foo', u'dir\\a\\foo')
+        self.assertIs(first.directory.parent, second.directory.parent)
+        self.assertEqual(second.old_path, u'dir\\a\\foo')
+        self.assertEqual(Event(FILE_ACTION_ADDED, u'foo').path, u'foo')
+
+    def test_events_are_slotted(self):
+        self.assertRaises(AttributeError, setattr,
+                          Event(FILE_ACTION_ADDED, u'a'), 'other', 1)
+
+    def test_nodes_keep_their_directory(self):
+        node = Event(FILE_ACTION_ADDED, u'dir\\sub\\foo').directory
+        self.assertEqual(node.directory, u'dir\\sub')
+        self.assertEqual(node.parent.directory, u'dir')
+        self.assertEqual(node.join(u'bar'), u'dir\\sub\\bar')
+        self.assertEqual(Event(FILE_ACTION_ADDED, u'\\foo').path, u'\\foo')
+
+    def test_equal_events_hash_alike(self):
+        first = Event(ACTION_MOVED, u'dir\\b', u'dir\\a')
+        events._directory_nodes.clear()
+        events._child_nodes.clear()
+        second = Event(ACTION_MOVED, u'dir\\b', u'dir\\a')
+        self.assertIsNot(first.directory, second.directory)
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(len(set([first, second,
+                                  Event(ACTION_MOVED, u'dir\\a', u'dir\\b'),
+                                  Event(FILE_ACTION_ADDED, u'dir\\b')])), 3)
+        self.assertNotEqual(first, Event(ACTION_MOVED, u'dir\\b', u'dir\\c'))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import os
+import re
+import shutil
+import tempfile
+
+from winwatcher.filters import PathFilter
+from winwatcher.fs_tree import build_tree_state
+from winwatcher.notify_parser import (decode_notify_buffer,
+                                      encode_notify_records)
+from winwatcher.win32_constants import (FILE_ACTION_ADDED,
+                                        FILE_ACTION_MODIFIED,
+                                        FILE_ACTION_RENAMED_OLD_NAME,
+                                        FILE_ACTION_RENAMED_NEW_NAME)
+
+
+class TestPathFilterTestCase(TestCase):
+
+    def setUp(self):
+        self.path_filter = PathFilter(
+                exclude=[u'.git', u'node_modules', u'*.tmp', u'.*.sw?',
+                         u'build/out'],
+                exclude_regex=[re.compile(u'~$')])
+
+    def test_component_globs_match_anywhere(self):
+        excludes = self.path_filter.excludes
+        self.assertTrue(excludes(u'.git'))
+        self.assertTrue(excludes(u'src\\.git\\objects\\ab'))
+        self.assertTrue(excludes(u'web\\node_modules'))
+        self.assertTrue(excludes(u'a\\b\\c.TMP'))
+        self.assertTrue(excludes(u'src\\.main.py.swp'))
+        self.assertFalse(excludes(u'src\\main.py'))
+        self.assertFalse(excludes(u'.gitignore'))
+        self.assertFalse(excludes(u'my.tmp.py'))
+
+    def test_path_globs_match_from_the_root(self):
+        excludes = self.path_filter.excludes
+        self.assertTrue(excludes(u'build\\out\\a.o'))
+        self.assertFalse(excludes(u'src\\build\\out'))
+        self.assertFalse(excludes(u'build\\outside'))
+
+    def test_regexes_search_the_path(self):
+        self.assertTrue(self.path_filter.excludes(u'src\\main.py~'))
+
+    def test_includes_and_excludes(self):
+        path_filter = PathFilter(include=[u'*.py', u'docs'],
+                                 exclude=[u'test_*'])
+        self.assertTrue(path_filter.accepts(u'src\\main.py'))
+        self.assertTrue(path_filter.accepts(u'docs\\index.rst'))
+        self.assertFalse(path_filter.accepts(u'src\\main.c'))
+        self.assertFalse(path_filter.accepts(u'src\\test_main.py'))
+
+    def test_empty_filter_accepts_everything(self):
+        self.assertFalse(PathFilter())
+        self.assertTrue(PathFilter().accepts(u'a\\b'))
+
+
+class TestFilteredParserTestCase(TestCase):
+
+    def _decode(self, records):
+        path_filter = PathFilter(exclude=[u'.git', u'*.tmp'])
+        return decode_notify_buffer(encode_notify_records(records),
+                                    path_filter=path_filter)
+
+    def test_excluded_names_are_skipped(self):
+        out = self._decode([(FILE_ACTION_ADDED, u'.git\\index'),
+                            (FILE_ACTION_MODIFIED, u'a.py'),
+                            (FILE_ACTION_ADDED, u'b.tmp')])
+        self.assertListEqual(out, [('Modified', u'a.py')])
+
+    def test_renames_across_the_filter(self):
+        out = self._decode([(FILE_ACTION_RENAMED_OLD_NAME, u'a.tmp'),
+                            (FILE_ACTION_RENAMED_NEW_NAME, u'a.py'),
+                            (FILE_ACTION_RENAMED_OLD_NAME, u'b.py'),
+                            (FILE_ACTION_RENAMED_NEW_NAME, u'b.tmp'),
+                            (FILE_ACTION_RENAMED_OLD_NAME, u'c.tmp'),
+                            (FILE_ACTION_RENAMED_NEW_NAME, u'd.tmp')])
+        self.assertListEqual(out, [('Added', u'a.py'),
+                                   ('Removed', u'b.py')])
+
+
+class TestFilteredTreeTestCase(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp().decode('utf-8')
+        for directory in (u'src', u'src/.git', u'src/.git/objects',
+                          u'node_modules', u'node_modules/pkg'):
+            os.mkdir(os.path.join(self.path, directory))
+        for name in (u'src/a.py', u'src/a.tmp', u'src/.git/HEAD'):
+            open(os.path.join(self.path, name), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_excluded_subtrees_are_pruned(self):
+        path_filter = PathFilter(exclude=[u'.git', u'node_modules',
+                                          u'*.tmp'])
+        tree = build_tree_state(self.path, path_filter=path_filter)
+        self.assertEqual(sorted(tree), [u'', u'src'])
+        self.assertEqual(tree[u''].dirs, set([u'src']))
+        self.assertEqual(tree[u'src'].files, set([u'a.py']))
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import tempfile
+import shutil
+import os
+import threading
+import time
+
+from winwatcher.fs_tree import (build_tree_state, rescan_tree_state,
+                                move_subtree, remove_subtree,
+                                build_tree_state_parallel, TreeState,
+                                DirectoryState, index_is_dir,
+                                BackgroundTreeBuilder, rescan_directories)
+
+
+class TestTreeStateTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='winwatcher_').decode('utf-8')
+        os.makedirs(os.path.join(self.directory, u'a', u'b'))
+        self._touch(u'a', u'foo.txt')
+        self._touch(u'a', u'b', u'bar.txt')
+        self.tree = build_tree_state(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def _touch(self, *names):
+        open(self._path(*names), 'w').close()
+
+    def _age(self, *names):
+        #make sure the mtime differs from the one in the state.
+        os.utime(self._path(*names), (1, 1))
+
+    def test_build_tree_state(self):
+        self.assertEqual(sorted(self.tree), [u'', u'a', os.path.join(u'a', u'b')])
+        self.assertEqual(self.tree[u'a'].files, set([u'foo.txt']))
+        self.assertEqual(self.tree[u'a'].dirs, set([u'b']))
+
+    def test_scan_directory_uses_the_scandir_entry_types(self):
+        from winwatcher import fs_tree
+        self.assertIsNotNone(fs_tree.scandir)
+        def isdir(path):
+            raise AssertionError, "%s was stat'ed" % (path,)
+        real_isdir, real_lstat = os.path.isdir, os.lstat
+        os.path.isdir = os.lstat = isdir
+        try:
+            state = fs_tree.scan_directory(self.directory, u'a')
+        finally:
+            os.path.isdir, os.lstat = real_isdir, real_lstat
+        self.assertEqual(state.dirs, set([u'b']))
+        self.assertEqual(state.files, set([u'foo.txt']))
+
+    def test_build_tree_state_without_scandir(self):
+        from winwatcher import fs_tree
+        self.addCleanup(setattr, fs_tree, 'scandir', fs_tree.scandir)
+        fs_tree.scandir = None
+        tree = build_tree_state(self.directory)
+        self.assertEqual(sorted(tree), sorted(self.tree))
+        for relpath, state in self.tree.items():
+            self.assertEqual(tree[relpath].dirs, state.dirs)
+            self.assertEqual(tree[relpath].files, state.files)
+
+    def test_links_to_directories_are_not_walked(self):
+        from winwatcher import fs_tree
+        if not hasattr(os, 'symlink'):
+            self.skipTest("no symlinks")
+        os.symlink(u'..', os.path.join(self.directory, u'a', u'loop'))
+        self.addCleanup(setattr, fs_tree, 'scandir', fs_tree.scandir)
+        for scandir in (fs_tree.scandir, None):
+            fs_tree.scandir = scandir
+            tree = build_tree_state(self.directory)
+            self.assertEqual(sorted(tree), sorted(self.tree))
+            self.assertEqual(tree[u'a'].files, set([u'foo.txt', u'loop']))
+            self.assertEqual(rescan_tree_state(self.directory, tree), [])
+
+    def test_rescan_reports_added_and_removed_files(self):
+        os.remove(self._path(u'a', u'foo.txt'))
+        self._touch(u'a', u'new.txt')
+        self._age(u'a')
+        events = rescan_tree_state(self.directory, self.tree)
+        self.assertEqual(sorted(events),
+                         [('FileAdded', os.path.join(u'a', u'new.txt')),
+                          ('FileRemoved', os.path.join(u'a', u'foo.txt'))])
+        self.assertEqual(rescan_tree_state(self.directory, self.tree), [])
+
+    def test_rescan_reports_removed_subtree(self):
+        shutil.rmtree(self._path(u'a', u'b'))
+        self._age(u'a')
+        events = rescan_tree_state(self.directory, self.tree)
+        b = os.path.join(u'a', u'b')
+        self.assertEqual(events,
+                         [('FileRemoved', os.path.join(b, u'bar.txt')),
+                          ('DirectoryRemoved', b)])
+        self.assertNotIn(b, self.tree)
+
+    def test_rescan_reports_added_subtree(self):
+        os.makedirs(self._path(u'c', u'd'))
+        self._touch(u'c', u'd', u'x')
+        self._age(u'')
+        events = rescan_tree_state(self.directory, self.tree)
+        d = os.path.join(u'c', u'd')
+        self.assertEqual(events, [('DirectoryAdded', u'c'),
+                                  ('DirectoryAdded', d),
+                                  ('FileAdded', os.path.join(d, u'x'))])
+
+    def test_rescan_skips_directories_with_the_same_mtime(self):
+        os.utime(self._path(u'a'), (5, 5))
+        self.tree = build_tree_state(self.directory)
+        self._touch(u'a', u'hidden.txt')
+        os.utime(self._path(u'a'), (5, 5))
+        self.assertEqual(rescan_tree_state(self.directory, self.tree), [])
+
+    def test_rescan_directories_lists_only_them(self):
+        os.utime(self._path(u'a'), (5, 5))
+        self.tree = build_tree_state(self.directory)
+        self._touch(u'a', u'new.txt')
+        self._touch(u'a', u'b', u'below.txt')
+        os.makedirs(self._path(u'a', u'c'))
+        self._touch(u'a', u'c', u'x')
+        os.utime(self._path(u'a'), (5, 5))
+        c = os.path.join(u'a', u'c')
+        self.assertEqual(sorted(rescan_directories(self.directory, self.tree,
+                                                   [u'a', u'gone'])),
+                         [('DirectoryAdded', c),
+                          ('FileAdded', os.path.join(c, u'x')),
+                          ('FileAdded', os.path.join(u'a', u'new.txt'))])
+        b = os.path.join(u'a', u'b')
+        self.assertNotIn(u'below.txt', self.tree[b].files)
+
+    def test_index_is_dir(self):
+        self.assertTrue(index_is_dir(self.tree, os.path.join(u'a', u'b')))
+        self.assertFalse(index_is_dir(self.tree,
+                                      os.path.join(u'a', u'foo.txt')))
+        self.assertIsNone(index_is_dir(self.tree, os.path.join(u'a', u'new')))
+        self.assertIsNone(index_is_dir(self.tree,
+                                       os.path.join(u'x', u'foo.txt')))
+        #listed, but not scanned yet.
+        self.tree[u''].dirs.add(u'c')
+        self.assertTrue(index_is_dir(self.tree, u'c'))
+
+    def test_move_and_remove_subtree(self):
+        move_subtree(self.tree, u'a', u'z')
+        self.assertEqual(sorted(self.tree), [u'', u'z', os.path.join(u'z', u'b')])
+        self.assertIn(u'z', self.tree[u''].dirs)
+        remove_subtree(self.tree, u'z')
+        self.assertEqual(sorted(self.tree), [u''])
+        self.assertFalse(self.tree[u''].dirs)
+
+
+class TestTreeStateTrieTestCase(TestCase):
+
+    def setUp(self):
+        self.tree = TreeState()
+        for relpath in (u'', u'a', u'b', os.path.join(u'a', u'x'),
+                        os.path.join(u'a', u'x', u'y'),
+                        os.path.join(u'b', u'x')):
+            self.tree[relpath] = DirectoryState()
+
+    def test_used_like_a_dict(self):
+        tree = self.tree
+        self.assertEqual(len(tree), 6)
+        self.assertIn(os.path.join(u'a', u'x', u'y'), tree)
+        self.assertNotIn(os.path.join(u'a', u'z'), tree)
+        self.assertIsNone(tree.get(os.path.join(u'a', u'z', u'w')))
+        self.assertRaises(KeyError, tree.__getitem__, u'c')
+        self.assertEqual(len(tree.items()), 6)
+
+        state = tree[u'a']
+        tree[u'a'] = DirectoryState(5)
+        self.assertIsNot(tree[u'a'], state)
+        self.assertEqual(len(tree), 6)
+        self.assertIn(os.path.join(u'a', u'x', u'y'), tree)
+
+    def test_move_relinks_the_subtree(self):
+        y = self.tree[os.path.join(u'a', u'x', u'y')]
+        self.assertTrue(self.tree.move(u'a', u'c'))
+        self.assertIs(self.tree[os.path.join(u'c', u'x', u'y')], y)
+        self.assertNotIn(u'a', self.tree)
+        self.assertEqual(len(self.tree), 6)
+        self.assertFalse(self.tree.move(u'a', u'd'))
+
+    def test_move_replaces_the_target(self):
+        self.tree.move(u'a', u'b')
+        self.assertEqual(len(self.tree), 4)
+        self.assertIn(os.path.join(u'b', u'x', u'y'), self.tree)
+
+    def test_detach(self):
+        self.assertEqual(len(self.tree.detach(u'a')), 3)
+        self.assertEqual(sorted(self.tree),
+                         [u'', u'b', os.path.join(u'b', u'x')])
+        self.assertEqual(self.tree.detach(u'a'), [])
+
+    def test_directories_without_their_parents(self):
+        tree = TreeState()
+        tree[os.path.join(u'a', u'b')] = DirectoryState()
+        self.assertEqual(list(tree), [os.path.join(u'a', u'b')])
+        self.assertNotIn(u'a', tree)
+        self.assertNotIn(u'', tree)
+        tree[u''] = DirectoryState()
+        self.assertEqual(len(tree), 2)
+        self.assertIn(os.path.join(u'a', u'b'), tree)
+
+    def test_names_are_interned(self):
+        names = [name for name in self.tree[u'a'].children] + \
+                [name for name in self.tree[u'b'].children]
+        self.assertIs(names[0], names[1])
+
+
+class GeneratedTreeTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='winwatcher_').decode('utf-8')
+        for i in range(4):
+            for j in range(5):
+                leaf = os.path.join(self.directory, u'd%d' % i, u's%d' % j)
+                os.makedirs(leaf)
+                open(os.path.join(leaf, u'f.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _states(self, tree):
+        return dict((k, (sorted(s.dirs), sorted(s.files)))
+                    for k, s in tree.items())
+
+    def _patch_scan_directory(self, scan):
+        from winwatcher import fs_tree
+        self.addCleanup(setattr, fs_tree, 'scan_directory',
+                        fs_tree.scan_directory)
+        fs_tree.scan_directory = scan
+
+
+class TestParallelTreeStateTestCase(GeneratedTreeTestCase):
+
+    def test_parallel_build_matches_the_serial_one(self):
+        serial = build_tree_state(self.directory)
+        parallel = build_tree_state_parallel(self.directory, workers=3)
+        self.assertEqual(self._states(parallel), self._states(serial))
+
+    def test_build_a_list_of_directories(self):
+        tree = build_tree_state_parallel(self.directory, [u'd0', u'd2'],
+                                         workers=2)
+        self.assertEqual(len(tree), 12)
+        self.assertFalse(u'' in tree)
+        self.assertTrue(os.path.join(u'd2', u's4') in tree)
+
+    def test_progress_is_reported(self):
+        reports = []
+        build_tree_state_parallel(self.directory, workers=2,
+                                  progress=lambda *r: reports.append(r),
+                                  progress_interval=0)
+        self.assertEqual(reports[-1], (25, 20))
+
+    def test_errors_are_raised_in_the_caller(self):
+        from winwatcher import fs_tree
+        scan_directory = fs_tree.scan_directory
+
+        def failing_scan(path, relpath=u'', path_filter=None):
+            if relpath:
+                raise ValueError("broken")
+            return scan_directory(path, relpath, path_filter)
+
+        fs_tree.scan_directory = failing_scan
+        try:
+            self.assertRaises(ValueError, build_tree_state_parallel,
+                              self.directory, workers=2)
+        finally:
+            fs_tree.scan_directory = scan_directory
+
+    def test_cancel_stops_the_walk(self):
+        cancel = threading.Event()
+        cancel.set()
+        tree = build_tree_state_parallel(self.directory, workers=2,
+                                         cancel=cancel)
+        self.assertEqual(len(tree), 0)
+        tree = build_tree_state_parallel(self.directory, workers=1,
+                                         cancel=cancel)
+        self.assertEqual(len(tree), 0)
+
+
+class TestBackgroundTreeBuilderTestCase(GeneratedTreeTestCase):
+
+    def test_builds_the_tree_in_a_thread(self):
+        builder = BackgroundTreeBuilder(self.directory, workers=2)
+        self.assertFalse(builder.done)
+        builder.start()
+        self.assertTrue(builder.wait(10))
+        self.assertIsNone(builder.error)
+        self.assertEqual(self._states(builder.tree),
+                         self._states(build_tree_state(self.directory)))
+
+    def test_cancel(self):
+        from winwatcher.fs_tree import scan_directory
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_scan(path, relpath=u'', path_filter=None):
+            if relpath:
+                started.set()
+                release.wait(10)
+            return scan_directory(path, relpath, path_filter)
+
+        self._patch_scan_directory(slow_scan)
+        builder = BackgroundTreeBuilder(self.directory, workers=2)
+        builder.start()
+        self.assertTrue(started.wait(10))
+        cancelling = threading.Thread(target=builder.cancel)
+        cancelling.start()
+        while not builder.cancelled:
+            time.sleep(0.01)
+        release.set()
+        cancelling.join(10)
+        self.assertTrue(builder.done)
+        self.assertLess(len(builder.tree), 25)
+
+    def test_errors_are_kept(self):
+        def failing_scan(path, relpath=u'', path_filter=None):
+            raise ValueError("broken")
+
+        self._patch_scan_directory(failing_scan)
+        builder = BackgroundTreeBuilder(self.directory, workers=2)
+        builder.start()
+        self.assertTrue(builder.wait(10))
+        self.assertIsInstance(builder.error, ValueError)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import shutil
+import tempfile
+import threading
+import time
+
+from winwatcher.errors import TimeoutError, WaitForMultipleObjectsError
+from winwatcher.manager import WatchManager
+from winwatcher.object_watcher import BACKEND_WFMO, BACKEND_IOCP
+from winwatcher.simkernel import SimulatedKernel
+from winwatcher.win32_constants import (FILE_ACTION_ADDED,
+                                        FILE_ACTION_MODIFIED)
+
+
+class TestWatchManagerTestCase(TestCase):
+
+    def setUp(self):
+        self.roots = [tempfile.mkdtemp().decode('ascii') for i in range(2)]
+        self.manager = WatchManager(backend=BACKEND_IOCP,
+                                    kernel=SimulatedKernel())
+
+    def tearDown(self):
+        self.manager.close()
+        for root in self.roots:
+            shutil.rmtree(root)
+
+    def _queue(self, watcher, changes):
+        watcher._kernel.queue_changes(watcher._file_handle, changes)
+
+    def test_events_are_tagged_with_their_root(self):
+        watchers = [self.manager.add_root(root) for root in self.roots]
+        self._queue(watchers[1], [(FILE_ACTION_ADDED, u'b')])
+        root, event = self.manager.pool(1)
+        self.assertEqual(root, self.roots[1])
+        self.assertEqual(tuple(event), ('Added', u'b'))
+
+    def test_roots_are_served_in_turn(self):
+        watchers = [self.manager.add_root(root) for root in self.roots]
+        for watcher in watchers:
+            self._queue(watcher, [(FILE_ACTION_ADDED, u'a'),
+                                  (FILE_ACTION_ADDED, u'b')])
+        #both completions taken, the roots alternate.
+        self.manager._fetch_events(1)
+        self.manager._fetch_events(1)
+        out = [self.manager.pool(0) for i in range(4)]
+        roots = [root for root, event in out]
+        self.assertEqual(roots[:2], roots[2:])
+        self.assertEqual(sorted(roots[:2]), sorted(self.roots))
+        self.assertEqual([event.path for root, event in out],
+                         [u'a', u'a', u'b', u'b'])
+        self.assertRaises(TimeoutError, self.manager.pool, 0.05)
+
+    def test_the_watcher_options_are_used(self):
+        coalescing = self.manager.add_root(self.roots[0],
+                                           coalesce_window=0.05)
+        bounded = self.manager.add_root(self.roots[1], max_queued_events=2)
+        self._queue(coalescing, [(FILE_ACTION_MODIFIED, u'a')] * 3)
+        self._queue(bounded, [(FILE_ACTION_ADDED, u'f%d' % i)
+                              for i in range(5)])
+        out = [(root, tuple(event))
+               for root, event in self.manager.iter_events(0.2)]
+        self.assertEqual(sorted(out),
+                         sorted([(self.roots[0], ('Modified', u'a')),
+                                 (self.roots[1], ('Added', u'f3')),
+                                 (self.roots[1], ('Added', u'f4'))]))
+        self.assertEqual(bounded.queue_counters['dropped'], 3)
+        self.assertEqual(coalescing.stats()['latency']['count'], 1)
+
+    def test_due_coalesced_events_on_a_zero_timeout(self):
+        coalescing = self.manager.add_root(self.roots[0],
+                                           coalesce_window=0.05)
+        self._queue(coalescing, [(FILE_ACTION_MODIFIED, u'a')] * 2)
+        self.assertRaises(TimeoutError, self.manager.pool, 0.01)
+        time.sleep(0.06)
+        root, event = self.manager.pool(0)
+        self.assertEqual((root, tuple(event)),
+                         (self.roots[0], ('Modified', u'a')))
+        self.assertRaises(TimeoutError, self.manager.pool, 0)
+
+
+class TestWatchManagerWFMOTestCase(TestCase):
+
+    def setUp(self):
+        self.roots = [tempfile.mkdtemp().decode('ascii') for i in range(3)]
+        self.kernel = SimulatedKernel()
+        self.manager = WatchManager(backend=BACKEND_WFMO, kernel=self.kernel)
+
+    def tearDown(self):
+        self.manager.close()
+        for root in self.roots:
+            shutil.rmtree(root)
+
+    def test_add_remove_and_pool(self):
+        failures = []
+        wait = self.kernel.WaitForMultipleObjects
+
+        def checked_wait(handles, timeout):
+            try:
+                return wait(handles, timeout)
+            except WaitForMultipleObjectsError, error:
+                failures.append(error)
+                raise
+
+        self.kernel.WaitForMultipleObjects = checked_wait
+        watchers = [self.manager.add_root(root) for root in self.roots]
+        out = []
+        pooling = threading.Thread(
+                target=lambda: out.append(self.manager.pool(5)))
+        pooling.start()
+        #removed while the worker waits for its handle.
+        time.sleep(0.02)
+        self.manager.remove_root(self.roots[1])
+        self.assertFalse(self.roots[1] in self.manager)
+        self.assertEqual(watchers[1]._handle, None)
+        self.kernel.queue_changes(watchers[2]._file_handle,
+                                  [(FILE_ACTION_ADDED, u'c')])
+        pooling.join()
+        root, event = out[0]
+        self.assertEqual((root, tuple(event)),
+                         (self.roots[2], ('Added', u'c')))
+        self.assertEqual(failures, [])
+
+        #added back, it is reported again.
+        watcher = self.manager.add_root(self.roots[1])
+        self.kernel.queue_changes(watcher._file_handle,
+                                  [(FILE_ACTION_ADDED, u'b')])
+        root, event = self.manager.pool(1)
+        self.assertEqual((root, tuple(event)),
+                         (self.roots[1], ('Added', u'b')))
+        self.assertRaises(TimeoutError, self.manager.pool, 0.05)
+        self.assertEqual(len(self.manager._pool._groups), 1)
+        self.assertEqual(failures, [])
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import threading
+
+from winwatcher.events import Event, ACTION_OVERFLOW, monotonic
+from winwatcher.metrics import WatcherMetrics, StatsReporter
+from winwatcher.win32_constants import FILE_ACTION_ADDED, FILE_ACTION_REMOVED
+
+
+class TestWatcherMetricsTestCase(TestCase):
+
+    def setUp(self):
+        self.metrics = WatcherMetrics(buckets=(0.01, 1.0))
+
+    def test_completions_and_events_by_action(self):
+        metrics = self.metrics
+        metrics.wakes += 1
+        metrics.record_completion(512, 1024, [Event(FILE_ACTION_ADDED, u'a'),
+                                              Event(FILE_ACTION_ADDED, u'b')])
+        metrics.record_completion(256, 1024,
+                                  [Event(FILE_ACTION_REMOVED, u'a')])
+        metrics.record_completion(0, 1024, [Event(ACTION_OVERFLOW, u'')])
+        stats = metrics.snapshot()
+        self.assertEqual(stats['events'],
+                         {'Added': 2, 'Removed': 1, 'Overflow': 1})
+        self.assertEqual(stats['completions'], 3)
+        self.assertEqual(stats['completions_per_wake'], 3.0)
+        self.assertAlmostEqual(stats['buffer_fill']['average'], 0.25)
+        self.assertEqual(stats['buffer_fill']['max'], 0.5)
+        self.assertTrue(stats['events_per_second']['Added'] > 0)
+
+    def test_latency_histogram(self):
+        now = monotonic()
+        events = [Event(FILE_ACTION_ADDED, u'a', timestamp=now),
+                  Event(FILE_ACTION_ADDED, u'b', timestamp=now - 0.5),
+                  Event(FILE_ACTION_ADDED, u'c', timestamp=now - 10),
+                  ('FileAdded', u'd')]
+        self.metrics.record_delivery(events)
+        latency = self.metrics.snapshot()['latency']
+        self.assertEqual(latency['count'], 3)
+        self.assertEqual(latency['histogram'],
+                         [(0.01, 1), (1.0, 1), (None, 1)])
+        self.assertTrue(latency['max'] >= 10)
+
+    def test_rates_since_a_previous_snapshot(self):
+        metrics = self.metrics
+        metrics.record_completion(10, 100, [Event(FILE_ACTION_ADDED, u'a')])
+        previous = metrics.snapshot()
+        stats = metrics.snapshot(previous)
+        self.assertEqual(stats['events']['Added'], 1)
+        self.assertEqual(stats['events_per_second']['Added'], 0)
+
+
+class TestStatsReporterTestCase(TestCase):
+
+    def test_reports_every_interval(self):
+        metrics = WatcherMetrics()
+        reports = []
+        reported = threading.Event()
+
+        def callback(stats):
+            reports.append(stats)
+            if len(reports) == 2:
+                reported.set()
+            raise ValueError("broken callback")
+
+        reporter = StatsReporter(metrics.snapshot, callback, 0.01).start()
+        self.addCleanup(reporter.stop)
+        self.assertTrue(reported.wait(10))
+        reporter.stop()
+        self.assertTrue(reporter.errors >= 2)
+        self.assertTrue(reports[1]['time'] > reports[0]['time'])
+
+    def test_stats_errors_dont_stop_the_reports(self):
+        metrics = WatcherMetrics()
+        calls = []
+        reports = []
+        reported = threading.Event()
+
+        def stats(previous=None):
+            calls.append(previous)
+            #the first call comes from start, the next three fail.
+            if 2 <= len(calls) <= 4:
+                raise RuntimeError("not watching")
+            return metrics.snapshot(previous)
+
+        def callback(stats):
+            reports.append(stats)
+            reported.set()
+
+        reporter = StatsReporter(stats, callback, 0.01).start()
+        self.addCleanup(reporter.stop)
+        self.assertTrue(reported.wait(10))
+        reporter.stop()
+        self.assertEqual(reporter.errors, 3)
+        #the first report is still since the snapshot taken by start.
+        self.assertTrue(calls[4] is calls[1])
+        self.assertTrue(calls[1] is not None)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from winwatcher.errors import IoIncompleteError
+from winwatcher.notify_buffers import NotifyBufferRing
+from winwatcher.notify_parser import decode_notify_buffer
+from winwatcher.simkernel import SimulatedKernel
+from winwatcher.win32_constants import (FILE_ACTION_ADDED,
+                                        FILE_ACTION_MODIFIED)
+
+
+class TestNotifyBufferRingTestCase(TestCase):
+
+    def setUp(self):
+        self.kernel = SimulatedKernel()
+        self.handle = self.kernel.CreateFileDirectory(u'c:\\sim')
+
+    def _ring(self, count):
+        ring = NotifyBufferRing(self.kernel, self.handle, True, 0, count)
+        ring.arm()
+        return ring
+
+    def test_next_read_is_issued_before_the_buffer_is_returned(self):
+        ring = self._ring(2)
+        self.kernel.queue_changes(self.handle, [(FILE_ACTION_ADDED, u'a')])
+        buf, nbytes = ring.complete()
+        self.assertEqual(self.kernel.reads, 2)
+        #changes arriving while the caller parses land on the other buffer.
+        self.kernel.queue_changes(self.handle, [(FILE_ACTION_ADDED, u'b')])
+        self.assertListEqual(decode_notify_buffer(buf, nbytes),
+                             [('Added', u'a')])
+        buf2, nbytes2 = ring.complete()
+        self.assertIsNot(buf, buf2)
+        self.assertListEqual(decode_notify_buffer(buf2, nbytes2),
+                             [('Added', u'b')])
+
+    def test_buffers_rotate(self):
+        ring = self._ring(3)
+        seen = []
+        for i in range(6):
+            self.kernel.queue_changes(self.handle,
+                                      [(FILE_ACTION_MODIFIED, u'f%d' % i)])
+            buf, nbytes = ring.complete()
+            seen.append(id(buf))
+            self.assertListEqual(decode_notify_buffer(buf, nbytes),
+                                 [('Modified', u'f%d' % i)])
+        self.assertEqual(len(set(seen)), 3)
+        self.assertEqual(seen[:3], seen[3:])
+
+    def test_single_buffer_waits_for_arm(self):
+        ring = self._ring(1)
+        self.kernel.queue_changes(self.handle, [(FILE_ACTION_ADDED, u'a')])
+        ring.complete()
+        self.assertEqual(self.kernel.reads, 1)
+        ring.arm()
+        self.assertEqual(self.kernel.reads, 2)
+
+    def test_complete_without_wait_raises_when_pending(self):
+        ring = self._ring(2)
+        self.assertRaises(IoIncompleteError, ring.complete, False)
+
+    def test_close_releases_events(self):
+        ring = self._ring(2)
+        ring.close()
+        self.assertFalse(self.kernel._events)
+
+
+class TestNotifyBufferSizingTestCase(TestCase):
+
+    def setUp(self):
+        self.kernel = SimulatedKernel()
+        self.path = u'c:\\sim'
+        self.handle = self.kernel.CreateFileDirectory(self.path)
+        self.handles = [self.handle]
+        self.ring = NotifyBufferRing(self.kernel, self.handle, True, 0,
+                                     2, 1024, 4096, self._reopen)
+        self.ring.arm()
+
+    def _reopen(self, handle):
+        self.assertEqual(handle, self.handles[-1])
+        self.kernel.CloseHandle(handle)
+        self.handles.append(self.kernel.CreateFileDirectory(self.path))
+        return self.handles[-1]
+
+    def _changes(self, count):
+        return [(FILE_ACTION_ADDED, u'file%04d' % i) for i in range(count)]
+
+    def test_overflow_completion_grows_buffers_up_to_max_size(self):
+        for size in (2048, 4096, 4096):
+            self.kernel.queue_overflow(self.handles[-1])
+            buf, nbytes = self.ring.complete()
+            self.assertEqual(nbytes, 0)
+            self.assertEqual(self.ring.size, size)
+        self.assertEqual(self.ring.overflows, 3)
+        #not reopened once max_size is reached.
+        self.assertEqual(len(self.handles), 3)
+
+    def test_changes_not_fitting_the_buffer_are_an_overflow(self):
+        self.kernel.queue_changes(self.handle, self._changes(100))
+        buf, nbytes = self.ring.complete()
+        self.assertEqual(nbytes, 0)
+        self.assertEqual(self.ring.overflows, 1)
+
+    def test_the_grown_buffers_read_a_new_handle(self):
+        self.kernel.queue_changes(self.handle, self._changes(40))
+        self.assertEqual(self.ring.complete()[1], 0)
+        handle = self.handles[-1]
+        self.assertNotEqual(handle, self.handle)
+        #the first read of the new handle sizes its kernel buffer.
+        self.kernel.queue_changes(handle, self._changes(40))
+        buf, nbytes = self.ring.complete()
+        self.assertEqual(len(buf), 2048)
+        self.assertEqual(len(decode_notify_buffer(buf, nbytes)), 40)
+        self.assertEqual(self.ring.size, 2048)
+
+    def test_the_kernel_keeps_the_size_of_the_first_read(self):
+        handle = self.kernel.CreateFileDirectory(u'c:\\other')
+        ring = NotifyBufferRing(self.kernel, handle, True, 0, 1, 1024, 4096)
+        ring.arm()
+        self.kernel.queue_changes(handle, [(FILE_ACTION_ADDED, u'a')])
+        ring.complete()
+        #a bigger user buffer on the same handle doesn't help.
+        ring.size = 4096
+        ring.arm()
+        self.kernel.queue_changes(handle, self._changes(40))
+        buf, nbytes = ring.complete()
+        self.assertEqual((len(buf), nbytes), (4096, 0))
+        #without reopen the size is fixed.
+        self.assertEqual(ring.size, 4096)
+        self.assertEqual(ring.overflows, 1)
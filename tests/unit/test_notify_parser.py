@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from ctypes import create_string_buffer
+
+from winwatcher.notify_parser import (decode_notify_buffer,
+                                      encode_notify_records)
+from winwatcher.win32_constants import (FILE_ACTION_ADDED,
+                                        FILE_ACTION_REMOVED,
+                                        FILE_ACTION_MODIFIED,
+                                        FILE_ACTION_RENAMED_OLD_NAME,
+                                        FILE_ACTION_RENAMED_NEW_NAME)
+
+
+class TestNotifyParserTestCase(TestCase):
+
+    def test_decode_simple_actions(self):
+        data = encode_notify_records([(FILE_ACTION_ADDED, u'foo.bar'),
+                                      (FILE_ACTION_MODIFIED, u'foo.bar'),
+                                      (FILE_ACTION_REMOVED, u'foo.bar')])
+        self.assertListEqual(decode_notify_buffer(data),
+                             [('Added', u'foo.bar'),
+                              ('Modified', u'foo.bar'),
+                              ('Removed', u'foo.bar')])
+
+    def test_decode_rename_pair_as_moved(self):
+        data = encode_notify_records([(FILE_ACTION_RENAMED_OLD_NAME, u'a'),
+                                      (FILE_ACTION_RENAMED_NEW_NAME, u'b')])
+        self.assertListEqual(decode_notify_buffer(data),
+                             [('Moved', u'a', u'b')])
+
+    def test_decode_from_ctypes_buffer_respects_nbytes(self):
+        data = encode_notify_records([(FILE_ACTION_ADDED, u'dir\\ção.txt')])
+        buf = create_string_buffer(8192)
+        buf[:len(data)] = data
+        self.assertListEqual(decode_notify_buffer(buf, len(data)),
+                             [('Added', u'dir\\ção.txt')])
+
+    def test_decode_empty_completion(self):
+        buf = create_string_buffer(8192)
+        self.assertListEqual(decode_notify_buffer(buf, 0), [])
+
+    def test_decode_full_buffer(self):
+        records = [(FILE_ACTION_MODIFIED, u'file%04d' % i)
+                   for i in range(300)]
+        data = encode_notify_records(records)
+        out = decode_notify_buffer(data)
+        self.assertEqual(len(out), 300)
+        self.assertEqual(out[-1], ('Modified', u'file0299'))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from winwatcher.errors import TimeoutError
+from winwatcher.event_queue import QUEUE_SPILL
+from winwatcher import object_watcher
+from winwatcher.object_watcher import (WinDirectoryWatcher, BACKEND_WFMO,
+                                       BACKEND_IOCP)
+from winwatcher.simkernel import SimulatedKernel
+from winwatcher.win32_constants import (FILE_ACTION_ADDED,
+                                        FILE_ACTION_MODIFIED)
+
+
+class TestWinDirectoryWatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp().decode('ascii')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _events(self, backend):
+        watcher = WinDirectoryWatcher(self.path, kernel=SimulatedKernel(),
+                                      backend=backend)
+        watcher.start_watching()
+        try:
+            #queued before the first pool, the completion isn't lost.
+            watcher._kernel.queue_changes(watcher._file_handle,
+                                          [(FILE_ACTION_ADDED, u'a'),
+                                           (FILE_ACTION_MODIFIED, u'a')])
+            events = [watcher.pool(1), watcher.pool(1)]
+            self.assertRaises(TimeoutError, watcher.pool, 0)
+        finally:
+            watcher.stop_watching()
+        return [tuple(e) for e in events]
+
+    def test_wfmo_backend_on_the_simulated_kernel(self):
+        self.assertEqual(self._events(BACKEND_WFMO),
+                         [('Added', u'a'), ('Modified', u'a')])
+
+    def test_iocp_backend_on_the_simulated_kernel(self):
+        self.assertEqual(self._events(BACKEND_IOCP),
+                         [('Added', u'a'), ('Modified', u'a')])
+
+    def _watch(self, **options):
+        watcher = WinDirectoryWatcher(self.path, kernel=SimulatedKernel(),
+                                      **options)
+        watcher.start_watching()
+        self.addCleanup(watcher.stop_watching)
+        return watcher
+
+    def _queue(self, watcher, *names):
+        watcher._kernel.queue_changes(watcher._file_handle,
+                                      [(FILE_ACTION_ADDED, n) for n in names])
+
+    def _paths(self, events):
+        return [event.path for event in events]
+
+    def test_pool_batch_takes_up_to_max_events(self):
+        watcher = self._watch()
+        self._queue(watcher, u'a', u'b', u'c', u'd', u'e')
+        self.assertEqual(self._paths(watcher.pool_batch(2, 1)), [u'a', u'b'])
+        self.assertEqual(self._paths(watcher.pool_batch(None, 1)),
+                         [u'c', u'd', u'e'])
+        self.assertRaises(TimeoutError, watcher.pool_batch, None, 0.05)
+
+    def test_pool_batch_drains_the_signaled_completions(self):
+        watcher = self._watch()
+        self._queue(watcher, u'a')
+        #completes the next read once the first is taken.
+        self._queue(watcher, u'b')
+        self.assertEqual(self._paths(watcher.pool_batch(None, 1)),
+                         [u'a', u'b'])
+        self.assertEqual(watcher.stats()['completions'], 2)
+        self.assertEqual(watcher.stats()['wakes'], 1)
+
+    def test_pool_batch_drains_up_to_max_completions(self):
+        self.addCleanup(setattr, object_watcher, 'MAX_COMPLETIONS_PER_BATCH',
+                        object_watcher.MAX_COMPLETIONS_PER_BATCH)
+        object_watcher.MAX_COMPLETIONS_PER_BATCH = 0
+        watcher = self._watch()
+        self._queue(watcher, u'a')
+        self._queue(watcher, u'b')
+        self.assertEqual(self._paths(watcher.pool_batch(None, 1)), [u'a'])
+        self.assertEqual(self._paths(watcher.pool_batch(None, 1)), [u'b'])
+
+    def test_iter_events_ends_after_timeout(self):
+        watcher = self._watch(backend=BACKEND_IOCP)
+        self._queue(watcher, u'a', u'b')
+        self._queue(watcher, u'c')
+        self.assertEqual(self._paths(watcher.iter_events(0.05)),
+                         [u'a', u'b', u'c'])
+        self.assertEqual(list(watcher.iter_events(0)), [])
+
+    def test_an_overflow_reopens_the_directory_with_bigger_buffers(self):
+        changes = [(FILE_ACTION_ADDED, u'file%04d' % i) for i in range(40)]
+        for backend in (BACKEND_WFMO, BACKEND_IOCP):
+            watcher = self._watch(backend=backend, buffer_size=1024,
+                                  max_buffer_size=4096)
+            first = watcher._file_handle
+            watcher._kernel.queue_changes(first, changes)
+            self.assertEqual(tuple(watcher.pool(1)), ('Overflow', u''))
+            self.assertNotEqual(watcher._file_handle, first)
+            watcher._kernel.queue_changes(watcher._file_handle, changes)
+            self.assertEqual(len(watcher.pool_batch(None, 1)), 40)
+            self.assertEqual(watcher.overflows, 1)
+
+    def test_stop_flushes_the_coalescer_and_keeps_it(self):
+        watcher = WinDirectoryWatcher(self.path, kernel=SimulatedKernel(),
+                                      coalesce_window=60)
+        coalescer = watcher._coalescer
+        watcher.start_watching()
+        try:
+            watcher._kernel.queue_changes(watcher._file_handle,
+                                          [(FILE_ACTION_MODIFIED, u'a')] * 3)
+            #held by the coalescer for the window.
+            self.assertRaises(TimeoutError, watcher.pool, 0.1)
+        finally:
+            watcher.stop_watching()
+        self.assertIs(watcher._coalescer, coalescer)
+        self.assertEqual([tuple(e) for e in watcher._queued_results],
+                         [('Modified', u'a')])
+
+        watcher.start_watching()
+        watcher.stop_watching()
+        self.assertIs(watcher._coalescer, coalescer)
+
+    def test_due_coalesced_events_without_a_completion(self):
+        for take in (lambda w: [w.pool(0)],
+                     lambda w: w.pool_batch(None, 0),
+                     lambda w: list(w.iter_events(0))):
+            watcher = self._watch(coalesce_window=0.05)
+            watcher._kernel.queue_changes(watcher._file_handle,
+                                          [(FILE_ACTION_MODIFIED, u'a')] * 2)
+            self.assertRaises(TimeoutError, watcher.pool, 0.01)
+            time.sleep(0.06)
+            #nothing completes, the held event is due.
+            self.assertEqual([tuple(e) for e in take(watcher)],
+                             [('Modified', u'a')])
+            self.assertRaises(TimeoutError, watcher.pool, 0)
+
+    def test_held_completions_keep_the_timeout(self):
+        watcher = self._watch(coalesce_window=60)
+        queue = lambda: watcher._kernel.queue_changes(
+                watcher._file_handle, [(FILE_ACTION_MODIFIED, u'a')])
+        timer = threading.Timer(0.1, queue)
+        timer.start()
+        self.addCleanup(timer.join)
+        started = time.time()
+        #the completion in the middle of the wait doesn't restart it.
+        self.assertRaises(TimeoutError, watcher.pool, 0.2)
+        self.assertTrue(time.time() - started < 0.3)
+        self.assertEqual(watcher.stats()['completions'], 1)
+
+    def test_stop_removes_the_spill_file(self):
+        spill_path = os.path.join(self.path, u'spill')
+        watcher = WinDirectoryWatcher(self.path, kernel=SimulatedKernel(),
+                                      max_queued_events=1,
+                                      queue_policy=QUEUE_SPILL,
+                                      spill_path=spill_path)
+        watcher.start_watching()
+        try:
+            watcher._kernel.queue_changes(watcher._file_handle,
+                                          [(FILE_ACTION_ADDED, u'a'),
+                                           (FILE_ACTION_ADDED, u'b')])
+            self.assertEqual(tuple(watcher.pool(1)), ('Added', u'a'))
+            self.assertTrue(os.path.exists(spill_path))
+        finally:
+            watcher.stop_watching()
+        self.assertFalse(os.path.exists(spill_path))
+        self.assertEqual(len(watcher._queued_results), 0)
+
+        #spills again after a restart.
+        watcher.start_watching()
+        try:
+            watcher._kernel.queue_changes(watcher._file_handle,
+                                          [(FILE_ACTION_ADDED, u'c'),
+                                           (FILE_ACTION_ADDED, u'd')])
+            self.assertEqual([tuple(watcher.pool(1)) for i in range(2)],
+                             [('Added', u'c'), ('Added', u'd')])
+        finally:
+            watcher.stop_watching()
+        self.assertFalse(os.path.exists(spill_path))
+
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import tempfile
+import shutil
+import os
+
+from winwatcher.filters import PathFilter
+from winwatcher.fs_tree import build_tree_state, rescan_tree_state
+from winwatcher.snapshot import (save_snapshot, load_snapshot,
+                                 encode_snapshot, decode_snapshot,
+                                 SnapshotError)
+
+
+class TestSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='winwatcher_').decode('utf-8')
+        os.makedirs(os.path.join(self.directory, u'a', u'b'))
+        self._touch(u'a', u'foo.txt')
+        self._touch(u'a', u'b', u'bar.txt')
+        self.tree = build_tree_state(self.directory)
+        self.snapshot_path = os.path.join(tempfile.mkdtemp(), 'tree.snapshot')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.snapshot_path))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def _touch(self, *names):
+        open(self._path(*names), 'w').close()
+
+    def _assert_same_tree(self, tree):
+        self.assertEqual(sorted(tree), sorted(self.tree))
+        for relpath, state in self.tree.iteritems():
+            self.assertEqual(tree[relpath].mtime, state.mtime)
+            self.assertEqual(tree[relpath].dirs, state.dirs)
+            self.assertEqual(tree[relpath].files, state.files)
+
+    def test_save_and_load(self):
+        self.tree[u'a'].mtime = None
+        save_snapshot(self.snapshot_path, self.tree, self.directory)
+        self._assert_same_tree(load_snapshot(self.snapshot_path,
+                                             self.directory))
+        #saving again replaces it.
+        save_snapshot(self.snapshot_path, self.tree, self.directory)
+        self._assert_same_tree(load_snapshot(self.snapshot_path))
+
+    def test_unicode_names(self):
+        self.tree[u''].files.add(u'caf\xe9.txt')
+        data = encode_snapshot(self.tree, self.directory)
+        self._assert_same_tree(decode_snapshot(data, self.directory))
+
+    def test_missing_snapshot(self):
+        self.assertIsNone(load_snapshot(self.snapshot_path, self.directory))
+
+    def test_rejects_another_root_or_filter(self):
+        save_snapshot(self.snapshot_path, self.tree, self.directory)
+        self.assertRaises(SnapshotError, load_snapshot, self.snapshot_path,
+                          self._path(u'a'))
+        self.assertRaises(SnapshotError, load_snapshot, self.snapshot_path,
+                          self.directory, PathFilter(exclude=[u'*.tmp']))
+
+        path_filter = PathFilter(exclude=[u'*.tmp'])
+        data = encode_snapshot(self.tree, self.directory, path_filter)
+        decode_snapshot(data, self.directory, PathFilter(exclude=[u'*.tmp']))
+
+    def test_rejects_corrupted_snapshots(self):
+        data = encode_snapshot(self.tree, self.directory)
+        for corrupted in ('', 'XXXX' + data[4:], data[:-3], data + 'x'):
+            self.assertRaises(SnapshotError, decode_snapshot, corrupted)
+        open(self.snapshot_path, 'wb').close()
+        self.assertRaises(SnapshotError, load_snapshot, self.snapshot_path)
+
+    def test_diff_reports_the_missed_changes(self):
+        save_snapshot(self.snapshot_path, self.tree, self.directory)
+        os.remove(self._path(u'a', u'foo.txt'))
+        os.mkdir(self._path(u'a', u'new'))
+        self._touch(u'a', u'new', u'baz.txt')
+        os.utime(self._path(u'a'), (1, 1))
+
+        tree = load_snapshot(self.snapshot_path, self.directory)
+        events = rescan_tree_state(self.directory, tree)
+        new = os.path.join(u'a', u'new')
+        self.assertEqual(sorted(events),
+                         [('DirectoryAdded', new),
+                          ('FileAdded', os.path.join(new, u'baz.txt')),
+                          ('FileRemoved', os.path.join(u'a', u'foo.txt'))])
+        self.assertEqual(tree[new].files, set([u'baz.txt']))
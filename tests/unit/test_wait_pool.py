@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import threading
+
+from winwatcher.errors import TimeoutError, WaitForMultipleObjectsError
+from winwatcher.simkernel import SimulatedKernel
+from winwatcher.wait_pool import WaitPool
+from winwatcher.win32_constants import FILE_ACTION_ADDED, WAIT_INFINITE
+
+
+class TestWaitPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.kernel = SimulatedKernel()
+        self.pool = WaitPool(self.kernel)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def _watch(self, number):
+        directories = []
+        for i in range(number):
+            path = u'c:\\sim%d' % i
+            directory = self.kernel.CreateFileDirectory(path)
+            handle = self.kernel.FindFirstChangeNotification(path, 0, True)
+            self.pool.register_handle(handle)
+            directories.append((directory, handle))
+        return directories
+
+    def test_empty_pool_should_raise(self):
+        self.assertRaises(WaitForMultipleObjectsError, self.pool.pool)
+        self.assertRaises(TimeoutError, self.pool.pool, 1)
+
+    def test_pool_should_timeout_without_changes(self):
+        self._watch(1)
+        self.assertRaises(TimeoutError, self.pool.pool, 0)
+        self.assertRaises(TimeoutError, self.pool.pool, 0.05)
+
+    def test_zero_timeout_should_see_signaled_handles(self):
+        (directory, handle), = self._watch(1)
+        self.kernel.queue_changes(directory, [(FILE_ACTION_ADDED, u'a')])
+        self.assertEqual(self.pool.pool(0), handle)
+
+    def test_workers_are_reused_between_pools(self):
+        directories = self._watch(130)
+        for directory, handle in directories:
+            self.kernel.queue_changes(directory, [(FILE_ACTION_ADDED, u'a')])
+
+        threads = set()
+        out = []
+        for i in range(len(directories)):
+            handle = self.pool.pool(1)
+            self.kernel.FindNextChangeNotification(handle)
+            out.append(handle)
+            threads.update(w.thread for w in self.pool._groups)
+
+        self.assertEqual(sorted(out), sorted(h for d, h in directories))
+        self.assertEqual(len(threads), 3)
+        self.assertRaises(TimeoutError, self.pool.pool, 0.05)
+
+    def test_signaled_handle_is_reported_once_until_next_pool(self):
+        (directory, handle), = self._watch(1)
+        self.kernel.queue_changes(directory, [(FILE_ACTION_ADDED, u'a')])
+        self.assertEqual(self.pool.pool(1), handle)
+        self.assertEqual(self.pool._queue.qsize(), 0)
+        #not reset with FindNextChangeNotification, reported again.
+        self.assertEqual(self.pool.pool(1), handle)
+
+    def test_close_stops_the_workers(self):
+        self._watch(70)
+        self.assertRaises(TimeoutError, self.pool.pool, 0.01)
+        workers = [w.thread for w in self.pool._groups]
+        self.pool.close()
+        self.assertFalse([t for t in workers if t.is_alive()])
+        self.assertEqual(len(self.kernel._events), 70)
+
+    def test_unregister_only_wakes_the_group_of_the_handle(self):
+        directories = self._watch(70)
+        self.assertRaises(TimeoutError, self.pool.pool, 0.01)
+        first, second = self.pool._groups
+        self.kernel.ResetEvent(first.wake)
+        self.kernel.ResetEvent(second.wake)
+        calls = []
+        set_event = self.kernel.SetEvent
+        self.kernel.SetEvent = lambda h: calls.append(h) or set_event(h)
+        self.pool.unregister_handle(directories[65][1])
+        self.assertEqual(calls, [second.wake])
+
+    def _pool_error(self, timeout):
+        with self.assertRaises(WaitForMultipleObjectsError) as raised:
+            self.pool.pool(timeout)
+        self.assertNotIsInstance(raised.exception, TimeoutError)
+        return str(raised.exception)
+
+    def test_a_failed_wait_is_reported_and_the_worker_goes_on(self):
+        (directory, handle), = self._watch(1)
+        wait = self.kernel.WaitForMultipleObjects
+        failures = [WaitForMultipleObjectsError('kernel failure')]
+
+        def failing_wait(handles, timeout):
+            if failures and timeout == WAIT_INFINITE:
+                raise failures.pop()
+            return wait(handles, timeout)
+
+        self.kernel.WaitForMultipleObjects = failing_wait
+        self.assertTrue('kernel failure' in self._pool_error(1))
+        self.kernel.queue_changes(directory, [(FILE_ACTION_ADDED, u'a')])
+        self.assertEqual(self.pool.pool(1), handle)
+        self.assertEqual(self.pool.worker_threads, 1)
+
+    def test_a_closed_handle_is_dropped_from_its_group(self):
+        (bad_directory, bad), (directory, handle) = self._watch(2)
+        self.assertRaises(TimeoutError, self.pool.pool, 0.01)
+        #closed by its owner while it is registered.
+        self.kernel.CloseHandle(bad)
+        self.assertTrue(repr(bad) in self._pool_error(1))
+        self.kernel.queue_changes(directory, [(FILE_ACTION_ADDED, u'a')])
+        self.assertEqual(self.pool.pool(1), handle)
+        self.kernel.FindNextChangeNotification(handle)
+        self.pool.unregister_handle(bad)
+        self.assertRaises(TimeoutError, self.pool.pool, 0.05)
+
+    def test_emptied_group_is_dropped(self):
+        directories = self._watch(64)
+        self.assertRaises(TimeoutError, self.pool.pool, 0.01)
+        self.assertEqual(len(self.pool._groups), 2)
+        thread = self.pool._groups[1].thread
+        self.pool.unregister_handle(directories[63][1])
+        self.assertEqual(len(self.pool._groups), 1)
+        self.assertFalse(thread.is_alive())
+
+
+class TestFairWaitPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.kernel = SimulatedKernel()
+        self.pool = WaitPool(self.kernel, fair=True)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def _signaled(self, number):
+        handles = []
+        for i in range(number):
+            path = u'c:\\sim%d' % i
+            directory = self.kernel.CreateFileDirectory(path)
+            handle = self.kernel.FindFirstChangeNotification(path, 0, True)
+            self.pool.register_handle(handle)
+            #never reset, always signaled again.
+            self.kernel.queue_changes(directory, [(FILE_ACTION_ADDED, u'a')])
+            handles.append(handle)
+        return handles
+
+    def test_busy_handles_are_served_round_robin(self):
+        handles = self._signaled(4)
+        for i in range(4 * 10):
+            self.pool.pool(1)
+        counts = self.pool.service_counts()
+        self.assertEqual([counts[h] for h in handles], [10] * 4)
+
+    def test_weights_share_the_turns(self):
+        busy, quiet = self._signaled(2)
+        self.pool.set_weight(busy, 3)
+        for i in range(40):
+            self.pool.pool(1)
+        counts = self.pool.service_counts()
+        self.assertEqual(counts[busy] + counts[quiet], 40)
+        self.assertTrue(counts[busy] >= 2 * counts[quiet])
+        self.assertTrue(counts[quiet] >= 5)
+
+    def test_set_weight_should_check_the_handle(self):
+        self.assertRaises(WaitForMultipleObjectsError,
+                          self.pool.set_weight, 1, 2)
+        handle, = self._signaled(1)
+        self.assertRaises(ValueError, self.pool.set_weight, handle, 0)
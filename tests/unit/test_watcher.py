@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import threading
+
+from winwatcher import fs_tree, snapshot
+from winwatcher.errors import TimeoutError
+from winwatcher.event_queue import QUEUE_DROP_OLDEST, QUEUE_DROP_NEWEST
+from winwatcher.simkernel import SimulatedKernel
+from winwatcher.watcher import DirWatcher, DirWatcherError
+from winwatcher.win32_constants import (FILE_ACTION_ADDED,
+                                        FILE_ACTION_REMOVED)
+
+
+class DirWatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='winwatcher_').decode('utf-8')
+        os.mkdir(os.path.join(self.directory, u'a'))
+        self.watcher = None
+
+    def tearDown(self):
+        if self.watcher is not None and self.watcher._watching:
+            self.watcher.stop_watching()
+        shutil.rmtree(self.directory)
+
+    def _touch(self, *names):
+        open(os.path.join(self.directory, *names), 'w').close()
+
+    def _watch(self, **options):
+        options.setdefault('background_tree', False)
+        self.watcher = DirWatcher(self.directory, kernel=SimulatedKernel(),
+                                  **options)
+        self.watcher.start_watching()
+        return self.watcher
+
+    def _queue(self, changes):
+        watcher = self.watcher
+        watcher._kernel.queue_changes(watcher._file_handle, changes)
+
+
+class TestDirWatcherClassifyTestCase(DirWatcherTestCase):
+
+    def test_a_burst_is_classified_with_one_scan(self):
+        watcher = self._watch()
+        names = [os.path.join(u'a', u'f%d' % i) for i in range(6)]
+        os.mkdir(os.path.join(self.directory, u'a', u'sub'))
+        for name in names:
+            self._touch(name)
+        names.append(os.path.join(u'a', u'sub'))
+        self._queue([(FILE_ACTION_ADDED, name) for name in names])
+        events = watcher.observe_batch(None, 1)
+        self.assertEqual(events,
+                         [('FileAdded', name) for name in names[:-1]] +
+                         [('DirectoryAdded', names[-1])])
+        self.assertEqual(watcher.directory_scans, 1)
+        self.assertEqual(watcher.stat_calls, 0)
+
+
+class TestDirWatcherBatchTestCase(DirWatcherTestCase):
+
+    def _added(self, *names):
+        for name in names:
+            self._touch(u'a', name)
+        self._queue([(FILE_ACTION_ADDED, os.path.join(u'a', name))
+                      for name in names])
+
+    def test_observe_batch_takes_up_to_max_events(self):
+        watcher = self._watch()
+        self._added(u'x', u'y', u'z')
+        self.assertEqual(watcher.observe_batch(2, 1),
+                         [('FileAdded', os.path.join(u'a', u'x')),
+                          ('FileAdded', os.path.join(u'a', u'y'))])
+        self.assertEqual(watcher.observe_batch(None, 1),
+                         [('FileAdded', os.path.join(u'a', u'z'))])
+        self.assertRaises(TimeoutError, watcher.observe_batch, None, 0.05)
+
+    def test_observe_batch_keeps_the_tree(self):
+        watcher = self._watch()
+        self._added(u'x')
+        os.remove(os.path.join(self.directory, u'a', u'x'))
+        self._queue([(FILE_ACTION_REMOVED, os.path.join(u'a', u'x'))])
+        self.assertEqual(watcher.observe_batch(None, 1),
+                         [('FileAdded', os.path.join(u'a', u'x')),
+                          ('FileRemoved', os.path.join(u'a', u'x'))])
+        self.assertEqual(watcher._fs_tree[u'a'].files, set())
+
+    def test_iter_observe_ends_after_timeout(self):
+        watcher = self._watch()
+        self._added(u'x')
+        self._added(u'y')
+        self.assertEqual(list(watcher.iter_observe(0.05)),
+                         [('FileAdded', os.path.join(u'a', u'x')),
+                          ('FileAdded', os.path.join(u'a', u'y'))])
+
+
+class TestDirWatcherQueueTestCase(DirWatcherTestCase):
+
+    def _added(self, count):
+        names = [os.path.join(u'a', u'f%d' % i) for i in range(count)]
+        for name in names:
+            self._touch(name)
+        self._queue([(FILE_ACTION_ADDED, name) for name in names])
+        return names
+
+    def test_a_full_queue_is_an_overflow(self):
+        watcher = self._watch(max_queued_events=2)
+        names = self._added(4)
+        events = watcher.observe_batch(None, 1)
+        #the rescan lists them in no particular order.
+        self.assertEqual(events[0], ('Overflow', u''))
+        self.assertEqual(sorted(events[1:]),
+                         [('FileAdded', name) for name in names])
+        self.assertEqual(watcher._fs_tree[u'a'].files,
+                         set(os.path.basename(n) for n in names))
+
+    def test_dropped_events_are_rescanned(self):
+        for policy, kept in ((QUEUE_DROP_OLDEST, slice(2, 4)),
+                             (QUEUE_DROP_NEWEST, slice(0, 2))):
+            watcher = self._watch(max_queued_events=2, queue_policy=policy)
+            names = self._added(4)
+            self.assertEqual(watcher.observe_batch(None, 1),
+                             [('FileAdded', name) for name in names[kept]])
+            missed = [name for name in names if name not in names[kept]]
+            self.assertEqual(sorted(watcher.observe_batch(None, 1)),
+                             [('FileAdded', name) for name in missed])
+            self.assertEqual(watcher._fs_tree[u'a'].files,
+                             set(os.path.basename(n) for n in names))
+            watcher.stop_watching()
+            for name in names:
+                os.remove(os.path.join(self.directory, name))
+
+
+class TestDirWatcherBackgroundTreeTestCase(DirWatcherTestCase):
+
+    def setUp(self):
+        DirWatcherTestCase.setUp(self)
+        for name in (u'b', u'c'):
+            os.makedirs(os.path.join(self.directory, name, u'sub'))
+        self.scanned = []
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        scan_directory = fs_tree.scan_directory
+
+        def gated_scan(path, relpath=u'', path_filter=None):
+            state = scan_directory(path, relpath, path_filter)
+            self.scanned.append(relpath)
+            if relpath == u'a':
+                #listed, the changes made now are missed.
+                self.release.wait(10)
+            return state
+
+        self.addCleanup(setattr, fs_tree, 'scan_directory', scan_directory)
+        fs_tree.scan_directory = gated_scan
+        self.stats = []
+        mtime = fs_tree._mtime
+
+        def counted_mtime(path):
+            self.stats.append(path)
+            return mtime(path)
+
+        self.addCleanup(setattr, fs_tree, '_mtime', mtime)
+        fs_tree._mtime = counted_mtime
+
+    def test_events_flow_while_the_tree_is_built(self):
+        watcher = self._watch(background_tree=True, tree_workers=2)
+        while u'a' not in self.scanned:
+            self.release.wait(0.01)
+        self._touch(u'a', u'new.txt')
+        new = os.path.join(u'a', u'new.txt')
+        self._queue([(FILE_ACTION_ADDED, new)])
+        self.assertEqual(watcher.observe(1), ('FileAdded', new))
+        self.assertTrue(watcher.stats()['tree_building'])
+
+        self.release.set()
+        watcher._tree_builder.wait(10)
+        listed, stated = len(self.scanned), len(self.stats)
+        self.assertTrue(watcher.wait_for_tree(10))
+        #only the directory changed while it was built is listed again,
+        #the others aren't even stat'ed.
+        self.assertEqual(self.scanned[listed:], [u'a'])
+        self.assertEqual(len(self.stats) - stated, 1)
+        self.assertEqual(watcher._fs_tree[u'a'].files, set([u'new.txt']))
+        self.assertEqual(len(watcher._fs_tree), 6)
+
+    def test_a_failed_build_is_built_again(self):
+        self.release.set()
+        failures = [OSError('first'), OSError('second')]
+        gated_scan = fs_tree.scan_directory
+
+        def failing_scan(path, relpath=u'', path_filter=None):
+            if relpath == u'b' and failures:
+                raise failures.pop(0)
+            return gated_scan(path, relpath, path_filter)
+
+        fs_tree.scan_directory = failing_scan
+        watcher = self._watch(background_tree=True, tree_workers=2)
+        watcher._tree_builder.wait(10)
+        #the second build fails too, the next call tries again.
+        self.assertRaisesRegexp(OSError, 'second', watcher.observe, 0)
+        self.assertTrue(watcher._tree_builder is not None)
+        self.assertRaisesRegexp(OSError, 'first', watcher.observe, 0)
+        self.assertTrue(watcher._tree_builder is None)
+        self.assertEqual(len(watcher._fs_tree), 6)
+
+        self._touch(u'b', u'new.txt')
+        new = os.path.join(u'b', u'new.txt')
+        self._queue([(FILE_ACTION_ADDED, new)])
+        self.assertEqual(watcher.observe(1), ('FileAdded', new))
+        self.assertEqual(watcher._fs_tree[u'b'].files, set([u'new.txt']))
+
+
+class TestDirWatcherSnapshotTestCase(DirWatcherTestCase):
+
+    def setUp(self):
+        DirWatcherTestCase.setUp(self)
+        self._touch(u'a', u'old.txt')
+        store = tempfile.mkdtemp(prefix='winwatcher_')
+        self.addCleanup(shutil.rmtree, store)
+        self.snapshot_path = os.path.join(store, 'tree.snapshot')
+        self.scanned = []
+        self.release = threading.Event()
+        self.release.set()
+        self.addCleanup(self.release.set)
+        scan_directory = fs_tree.scan_directory
+
+        def gated_scan(path, relpath=u'', path_filter=None):
+            self.scanned.append(relpath)
+            self.release.wait(10)
+            return scan_directory(path, relpath, path_filter)
+
+        self.addCleanup(setattr, fs_tree, 'scan_directory', scan_directory)
+        fs_tree.scan_directory = gated_scan
+
+    def _restart(self, **options):
+        """a watcher saved by stop_watching, then a new one."""
+        self._watch(snapshot_path=self.snapshot_path).stop_watching()
+        self.scanned = []
+        return self._watch(snapshot_path=self.snapshot_path, **options)
+
+    def test_stop_watching_saves_the_tree(self):
+        self.assertFalse(os.path.exists(self.snapshot_path))
+        watcher = self._watch(snapshot_path=self.snapshot_path)
+        tree = dict((relpath, (state.dirs, state.files))
+                    for relpath, state in watcher._fs_tree.items())
+        watcher.stop_watching()
+        loaded = snapshot.load_snapshot(self.snapshot_path, self.directory)
+        self.assertEqual(dict((relpath, (state.dirs, state.files))
+                              for relpath, state in loaded.items()), tree)
+
+    def test_a_restart_starts_from_the_snapshot(self):
+        watcher = self._restart(background_tree=True)
+        #nothing changed, nothing is listed and there is no build.
+        self.assertEqual(self.scanned, [])
+        self.assertTrue(watcher.wait_for_tree(0))
+        self.assertEqual(watcher._fs_tree[u'a'].files, set([u'old.txt']))
+
+    def test_the_missed_changes_come_first(self):
+        self._watch(snapshot_path=self.snapshot_path).stop_watching()
+        os.remove(os.path.join(self.directory, u'a', u'old.txt'))
+        self._touch(u'a', u'missed.txt')
+        os.utime(os.path.join(self.directory, u'a'), (5, 5))
+        self.scanned = []
+        watcher = self._watch(snapshot_path=self.snapshot_path)
+        self.assertEqual(self.scanned, [u'a'])
+        self._touch(u'a', u'new.txt')
+        self._queue([(FILE_ACTION_ADDED, os.path.join(u'a', u'new.txt'))])
+        self.assertEqual(watcher.observe_batch(None, 1),
+                         [('FileRemoved', os.path.join(u'a', u'old.txt')),
+                          ('FileAdded', os.path.join(u'a', u'missed.txt')),
+                          ('FileAdded', os.path.join(u'a', u'new.txt'))])
+
+    def test_a_stop_during_the_build_skips_the_save(self):
+        self.release.clear()
+        watcher = self._watch(snapshot_path=self.snapshot_path,
+                              background_tree=True)
+        #the build is cancelled once the listing it waits for is done.
+        threading.Timer(0.05, self.release.set).start()
+        watcher.stop_watching()
+        self.assertFalse(os.path.exists(self.snapshot_path))
+        self.assertRaises(DirWatcherError, watcher.checkpoint)
+
+    def test_an_unusable_snapshot_is_ignored(self):
+        with open(self.snapshot_path, 'wb') as f:
+            f.write('not a snapshot')
+        watcher = self._watch(snapshot_path=self.snapshot_path)
+        self.assertEqual(sorted(self.scanned), [u'', u'a'])
+        self.assertEqual(watcher._fs_tree[u'a'].files, set([u'old.txt']))
+        self.assertRaises(TimeoutError, watcher.observe, 0.05)
@@ -1,16 +1,26 @@
 # -*- coding: utf-8 -*-
-from .win32_objects import (FindCloseChangeNotification,
-                            FindFirstChangeNotification,
-                            FindNextChangeNotification,
-                            DirectoryWatcherError,
-                            TimeoutError, WaitForMultipleObjectsError,
-                            WaitForMultipleObjectsPool,
-                            NOTIFY_CONSTANTS,
-                            WAIT_OBJECT_0,
-                            WAIT_OBJECT_ABANDONED_0,
-                            WAIT_TIMEOUT,
-                            WAIT_FAILED,
-                            CreateFileDirectory)
+import sys
 
-from .object_watcher import (DirectoryWatcherError, FSObjectWatcherWMFOPool,
-                             WinDirectoryWatcher)
\ No newline at end of file
+from .events import Event
+from .notify_parser import decode_notify_buffer
+from .filters import PathFilter
+from .errors import TimeoutError
+from .object_watcher import (DirectoryWatcherError,
+                             FSObjectWatcherWMFOPool,
+                             FSObjectWatcherIOCPPool,
+                             WinDirectoryWatcher)
+from .manager import WatchManager, WatchManagerError
+
+if sys.platform == 'win32':
+    from .win32_objects import (FindCloseChangeNotification,
+                                FindFirstChangeNotification,
+                                FindNextChangeNotification,
+                                DirectoryWatcherError,
+                                TimeoutError, WaitForMultipleObjectsError,
+                                WaitForMultipleObjectsPool,
+                                NOTIFY_CONSTANTS,
+                                WAIT_OBJECT_0,
+                                WAIT_OBJECT_ABANDONED_0,
+                                WAIT_TIMEOUT,
+                                WAIT_FAILED,
+                                CreateFileDirectory)
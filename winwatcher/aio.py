@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio streams of the watcher events, with trollius (asyncio on python 2).
+
+    @trollius.coroutine
+    def consume(watcher):
+        with watcher.events() as stream:
+            while True:
+                try:
+                    event = yield From(stream.get())
+                except StreamClosed:
+                    break
+                ...
+
+    event = yield From(dir_watcher.observe_async())
+
+the events get to the loop through one of two bridges:
+
+BRIDGE_THREAD: a thread pools the watcher (observe_batch for a DirWatcher,
+    pool_batch for a WinDirectoryWatcher) and hands every batch to the loop
+    with call_soon_threadsafe.
+BRIDGE_PROACTOR: the proactor loop waits for the change notification
+    handle itself, the completed read is parsed in the loop, no threads.
+    needs a loop with a proactor and the wfmo backend. the handle can be
+    signaled before the read completes, the loop doesn't wait for it, it
+    tries again READ_RETRY_DELAY later.
+
+by default the proactor is used when it is available.
+
+a stream started on a watcher that wasn't watching owns it: closing the
+stream stops the watcher, releasing its OVERLAPPED buffers and the pool
+threads. cancelling a get (observe_async) doesn't close it, leaving the
+loop doesn't either, use the stream as a context manager as above.
+"""
+
+from collections import deque
+import threading
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+from .errors import TimeoutError, IoIncompleteError
+
+BRIDGE_THREAD = 'thread'
+BRIDGE_PROACTOR = 'proactor'
+#how long the bridge waits before checking if the stream was closed, the
+#proactor waits as long for the rescans and the coalescing window.
+DEFAULT_BRIDGE_INTERVAL = 0.5
+#how long the proactor bridge waits for a read still pending when the
+#handle was signaled.
+READ_RETRY_DELAY = 0.005
+
+
+class StreamClosed(Exception):
+    pass
+
+
+def proactor_available(loop, watcher):
+    proactor = getattr(loop, '_proactor', None)
+    return (hasattr(proactor, 'wait_for_handle') and
+            getattr(watcher, '_handle', None) is not None)
+
+
+class AsyncEventStream(object):
+    def __init__(self, watcher, loop=None, bridge=None,
+                 interval=DEFAULT_BRIDGE_INTERVAL):
+        if asyncio is None:
+            raise ImportError, "trollius (or asyncio) is not available"
+        self._watcher = watcher
+        self._loop = loop or asyncio.get_event_loop()
+        self.interval = interval
+        self._events = deque()
+        self._waiter = None
+        self._error = None
+        self._closed = False
+        self._wait = None
+        self._thread = None
+        self.bridge = None
+
+        self._owns_watcher = not watcher._watching
+        if self._owns_watcher:
+            watcher.start_watching()
+
+        if bridge is None:
+            bridge = BRIDGE_THREAD
+            if proactor_available(self._loop, watcher):
+                bridge = BRIDGE_PROACTOR
+        elif bridge == BRIDGE_PROACTOR:
+            if not proactor_available(self._loop, watcher):
+                self._abort()
+                raise ValueError, "the proactor can't wait for this watcher"
+        elif bridge != BRIDGE_THREAD:
+            self._abort()
+            raise ValueError, "invalid bridge %r" % (bridge,)
+        self.bridge = bridge
+
+        if bridge == BRIDGE_PROACTOR:
+            self._wait_handle()
+        else:
+            self._thread = threading.Thread(name='AsyncEventStream-Bridge',
+                                            target=self._bridge_thread)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _abort(self):
+        self._closed = True
+        if self._owns_watcher:
+            self._watcher.stop_watching()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self):
+        """
+        a future with the next event, StreamClosed when the stream is
+        closed.
+        """
+        future = asyncio.Future(loop=self._loop)
+        if self._waiter is not None and not self._waiter.done():
+            raise RuntimeError, "another task is already waiting for events"
+        if self._events:
+            future.set_result(self._events.popleft())
+        elif self._error is not None:
+            future.set_exception(self._error)
+        elif self._closed:
+            future.set_exception(StreamClosed())
+        else:
+            self._waiter = future
+        return future
+
+    def _wake_waiter(self):
+        waiter = self._waiter
+        if waiter is None or waiter.done():
+            return
+        self._waiter = None
+        if self._events:
+            waiter.set_result(self._events.popleft())
+        elif self._error is not None:
+            waiter.set_exception(self._error)
+        elif self._closed:
+            waiter.set_exception(StreamClosed())
+        else:
+            self._waiter = waiter
+
+    def _deliver(self, batch):
+        if self._closed:
+            return
+        self._events.extend(batch)
+        self._wake_waiter()
+
+    def _fail(self, error):
+        if self._closed:
+            return
+        self._error = error
+        self.close()
+
+    def close(self, stop_watching=True):
+        if self._closed:
+            return
+        self._closed = True
+        if self._wait is not None:
+            self._wait.cancel()
+            self._wait = None
+        #the bridge thread stops the watcher itself, it may be pooling it.
+        if (self._owns_watcher and stop_watching and
+            self.bridge == BRIDGE_PROACTOR):
+            self._watcher.stop_watching()
+        if not stop_watching:
+            self._owns_watcher = False
+        self._wake_waiter()
+
+    #thread bridge
+
+    def _bridge_thread(self):
+        watcher = self._watcher
+        call_soon = self._loop.call_soon_threadsafe
+        try:
+            while not self._closed:
+                try:
+                    batch = watcher._next_batch(self.interval)
+                except TimeoutError:
+                    continue
+                except Exception, error:
+                    if not self._closed:
+                        call_soon(self._fail, error)
+                    return
+                call_soon(self._deliver, batch)
+        except RuntimeError:
+            #the loop was closed under us.
+            self._closed = True
+        finally:
+            if self._owns_watcher and watcher._watching:
+                watcher.stop_watching()
+
+    #proactor bridge
+
+    def _wait_handle(self):
+        proactor = self._loop._proactor
+        self._wait = proactor.wait_for_handle(self._watcher._handle,
+                                              self.interval)
+        self._wait.add_done_callback(self._handle_signaled)
+
+    def _handle_signaled(self, wait):
+        if self._closed or wait.cancelled():
+            return
+        self._fetch(wait.result())
+
+    def _fetch(self, signaled):
+        if self._closed:
+            return
+        self._wait = None
+        watcher = self._watcher
+        try:
+            if signaled:
+                watcher._fetch_signaled(wait=False)
+            batch = watcher._take_queued()
+        except IoIncompleteError:
+            #the handle stays signaled, the read is taken when it is done.
+            self._wait = self._loop.call_later(READ_RETRY_DELAY, self._fetch,
+                                               True)
+            return
+        except Exception, error:
+            self._fail(error)
+            return
+        if batch:
+            self._deliver(batch)
+        self._wait_handle()
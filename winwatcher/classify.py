@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+the type of the paths DirWatcher's tree doesn't know, a directory at a
+time.
+
+a burst of events (an archive extracted, a build) touches many entries of
+the same directories. prefetch groups the paths by their directory and
+lists each one with a single scandir, the DirEntry objects carry the type
+(from the same FindNextFile call on windows, d_type elsewhere), and they
+are kept for ttl seconds for the events that follow. a directory
+with less than min_batch of the paths is not listed, its entries are
+stat'ed one by one, a big directory costs more to list than a few stats.
+
+without scandir (the backport, required on python 2) every path is
+stat'ed. a link to a directory is a file, as in the tree (see fs_tree).
+"""
+
+import os
+
+from .events import monotonic
+from .fs_tree import scandir, entry_is_dir, path_is_dir
+
+#long enough for the events of a burst, a batch usually follows the last.
+DEFAULT_CACHE_TTL = 1.0
+DEFAULT_MIN_BATCH = 4
+
+
+class EntryCache(object):
+    def __init__(self, root, ttl=DEFAULT_CACHE_TTL,
+                 min_batch=DEFAULT_MIN_BATCH):
+        self.root = root
+        self.ttl = ttl
+        self.min_batch = min_batch
+        #relpath of the directory: (expires, {name: DirEntry})
+        self._listings = {}
+
+        self.scans = 0
+        self.stats = 0
+
+    def __len__(self):
+        return len(self._listings)
+
+    def prefetch(self, relpaths):
+        """list the directories holding at least min_batch of relpaths."""
+        if scandir is None:
+            return
+        now = monotonic()
+        groups = {}
+        for relpath in relpaths:
+            parent = os.path.dirname(relpath)
+            groups[parent] = groups.get(parent, 0) + 1
+        listings = self._listings
+        for parent, count in groups.iteritems():
+            if count < self.min_batch:
+                continue
+            listing = listings.get(parent)
+            if listing is not None and listing[0] > now:
+                continue
+            self._scan(parent, now)
+        self._expire(now)
+
+    def entry(self, relpath):
+        """the DirEntry of relpath in a fresh listing, None if there isn't."""
+        listing = self._listings.get(os.path.dirname(relpath))
+        if listing is None or listing[0] <= monotonic():
+            return None
+        return listing[1].get(os.path.basename(relpath))
+
+    def is_dir(self, relpath):
+        entry = self.entry(relpath)
+        if entry is not None:
+            return entry_is_dir(entry)
+        self.stats += 1
+        return path_is_dir(os.path.join(self.root, relpath))
+
+    def forget(self, relpath):
+        """relpath was removed or renamed, its entry (and listing) is stale."""
+        listings = self._listings
+        listing = listings.get(os.path.dirname(relpath))
+        if listing is not None:
+            listing[1].pop(os.path.basename(relpath), None)
+        if listings:
+            prefix = relpath + os.sep
+            for directory in [d for d in listings
+                              if d == relpath or d.startswith(prefix)]:
+                del listings[directory]
+
+    def clear(self):
+        self._listings.clear()
+
+    def _scan(self, parent, now):
+        full_path = os.path.join(self.root, parent) if parent else self.root
+        self.scans += 1
+        try:
+            entries = dict((e.name, e) for e in scandir(full_path))
+        except OSError:
+            self._listings.pop(parent, None)
+            return
+        self._listings[parent] = (now + self.ttl, entries)
+
+    def _expire(self, now):
+        listings = self._listings
+        for directory in [d for d, l in listings.iteritems() if l[0] <= now]:
+            del listings[directory]
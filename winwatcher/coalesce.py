@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+coalescing of the raw watcher events.
+
+events are held for a time window and merged while they wait:
+
+* repeated Modified on the same path are delivered once;
+* Added then Removed cancel each other, Removed then Added is a Modified;
+* renames are folded: Added a, Moved a -> b is Added b, Moved a -> b,
+  Moved b -> c is Moved a -> c and moving back to the first name cancels.
+"""
+
+from collections import deque
+
+from .events import ACTION_MOVED as MOVED
+from .win32_constants import (FILE_ACTION_ADDED as ADDED,
+                              FILE_ACTION_REMOVED as REMOVED,
+                              FILE_ACTION_MODIFIED as MODIFIED)
+
+
+class _Pending(object):
+    __slots__ = ('time', 'path', 'event')
+
+    def __init__(self, time, path, event):
+        self.time = time
+        self.path = path
+        self.event = event
+
+
+class EventCoalescer(object):
+    def __init__(self, window):
+        self.window = window
+        self._pending = deque()
+        self._by_path = {}
+        self.merged = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _append(self, now, path, event):
+        entry = _Pending(now, path, event)
+        self._pending.append(entry)
+        if path is not None:
+            self._by_path[path] = entry
+
+    def _rekey(self, entry, path):
+        entry.path = path
+        self._by_path[path] = entry
+
+    def add(self, event, now):
+        action = event.action
+        by_path = self._by_path
+
+        if action == MODIFIED:
+            prev = by_path.get(event.path)
+            if prev is not None and prev.event.action in (ADDED, MODIFIED):
+                self.merged += 1
+                return
+            self._append(now, event.path, event)
+
+        elif action == ADDED:
+            path = event.path
+            prev = by_path.get(path)
+            if prev is not None and prev.event.action == REMOVED:
+                #deleted and created again, the content changed.
+                prev.event = prev.event.replace(MODIFIED, path)
+                self.merged += 1
+                return
+            self._append(now, path, event)
+
+        elif action == REMOVED:
+            path = event.path
+            prev = by_path.pop(path, None)
+            if prev is None:
+                self._append(now, path, event)
+                return
+            self.merged += 1
+            prev_action = prev.event.action
+            if prev_action == ADDED:
+                prev.event = None
+            elif prev_action == MOVED:
+                old = prev.event.old_path
+                prev.event = prev.event.replace(REMOVED, old)
+                self._rekey(prev, old)
+            elif prev_action == REMOVED:
+                by_path[path] = prev
+            else:
+                prev.event = None
+                self._append(now, path, event)
+
+        elif action == MOVED:
+            old, new = event.old_path, event.path
+            prev = by_path.get(old)
+            if prev is None or prev.event.action not in (ADDED, MOVED):
+                self._append(now, new, event)
+                return
+            self.merged += 1
+            del by_path[old]
+            if prev.event.action == ADDED:
+                target = by_path.get(new)
+                if target is not None and target.event.action == REMOVED:
+                    #renamed over a removed file, as editors do when saving.
+                    target.event = target.event.replace(MODIFIED, new)
+                    prev.event = None
+                else:
+                    prev.event = prev.event.replace(ADDED, new)
+                    self._rekey(prev, new)
+            elif prev.event.old_path == new:
+                prev.event = None
+            else:
+                prev.event = prev.event.replace(MOVED, new,
+                                                prev.event.old_path)
+                self._rekey(prev, new)
+
+        else:
+            self._append(now, None, event)
+
+    def extend(self, events, now):
+        add = self.add
+        for event in events:
+            add(event, now)
+
+    def next_deadline(self):
+        """when the oldest held event should be delivered, or None."""
+        if not self._pending:
+            return None
+        return self._pending[0].time + self.window
+
+    def ready(self, now):
+        """return the events whose window is over."""
+        out = []
+        pending = self._pending
+        by_path = self._by_path
+        limit = now - self.window
+        while pending and pending[0].time <= limit:
+            entry = pending.popleft()
+            if entry.path is not None and by_path.get(entry.path) is entry:
+                del by_path[entry.path]
+            if entry.event is not None:
+                out.append(entry.event)
+        return out
+
+    def flush(self):
+        """return every held event, ignoring the window."""
+        out = [entry.event for entry in self._pending
+               if entry.event is not None]
+        self._pending.clear()
+        self._by_path.clear()
+        return out
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+the I/O completion port engine, an alternative to the WaitForMultipleObjects
+pool.
+
+every directory handle is associated to one completion port with a key of
+its own, a completed ReadDirectoryChangesW queues a packet with that key on
+the port, so a single thread waiting on GetQueuedCompletionStatus serves all
+the directories: no groups of MAX_OBJECTS handles, no worker threads and no
+change notification handles.
+
+the key of an unregistered handle may still have packets queued, a handle
+can't leave its port before being closed, those packets are dropped.
+
+kernel is any object with the interface of win32_objects.Win32Kernel,
+simkernel.SimulatedKernel can be used to test it without windows.
+"""
+
+from itertools import count
+import threading
+import time
+
+from .errors import TimeoutError, IoCompletionPortError
+from .win32_constants import WAIT_INFINITE
+
+#the key of the packets posted by close.
+_WAKE_KEY = 0
+
+
+class CompletionPortEngine(object):
+    def __init__(self, kernel):
+        self._kernel = kernel
+        self._port = kernel.CreateIoCompletionPort(None, None, _WAKE_KEY)
+        self._mutex = threading.Lock()
+        self._keys = count(_WAKE_KEY + 1)
+        self._targets = {}
+        self._closed = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._targets)
+
+    def register(self, file_handle, target):
+        """
+        associate file_handle to the port, pool returns target for its
+        completions. return the key to unregister it.
+        """
+        with self._mutex:
+            key = next(self._keys)
+            self._targets[key] = target
+        try:
+            self._kernel.CreateIoCompletionPort(file_handle, self._port, key)
+        except:
+            with self._mutex:
+                del self._targets[key]
+            raise
+        return key
+
+    def unregister(self, key):
+        with self._mutex:
+            del self._targets[key]
+
+    def pool(self, timeout=-1):
+        """
+        wait up to timeout seconds (forever if negative) for a completion
+        and return its target, raise TimeoutError if nothing completed.
+        """
+        deadline = None
+        if timeout >= 0:
+            deadline = time.time() + timeout
+        while True:
+            if self._closed:
+                raise IoCompletionPortError, "the completion port is closed"
+            if deadline is None:
+                wait = WAIT_INFINITE
+            else:
+                wait = int(max(deadline - time.time(), 0) * 1000)
+            packet = self._kernel.GetQueuedCompletionStatus(self._port, wait)
+            if packet is None:
+                raise TimeoutError, "IOCP timeout expired"
+            nbytes, key, overlapped = packet
+            target = self._targets.get(key)
+            if target is not None:
+                return target
+            if key != _WAKE_KEY:
+                self.dropped += 1
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        #a thread blocked in pool wakes up and sees the port closed.
+        self._kernel.PostQueuedCompletionStatus(self._port, 0, _WAKE_KEY)
+        self._kernel.CloseHandle(self._port)
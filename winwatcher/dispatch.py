@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+handlers for the watcher events, run by a thread pool.
+
+    dispatcher = Dispatcher(DirWatcher(path))
+
+    @dispatcher.on(('FileAdded', 'FileModified'), u'*.py')
+    def compile(event):
+        ...
+
+    dispatcher.start()
+
+a reader thread takes the events from the watcher (observe_batch for a
+DirWatcher, pool_batch for a WinDirectoryWatcher) into a bounded queue, a
+dispatch thread hands them to the executor, at most max_in_flight handlers
+run at once. a slow handler holds the queue, not the reads of
+ReadDirectoryChangesW. when the queue is full the reader:
+
+POLICY_BLOCK: waits for room, the kernel keeps buffering (and overflowing).
+POLICY_DROP: drops the new event.
+POLICY_COALESCE: drops the new event if the same one is already queued,
+    otherwise waits for room, no change is lost.
+
+in_flight, queue_depth and the dropped and coalesced counters tell how
+it is keeping up.
+
+an error raised by the watcher stops the reading, the queued events are
+still dispatched. it is kept in error, counted in errors and given to
+error_handler(None, None, error), start again to resume.
+"""
+
+from collections import deque
+from fnmatch import fnmatch
+import threading
+
+from .errors import TimeoutError
+
+POLICY_BLOCK = 'block'
+POLICY_DROP = 'drop'
+POLICY_COALESCE = 'coalesce'
+
+DEFAULT_MAX_QUEUE = 1024
+DEFAULT_MAX_WORKERS = 4
+#how long the threads wait before checking if the dispatcher was stopped.
+DEFAULT_INTERVAL = 0.5
+
+
+class DispatcherError(Exception):
+    pass
+
+
+class _Handler(object):
+    __slots__ = ('callback', 'events', 'pattern')
+
+    def __init__(self, callback, events, pattern):
+        self.callback = callback
+        self.events = frozenset(events) if events is not None else None
+        self.pattern = pattern
+
+    def matches(self, event):
+        if self.events is not None and event[0] not in self.events:
+            return False
+        if self.pattern is None:
+            return True
+        for path in tuple(event)[1:]:
+            if fnmatch(path, self.pattern):
+                return True
+        return False
+
+
+class Dispatcher(object):
+    def __init__(self, watcher, executor=None,
+                 max_workers=DEFAULT_MAX_WORKERS, max_queue=DEFAULT_MAX_QUEUE,
+                 policy=POLICY_BLOCK, max_in_flight=None,
+                 error_handler=None, interval=DEFAULT_INTERVAL):
+        if policy not in (POLICY_BLOCK, POLICY_DROP, POLICY_COALESCE):
+            raise DispatcherError, "invalid policy %r" % (policy,)
+        if max_queue < 1:
+            raise DispatcherError, "max_queue should be at least 1"
+        self._watcher = watcher
+        self._executor = executor
+        self._owns_executor = executor is None
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight or max_workers
+        self.policy = policy
+        self.error_handler = error_handler
+        self.interval = interval
+
+        self._handlers = []
+        self._queue = deque()
+        self._queued_keys = {}
+        self._mutex = threading.Condition(threading.Lock())
+        self._slots = threading.Semaphore(self.max_in_flight)
+        self._running = False
+        self._reading = False
+        self._owns_watcher = False
+        self._reader = self._dispatcher = None
+
+        self.in_flight = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.error = None
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def register(self, callback, events=None, pattern=None):
+        """
+        call callback(event) for the events of the given types (all of them
+        if None) with a path matching the fnmatch pattern (any if None).
+        """
+        handler = _Handler(callback, events, pattern)
+        with self._mutex:
+            self._handlers = self._handlers + [handler]
+        return callback
+
+    def unregister(self, callback):
+        with self._mutex:
+            self._handlers = [h for h in self._handlers
+                              if h.callback is not callback]
+
+    def on(self, events=None, pattern=None):
+        """register as a decorator."""
+        def decorator(callback):
+            return self.register(callback, events, pattern)
+        return decorator
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        if self._reader is not None:
+            return
+        if self._executor is None:
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+            except ImportError:
+                raise ImportError, ("concurrent.futures is not available, "
+                                    "install futures or pass an executor")
+            self._executor = ThreadPoolExecutor(self.max_workers)
+        if not self._watcher._watching:
+            self._watcher.start_watching()
+            self._owns_watcher = True
+        self.error = None
+        self._running = self._reading = True
+        self._reader = threading.Thread(name='Dispatcher-Reader',
+                                        target=self._read)
+        self._dispatcher = threading.Thread(name='Dispatcher',
+                                            target=self._dispatch)
+        for thread in (self._reader, self._dispatcher):
+            thread.daemon = True
+            thread.start()
+
+    def stop(self, wait=True):
+        """
+        stop reading, the queued events are still dispatched, with wait
+        it returns after the handlers are done.
+        """
+        if self._reader is None:
+            return
+        with self._mutex:
+            self._reading = False
+            self._mutex.notify_all()
+        self._reader.join()
+        with self._mutex:
+            self._running = False
+            self._mutex.notify_all()
+        if wait:
+            self._dispatcher.join()
+        if self._owns_watcher:
+            self._watcher.stop_watching()
+            self._owns_watcher = False
+        self._reader = self._dispatcher = None
+
+    #reader
+
+    def _read(self):
+        watcher = self._watcher
+        while self._reading:
+            try:
+                batch = watcher._next_batch(self.interval)
+            except TimeoutError:
+                continue
+            except Exception, error:
+                self._reader_failed(error)
+                return
+            for event in batch:
+                if not self._put(event):
+                    return
+
+    def _reader_failed(self, error):
+        with self._mutex:
+            self.error = error
+            self.errors += 1
+            #the dispatcher thread ends when the queue is empty.
+            self._reading = self._running = False
+            self._mutex.notify_all()
+        if self.error_handler is not None:
+            self.error_handler(None, None, error)
+
+    def _put(self, event):
+        key = tuple(event)
+        with self._mutex:
+            queue = self._queue
+            while len(queue) >= self.max_queue:
+                if self.policy == POLICY_DROP:
+                    self.dropped += 1
+                    return True
+                if self.policy == POLICY_COALESCE and key in self._queued_keys:
+                    self.coalesced += 1
+                    return True
+                if not self._reading:
+                    return False
+                self._mutex.wait(self.interval)
+            queue.append(event)
+            self._queued_keys[key] = self._queued_keys.get(key, 0) + 1
+            self._mutex.notify_all()
+        return True
+
+    #dispatcher
+
+    def _take(self):
+        with self._mutex:
+            queue = self._queue
+            while not queue:
+                if not self._running:
+                    return None
+                self._mutex.wait(self.interval)
+            event = queue.popleft()
+            key = tuple(event)
+            if self._queued_keys[key] == 1:
+                del self._queued_keys[key]
+            else:
+                self._queued_keys[key] -= 1
+            self._mutex.notify_all()
+            return event, self._handlers
+
+    def _dispatch(self):
+        slots = self._slots
+        while True:
+            #the event waits for a free slot in the queue, so queue_depth
+            #counts it and the policies can see it.
+            slots.acquire()
+            taken = self._take()
+            if taken is None:
+                slots.release()
+                break
+            event, handlers = taken
+            has_slot = True
+            for handler in handlers:
+                if not handler.matches(event):
+                    continue
+                if not has_slot:
+                    slots.acquire()
+                has_slot = False
+                with self._mutex:
+                    self.in_flight += 1
+                try:
+                    self._executor.submit(self._run, handler.callback, event)
+                except:
+                    with self._mutex:
+                        self.in_flight -= 1
+                    slots.release()
+                    raise
+            if has_slot:
+                slots.release()
+        #the handlers still running hold their slots.
+        for i in xrange(self.max_in_flight):
+            self._slots.acquire()
+        for i in xrange(self.max_in_flight):
+            self._slots.release()
+        if self._owns_executor:
+            self._executor.shutdown(False)
+            self._executor = None
+
+    def _run(self, callback, event):
+        try:
+            callback(event)
+        except Exception, error:
+            with self._mutex:
+                self.errors += 1
+            if self.error_handler is not None:
+                self.error_handler(callback, event, error)
+        finally:
+            self._done()
+
+    def _done(self):
+        with self._mutex:
+            self.in_flight -= 1
+            self.dispatched += 1
+        self._slots.release()
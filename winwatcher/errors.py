@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+try:
+    WindowsError = WindowsError
+except NameError:
+    #not on windows, only the simulated kernel can be used.
+    WindowsError = OSError
+
+
+class DirectoryWatcherError(WindowsError):
+    pass
+
+class WaitForMultipleObjectsError(WindowsError):
+    pass
+
+class TimeoutError(WaitForMultipleObjectsError):
+    pass
+
+class IoCompletionPortError(WindowsError):
+    pass
+
+class IoIncompleteError(DirectoryWatcherError):
+    pass
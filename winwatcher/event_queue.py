@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+a bounded queue for the events waiting for the consumer.
+
+it is used by WinDirectoryWatcher in place of its deque when a limit is
+given, with max_events and/or max_bytes (an estimate of the memory held by
+the events). when the limits are reached the policy decides what is shed:
+
+QUEUE_DROP_OLDEST: the oldest events are dropped to make room.
+QUEUE_DROP_NEWEST: the new event is dropped.
+QUEUE_RESCAN_MARKER: the queue collapses into a single Overflow event,
+    the consumer rescans (DirWatcher does) instead of replaying the
+    changes. the events coming while the marker is queued are covered by
+    the rescan and dropped.
+QUEUE_SPILL: the new events go to an append-only file (spill_path, or a
+    temporary file) and are read back in order when the memory is empty,
+    nothing is lost.
+
+dropped, collapsed and spilled count what was shed. the watcher's
+stop_watching closes the queue, the events not pooled are dropped and the
+spill file is removed.
+"""
+
+from collections import deque
+import marshal
+import os
+import tempfile
+
+from .events import Event, ACTION_OVERFLOW, monotonic
+
+QUEUE_DROP_OLDEST = 'drop_oldest'
+QUEUE_DROP_NEWEST = 'drop_newest'
+QUEUE_RESCAN_MARKER = 'rescan_marker'
+QUEUE_SPILL = 'spill'
+
+QUEUE_POLICIES = (QUEUE_DROP_OLDEST, QUEUE_DROP_NEWEST, QUEUE_RESCAN_MARKER,
+                  QUEUE_SPILL)
+
+#the object and its slots, the paths are counted apart.
+EVENT_OVERHEAD = 96
+#how many spilled events are read back at once without limits.
+SPILL_CHUNK = 1024
+
+
+def event_size(event):
+    """rough estimate of the bytes held by event."""
+    size = EVENT_OVERHEAD
+    for path in tuple(event)[1:]:
+        size += 2 * len(path)
+    return size
+
+
+class BoundedEventQueue(object):
+    def __init__(self, max_events=None, max_bytes=None,
+                 policy=QUEUE_DROP_OLDEST, spill_path=None, watch_id=None):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError, "invalid queue policy %r" % (policy,)
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.spill_path = spill_path
+        self.watch_id = watch_id
+        self._events = deque()
+        self._sizes = deque()
+        self.bytes = 0
+        self._marker = None
+        self._spill = None
+        self._spill_count = 0
+        self._read_pos = 0
+
+        self.dropped = 0
+        self.collapsed = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return len(self._events) + self._spill_count
+
+    def __nonzero__(self):
+        return bool(self._events) or self._spill_count > 0
+
+    def __iter__(self):
+        for event in self._events:
+            yield event
+        if self._spill_count:
+            spill = self._spill
+            spill.seek(self._read_pos)
+            for i in xrange(self._spill_count):
+                yield self._load(spill)
+
+    def _full(self, size):
+        if (self.max_events is not None and
+            len(self._events) >= self.max_events):
+            return True
+        return (self.max_bytes is not None and
+                self.bytes + size > self.max_bytes)
+
+    def _push(self, event, size):
+        self._events.append(event)
+        self._sizes.append(size)
+        self.bytes += size
+
+    def _pop(self):
+        event = self._events.popleft()
+        self.bytes -= self._sizes.popleft()
+        if event is self._marker:
+            self._marker = None
+        return event
+
+    def append(self, event):
+        size = event_size(event) if self.max_bytes is not None else 0
+        policy = self.policy
+        if self._spill_count:
+            #spilled events are older, it keeps going to the file.
+            self._dump(event)
+            return
+        if self._marker is not None:
+            self.collapsed += 1
+            return
+        if self._full(size):
+            if policy == QUEUE_DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif policy == QUEUE_DROP_OLDEST:
+                while self._events and self._full(size):
+                    self._pop()
+                    self.dropped += 1
+            elif policy == QUEUE_RESCAN_MARKER:
+                self.collapsed += len(self._events) + 1
+                self._events.clear()
+                self._sizes.clear()
+                self.bytes = 0
+                self._marker = Event(ACTION_OVERFLOW, u'', None,
+                                     self.watch_id, monotonic())
+                self._push(self._marker, EVENT_OVERHEAD)
+                return
+            else:
+                self._dump(event)
+                return
+        self._push(event, size)
+
+    def extend(self, events):
+        append = self.append
+        for event in events:
+            append(event)
+
+    def popleft(self):
+        if not self._events and self._spill_count:
+            self._refill()
+        return self._pop()
+
+    def clear(self):
+        self._events.clear()
+        self._sizes.clear()
+        self.bytes = 0
+        self._marker = None
+        if self._spill_count:
+            self._spill_count = 0
+            self._truncate()
+
+    def close(self):
+        self.clear()
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+            if self.spill_path is not None:
+                os.remove(self.spill_path)
+
+    #spill file
+
+    def _dump(self, event):
+        if self._spill is None:
+            if self.spill_path is None:
+                self._spill = tempfile.TemporaryFile()
+            else:
+                self._spill = open(self.spill_path, 'w+b')
+        spill = self._spill
+        spill.seek(0, os.SEEK_END)
+        if isinstance(event, Event):
+            record = (True, event.action, event.path, event.old_path,
+                      event.watch_id, event.timestamp)
+        else:
+            record = (False, tuple(event))
+        marshal.dump(record, spill)
+        self._spill_count += 1
+        self.spilled += 1
+
+    def _load(self, spill):
+        record = marshal.load(spill)
+        if record[0]:
+            return Event(*record[1:])
+        return record[1]
+
+    def _refill(self):
+        spill = self._spill
+        spill.seek(self._read_pos)
+        load = self._load
+        while self._spill_count:
+            event = load(spill)
+            self._spill_count -= 1
+            size = event_size(event) if self.max_bytes is not None else 0
+            self._push(event, size)
+            if self._full(0) or len(self._events) >= SPILL_CHUNK:
+                break
+        self._read_pos = spill.tell()
+        if not self._spill_count:
+            self._truncate()
+
+    def _truncate(self):
+        self._spill.seek(0)
+        self._spill.truncate()
+        self._read_pos = 0
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+the event objects queued by the watchers.
+
+an Event is a small slotted object, but it still behaves like the tuples
+the watchers used to return: ('Added', path) or ('Moved', old_path, path).
+
+events don't keep the full path: they keep a PathNode for the directory,
+shared by every event (and every subdirectory) under it, and the leaf
+name. a node keeps its own directory string, so the full string is one
+concatenation when path is read.
+
+events compare and hash on their nodes and leaf names, an Event still
+equals its tuple but it doesn't hash like it.
+"""
+
+import sys
+import time
+
+from .win32_constants import ACTION_DICT, FILE_ACTION_RENAMED_NEW_NAME
+
+try:
+    from time import monotonic
+except ImportError:
+    #python 2: time.clock is the performance counter on windows.
+    monotonic = time.clock if sys.platform == 'win32' else time.time
+
+
+#not a kernel action, the kernel dropped events.
+ACTION_OVERFLOW = 0
+#the two renamed records are delivered as one event.
+ACTION_MOVED = FILE_ACTION_RENAMED_NEW_NAME
+
+ACTION_NAMES = dict(ACTION_DICT)
+ACTION_NAMES[ACTION_MOVED] = 'Moved'
+ACTION_NAMES[ACTION_OVERFLOW] = 'Overflow'
+
+ACTION_CODES = dict((name, code) for code, name in ACTION_NAMES.items())
+
+PATH_SEPARATOR = u'\\'
+
+MAX_INTERNED_PATHS = 1 << 16
+_interned_paths = {}
+
+
+def intern_path(path):
+    """
+    the builtin intern only accepts str, this one works with unicode paths,
+    so the same path in a burst of events is only stored once.
+    """
+    interned = _interned_paths.get(path)
+    if interned is None:
+        if len(_interned_paths) >= MAX_INTERNED_PATHS:
+            _interned_paths.clear()
+        interned = _interned_paths[path] = path
+    return interned
+
+
+class PathNode(object):
+    """
+    a directory, as a leaf name under its parent directory node. nodes
+    don't change, the directory string is built once, None for the root.
+    """
+    __slots__ = ('parent', 'name', 'directory')
+
+    def __init__(self, parent, name):
+        self.parent = parent
+        self.name = name
+        self.directory = parent.join(name) if parent is not None else None
+
+    def join(self, leaf):
+        if self.directory is None:
+            return leaf
+        return self.directory + PATH_SEPARATOR + leaf
+
+    @property
+    def path(self):
+        if self.directory is None:
+            return u''
+        return self.directory
+
+
+ROOT_NODE = PathNode(None, u'')
+
+MAX_DIRECTORY_NODES = 1 << 16
+#(parent node, name) -> node, and the directory string -> node for the
+#directories seen in the last events.
+_child_nodes = {}
+_directory_nodes = {}
+
+
+def directory_node(directory):
+    """the shared node for a relative directory path."""
+    node = _directory_nodes.get(directory)
+    if node is not None:
+        return node
+    if len(_directory_nodes) >= MAX_DIRECTORY_NODES:
+        #the events already queued keep their nodes alive.
+        _directory_nodes.clear()
+        _child_nodes.clear()
+
+    node = ROOT_NODE
+    for name in directory.split(PATH_SEPARATOR):
+        key = (node, name)
+        child = _child_nodes.get(key)
+        if child is None:
+            child = _child_nodes[key] = PathNode(node, intern_path(name))
+        node = child
+    _directory_nodes[directory] = node
+    return node
+
+
+def split_path(path):
+    """(directory node, interned leaf name) for a relative path."""
+    pos = path.rfind(PATH_SEPARATOR)
+    if pos < 0:
+        return ROOT_NODE, intern_path(path)
+    return directory_node(path[:pos]), intern_path(path[pos + 1:])
+
+
+class Event(object):
+    __slots__ = ('action', '_parent', '_leaf', '_old_parent', '_old_leaf',
+                 'watch_id', 'timestamp')
+
+    def __init__(self, action, path, old_path=None, watch_id=None,
+                 timestamp=None):
+        self.action = action
+        self._parent, self._leaf = split_path(path)
+        if old_path is None:
+            self._old_parent = self._old_leaf = None
+        else:
+            self._old_parent, self._old_leaf = split_path(old_path)
+        self.watch_id = watch_id
+        self.timestamp = timestamp if timestamp is not None else monotonic()
+
+    @property
+    def path(self):
+        return self._parent.join(self._leaf)
+
+    @property
+    def old_path(self):
+        if self._old_parent is None:
+            return None
+        return self._old_parent.join(self._old_leaf)
+
+    @property
+    def directory(self):
+        """the shared PathNode of the directory holding path."""
+        return self._parent
+
+    @property
+    def name(self):
+        return ACTION_NAMES[self.action]
+
+    def as_tuple(self):
+        if self.action == ACTION_MOVED:
+            return (ACTION_NAMES[ACTION_MOVED], self.old_path, self.path)
+        return (ACTION_NAMES[self.action], self.path)
+
+    def replace(self, action, path, old_path=None):
+        """a new event for the same watch, keeping the timestamp."""
+        return Event(action, path, old_path, self.watch_id, self.timestamp)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self):
+        return 3 if self.action == ACTION_MOVED else 2
+
+    def __getitem__(self, index):
+        return self.as_tuple()[index]
+
+    def _key(self):
+        old = self._old_parent
+        return (self.action, self._parent.directory, self._leaf,
+                old.directory if old is not None else None, self._old_leaf)
+
+    def __eq__(self, other):
+        if isinstance(other, Event):
+            #the nodes are shared, a new node for the same directory only
+            #comes after the node cache was cleared.
+            if (self._parent is other._parent and
+                    self._old_parent is other._old_parent):
+                return (self.action == other.action and
+                        self._leaf == other._leaf and
+                        self._old_leaf == other._old_leaf)
+            return self._key() == other._key()
+        elif not isinstance(other, tuple):
+            return NotImplemented
+        return self.as_tuple() == other
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'Event%r' % (self.as_tuple(),)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+include/exclude rules for the watched paths.
+
+the rules are compiled into a single regular expression for the excludes
+and another one for the includes, so checking a path is one search each,
+decode_notify_buffer checks the names before building the events and the
+tree walks skip the excluded directories.
+
+globs without a separator match any component of the path (.git excludes
+every .git directory and everything below it, *.tmp every .tmp file),
+globs with one match from the root (build\\out). * doesn't cross the
+separators, ** does. regexes are searched in the whole relative path.
+windows paths, so it is case insensitive, and / (not valid in a name) is
+a separator too.
+"""
+
+import re
+
+SEPARATOR = u'\\'
+
+
+def glob_to_regex(glob):
+    """the regex source for glob, without anchors."""
+    out = []
+    i, n = 0, len(glob)
+    while i < n:
+        c = glob[i]
+        i += 1
+        if c == u'*':
+            if i < n and glob[i] == u'*':
+                i += 1
+                out.append(u'.*')
+            else:
+                out.append(u'[^\\\\/]*')
+        elif c == u'?':
+            out.append(u'[^\\\\/]')
+        elif c == SEPARATOR:
+            out.append(u'[\\\\/]')
+        elif c == u'[':
+            end = glob.find(u']', i + 1 if glob[i:i + 1] in (u'!', u']')
+                            else i)
+            if end < 0:
+                out.append(u'\\[')
+                continue
+            body = glob[i:end].replace(u'\\', u'\\\\')
+            if body.startswith(u'!'):
+                body = u'^' + body[1:]
+            out.append(u'[%s]' % body)
+            i = end + 1
+        else:
+            out.append(re.escape(c))
+    return u''.join(out)
+
+
+def _rule(glob):
+    glob = glob.replace(u'/', SEPARATOR).rstrip(SEPARATOR)
+    if not glob:
+        raise ValueError, "empty glob"
+    if SEPARATOR in glob:
+        #anchored at the root, what is below it matches too.
+        return u'^(?:%s)(?:[\\\\/]|$)' % glob_to_regex(
+                glob.lstrip(SEPARATOR))
+    return u'(?:^|[\\\\/])(?:%s)(?:[\\\\/]|$)' % glob_to_regex(glob)
+
+
+def _compile(globs, regexes):
+    sources = [_rule(unicode(g)) for g in globs]
+    for regex in regexes:
+        sources.append(u'(?:%s)' % getattr(regex, 'pattern', regex))
+    if not sources:
+        return None
+    return re.compile(u'|'.join(sources), re.IGNORECASE | re.UNICODE)
+
+
+class PathFilter(object):
+    """
+    exclude wins over include, without includes everything that is not
+    excluded is accepted.
+    """
+
+    def __init__(self, include=(), exclude=(), include_regex=(),
+                 exclude_regex=()):
+        self._include = _compile(include, include_regex)
+        self._exclude = _compile(exclude, exclude_regex)
+        #bound once, they run for every name in the buffers.
+        self._include_search = self._include and self._include.search
+        self._exclude_search = self._exclude and self._exclude.search
+
+    def __nonzero__(self):
+        return bool(self._include or self._exclude)
+
+    @property
+    def signature(self):
+        """the compiled rules, two filters with it equal match the same."""
+        return u'%s\0%s' % (getattr(self._include, 'pattern', u''),
+                             getattr(self._exclude, 'pattern', u''))
+
+    def excludes(self, path):
+        """path (or a directory above it) is excluded."""
+        return bool(self._exclude_search and self._exclude_search(path))
+
+    def accepts(self, path):
+        exclude_search = self._exclude_search
+        if exclude_search and exclude_search(path):
+            return False
+        include_search = self._include_search
+        return not include_search or include_search(path) is not None
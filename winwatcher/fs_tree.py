@@ -0,0 +1,591 @@
+# -*- coding: utf-8 -*-
+"""
+in memory state of a directory tree, used by DirWatcher.
+
+the state is a TreeState, mapping the relative directory paths (the root
+is u'') to a DirectoryState holding the directory mtime and the names of
+its subdirectories and files. when the kernel drops events the tree can be
+rescanned against the state: directories whose mtime didn't change are
+not listed again, only their known subdirectories are visited.
+
+the directories are listed with scandir (os.scandir, or the scandir
+backport on python 2), the entry types come with the listing instead of a
+stat per entry. build_tree_state_parallel spreads the listing of the
+subtrees across worker threads, the calls release the GIL.
+
+like os.walk, the links to directories (symlinks and junctions) are not
+followed: a link back to a parent would be walked forever. they are kept
+as files.
+"""
+
+import os
+import stat
+import threading
+import time
+
+from .win32_constants import FILE_ATTRIBUTE_REPARSE_POINT
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+DEFAULT_TREE_WORKERS = 4
+#how often build_tree_state_parallel calls progress.
+PROGRESS_INTERVAL = 0.5
+
+
+class DirectoryState(object):
+    #children is kept by TreeState.
+    __slots__ = ('mtime', 'dirs', 'files', 'children')
+
+    def __init__(self, mtime=None, dirs=None, files=None):
+        self.mtime = mtime
+        self.dirs = dirs if dirs is not None else set()
+        self.files = files if files is not None else set()
+        self.children = None
+
+
+class _Placeholder(DirectoryState):
+    """a node above the known directories, not in the tree itself."""
+    __slots__ = ()
+
+
+def _join(relpath, name):
+    return os.path.join(relpath, name) if relpath else name
+
+
+class TreeState(object):
+    """
+    the DirectoryState of the known directories, used like a dict keyed by
+    the relative paths, but stored as a trie of the path components: every
+    state keeps its subdirectories in children (a dict, None while there
+    are none). moving or removing a directory relinks one node instead of
+    renaming every path below it, and no full path is kept in memory. the
+    directory names are interned, a name seen in many places is stored
+    once.
+    """
+
+    def __init__(self, items=()):
+        self._root = _Placeholder()
+        self._names = {}
+        self._count = 0
+        for relpath, state in items:
+            self[relpath] = state
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, relpath):
+        return self.get(relpath) is not None
+
+    def __getitem__(self, relpath):
+        state = self.get(relpath)
+        if state is None:
+            raise KeyError, relpath
+        return state
+
+    def __setitem__(self, relpath, state):
+        parent, name = self._parent_node(relpath, True)
+        old = self._replace(parent, name, state)
+        state.children = old.children if old is not None else None
+        if old is None or type(old) is _Placeholder:
+            self._count += 1
+
+    def __iter__(self):
+        for relpath, state in self.iteritems():
+            yield relpath
+
+    def get(self, relpath, default=None):
+        node = self._node(relpath)
+        if node is None or type(node) is _Placeholder:
+            return default
+        return node
+
+    def setdefault(self, relpath, state):
+        current = self.get(relpath)
+        if current is None:
+            self[relpath] = current = state
+        return current
+
+    def iteritems(self, relpath=u''):
+        """(relpath, state) for relpath and the directories below it."""
+        node = self._node(relpath)
+        if node is None:
+            return
+        pending = [(relpath, node)]
+        while pending:
+            current, node = pending.pop()
+            if type(node) is not _Placeholder:
+                yield current, node
+            if node.children:
+                pending.extend((_join(current, name), child)
+                               for name, child in node.children.iteritems())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [state for relpath, state in self.iteritems()]
+
+    def detach(self, relpath):
+        """forget relpath and everything below it, returns the states."""
+        parent, name = self._parent_node(relpath)
+        node = self._replace(parent, name, None)
+        if node is None:
+            return []
+        states = list(self._states(node))
+        self._count -= len(states)
+        return states
+
+    def move(self, old_relpath, new_relpath):
+        """
+        relink old_relpath (and everything below it) at new_relpath,
+        replacing what was there. returns False if it wasn't known.
+        """
+        parent, name = self._parent_node(old_relpath)
+        node = parent and self._replace(parent, name, None)
+        if node is None:
+            return False
+        self.detach(new_relpath)
+        parent, name = self._parent_node(new_relpath, True)
+        self._replace(parent, name, node)
+        return True
+
+    def _states(self, node):
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if type(node) is not _Placeholder:
+                yield node
+            if node.children:
+                pending.extend(node.children.itervalues())
+
+    def _node(self, relpath):
+        node = self._root
+        if relpath:
+            for name in relpath.split(os.sep):
+                children = node.children
+                if not children:
+                    return None
+                node = children.get(name)
+                if node is None:
+                    return None
+        return node
+
+    def _parent_node(self, relpath, create=False):
+        """
+        the node holding relpath and its last name, (None, None) for the
+        root. with create the missing nodes above it are added.
+        """
+        if not relpath:
+            return None, None
+        names = relpath.split(os.sep)
+        node = self._root
+        for name in names[:-1]:
+            children = node.children
+            child = children.get(name) if children else None
+            if child is None:
+                if not create:
+                    return None, None
+                child = _Placeholder()
+                if children is None:
+                    node.children = children = {}
+                children[self._intern(name)] = child
+            node = child
+        return node, names[-1]
+
+    def _replace(self, parent, name, node):
+        """link node at parent/name (unlink with None), returns the old."""
+        if name is None:
+            old = self._root
+            self._root = node if node is not None else _Placeholder()
+            return old
+        if parent is None:
+            return None
+        children = parent.children
+        old = children.get(name) if children else None
+        if node is None:
+            if old is not None:
+                del children[name]
+                if not children:
+                    parent.children = None
+            return old
+        if children is None:
+            parent.children = children = {}
+        children[self._intern(name)] = node
+        return old
+
+    def _intern(self, name):
+        return self._names.setdefault(name, name)
+
+
+def entry_is_dir(entry):
+    """a scandir entry for a directory, not for a link to one."""
+    try:
+        if not entry.is_dir(follow_symlinks=False):
+            return False
+        if os.name != 'nt':
+            return True
+        #a junction is a directory but not a symlink for scandir.
+        attributes = getattr(entry.stat(follow_symlinks=False),
+                             'st_file_attributes', 0)
+        return not attributes & FILE_ATTRIBUTE_REPARSE_POINT
+    except OSError:
+        return False
+
+
+def path_is_dir(full_path):
+    """os.path.isdir, without following links."""
+    try:
+        st = os.lstat(full_path)
+    except OSError:
+        return False
+    attributes = getattr(st, 'st_file_attributes', 0)
+    return (stat.S_ISDIR(st.st_mode) and
+            not attributes & FILE_ATTRIBUTE_REPARSE_POINT)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def scan_directory(path, relpath=u'', path_filter=None):
+    """
+    list one directory, returns a DirectoryState or None if it is gone.
+    the names excluded by path_filter are left out.
+    """
+    full_path = os.path.join(path, relpath) if relpath else path
+    mtime = _mtime(full_path)
+    state = DirectoryState(mtime)
+    excludes = path_filter.excludes if path_filter else None
+    if scandir is not None:
+        try:
+            entries = list(scandir(full_path))
+        except OSError:
+            return None
+        for entry in entries:
+            name = entry.name
+            if excludes is not None and excludes(_join(relpath, name)):
+                continue
+            if entry_is_dir(entry):
+                state.dirs.add(name)
+            else:
+                state.files.add(name)
+        return state
+
+    try:
+        names = os.listdir(full_path)
+    except OSError:
+        return None
+    for name in names:
+        if excludes is not None and excludes(_join(relpath, name)):
+            continue
+        if path_is_dir(os.path.join(full_path, name)):
+            state.dirs.add(name)
+        else:
+            state.files.add(name)
+    return state
+
+
+def build_tree_state(path, relpath=u'', tree=None, path_filter=None,
+                     cancel=None):
+    """
+    list the whole tree under relpath into tree and return it, the
+    directories excluded by path_filter are not walked. it stops half way
+    when the cancel event is set.
+    """
+    if tree is None:
+        tree = TreeState()
+    pending = [relpath]
+    while pending:
+        if cancel is not None and cancel.is_set():
+            break
+        current = pending.pop()
+        state = scan_directory(path, current, path_filter)
+        if state is None:
+            continue
+        tree[current] = state
+        pending.extend(_join(current, d) for d in state.dirs)
+    return tree
+
+
+def build_tree_state_parallel(path, relpaths=(u'',), tree=None,
+                              path_filter=None, workers=DEFAULT_TREE_WORKERS,
+                              progress=None,
+                              progress_interval=PROGRESS_INTERVAL,
+                              cancel=None):
+    """
+    build_tree_state for every directory in relpaths, with workers threads
+    taking the directories to list from a shared stack, so a big subtree
+    is spread across all of them.
+
+    progress(directories, files) is called from the calling thread every
+    progress_interval seconds and once at the end. setting the cancel event
+    stops the walk, the tree is left half built.
+    """
+    if tree is None:
+        tree = TreeState()
+    if workers <= 1:
+        for relpath in relpaths:
+            build_tree_state(path, relpath, tree, path_filter, cancel)
+        if progress is not None:
+            progress(len(tree), sum(len(s.files) for s in tree.values()))
+        return tree
+
+    cond = threading.Condition(threading.Lock())
+    pending = list(relpaths)
+    #directories taken or waiting to be taken.
+    counters = {'unfinished': len(pending), 'files': 0}
+    errors = []
+
+    def stopped():
+        return errors or (cancel is not None and cancel.is_set())
+
+    def worker():
+        while True:
+            with cond:
+                while (not pending and counters['unfinished'] and
+                       not stopped()):
+                    cond.wait()
+                if not pending or stopped():
+                    return
+                current = pending.pop()
+            try:
+                state = scan_directory(path, current, path_filter)
+            except Exception, error:
+                with cond:
+                    errors.append(error)
+                    cond.notify_all()
+                return
+            with cond:
+                if state is not None:
+                    tree[current] = state
+                    counters['files'] += len(state.files)
+                    pending.extend(_join(current, d) for d in state.dirs)
+                    counters['unfinished'] += len(state.dirs)
+                counters['unfinished'] -= 1
+                cond.notify_all()
+
+    threads = [threading.Thread(name='TreeBuilder-%d' % i, target=worker)
+               for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    next_report = time.time() + progress_interval
+    while True:
+        with cond:
+            if not counters['unfinished'] or stopped():
+                #wake the idle workers, they see it too.
+                cond.notify_all()
+                break
+            cond.wait(progress_interval)
+            done = (len(tree), counters['files'])
+        #outside the lock, the workers go on meanwhile.
+        if progress is not None and time.time() >= next_report:
+            next_report = time.time() + progress_interval
+            progress(*done)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    if progress is not None:
+        progress(len(tree), counters['files'])
+    return tree
+
+
+class BackgroundTreeBuilder(object):
+    """
+    build_tree_state_parallel in a thread of its own. tree fills up while
+    it runs, it can be read meanwhile (looked up, not iterated). error is
+    the exception that stopped it.
+    """
+
+    def __init__(self, path, path_filter=None, workers=DEFAULT_TREE_WORKERS,
+                 progress=None):
+        self.path = path
+        self.path_filter = path_filter
+        self.workers = workers
+        self.progress = progress
+        self.tree = TreeState()
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(name='BackgroundTreeBuilder',
+                                        target=self._run)
+        self._thread.daemon = True
+
+    @property
+    def done(self):
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def start(self):
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """True when the tree is built (or the build failed)."""
+        self._thread.join(timeout)
+        return self.done
+
+    def cancel(self):
+        self._cancel.set()
+        if self._thread.ident is not None:
+            self._thread.join()
+
+    def _run(self):
+        try:
+            build_tree_state_parallel(self.path, tree=self.tree,
+                                      path_filter=self.path_filter,
+                                      workers=self.workers,
+                                      progress=self.progress,
+                                      cancel=self._cancel)
+        except Exception, error:
+            self.error = error
+
+
+def index_is_dir(tree, relpath):
+    """
+    True if relpath is a directory of tree, False if it is a file, None if
+    the tree doesn't know it (then only a stat can tell).
+    """
+    if relpath in tree:
+        return True
+    parent = tree.get(os.path.dirname(relpath))
+    if parent is None:
+        return None
+    name = os.path.basename(relpath)
+    if name in parent.files:
+        return False
+    if name in parent.dirs:
+        return True
+    return None
+
+
+def subtree_paths(tree, relpath):
+    """relpath and every directory below it that is known in tree."""
+    return [current for current, state in tree.iteritems(relpath)]
+
+
+def _subtree_events(tree, relpath, dir_event, file_event):
+    events = []
+    for current, state in tree.iteritems(relpath):
+        events.extend((dir_event, _join(current, d)) for d in state.dirs)
+        events.extend((file_event, _join(current, f)) for f in state.files)
+    return events
+
+
+def _rescan_directory(path, tree, current, old, path_filter, events):
+    """
+    list current again and update its state, old, appending the events.
+    returns the subdirectories that were already known, None if current is
+    gone.
+    """
+    new = scan_directory(path, current, path_filter)
+    if new is None:
+        #the parent listing will report it.
+        return None
+
+    for name in old.files - new.files:
+        events.append(('FileRemoved', _join(current, name)))
+    for name in new.files - old.files:
+        events.append(('FileAdded', _join(current, name)))
+
+    for name in old.dirs - new.dirs:
+        child = _join(current, name)
+        removed = _subtree_events(tree, child, 'DirectoryRemoved',
+                                  'FileRemoved')
+        events.extend(reversed(removed))
+        events.append(('DirectoryRemoved', child))
+        tree.detach(child)
+
+    for name in new.dirs - old.dirs:
+        child = _join(current, name)
+        events.append(('DirectoryAdded', child))
+        build_tree_state(path, child, tree, path_filter)
+        events.extend(_subtree_events(tree, child, 'DirectoryAdded',
+                                      'FileAdded'))
+
+    old.mtime = new.mtime
+    old.files = new.files
+    kept = old.dirs & new.dirs
+    old.dirs = new.dirs
+    return kept
+
+
+def rescan_tree_state(path, tree, relpath=u'', path_filter=None):
+    """
+    rescan the tree under relpath and bring tree up to date.
+
+    returns the DirectoryAdded, FileAdded, DirectoryRemoved and FileRemoved
+    events needed to get from the old state to the new one.
+    """
+    events = []
+    pending = [relpath]
+    while pending:
+        current = pending.pop()
+        old = tree.get(current)
+        if old is None:
+            continue
+        full_path = os.path.join(path, current) if current else path
+        if old.mtime is not None and _mtime(full_path) == old.mtime:
+            #nothing was added or removed here, but maybe below.
+            pending.extend(_join(current, d) for d in old.dirs)
+            continue
+
+        kept = _rescan_directory(path, tree, current, old, path_filter,
+                                 events)
+        if kept:
+            pending.extend(_join(current, d) for d in kept)
+
+    return events
+
+
+def rescan_directories(path, tree, relpaths, path_filter=None):
+    """
+    like rescan_tree_state, but only relpaths are listed again (whatever
+    their mtime), not the directories below them. the new subdirectories
+    are listed whole.
+    """
+    events = []
+    for relpath in relpaths:
+        old = tree.get(relpath)
+        if old is not None:
+            _rescan_directory(path, tree, relpath, old, path_filter, events)
+    return events
+
+
+def remove_subtree(tree, relpath):
+    """forget relpath and everything below it, returns the removed states."""
+    removed = tree.detach(relpath)
+    parent = tree.get(os.path.dirname(relpath))
+    if parent is not None:
+        parent.dirs.discard(os.path.basename(relpath))
+    return removed
+
+
+def move_subtree(tree, old_relpath, new_relpath):
+    """
+    rename old_relpath and everything below it to new_relpath, returns
+    False if old_relpath wasn't known.
+    """
+    moved = tree.move(old_relpath, new_relpath)
+    old_parent = tree.get(os.path.dirname(old_relpath))
+    if old_parent is not None:
+        old_parent.dirs.discard(os.path.basename(old_relpath))
+    new_parent = tree.get(os.path.dirname(new_relpath))
+    if new_parent is not None and moved:
+        new_parent.dirs.add(os.path.basename(new_relpath))
+    return moved
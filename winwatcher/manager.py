@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+many roots, one wait pool.
+
+every WinDirectoryWatcher pooling by itself has a pool of its own (and its
+threads), WatchManager keeps one pool for all the roots it watches, the
+roots can be added and removed while it is pooling from another thread, and
+the events come tagged with their root as (root, event).
+
+the events go through the pipeline of their root's watcher (coalescing,
+queue limits and metrics, as given to add_root), the roots with queued
+events are served in turn.
+"""
+
+from collections import deque
+import threading
+import time
+
+from .object_watcher import (WinDirectoryWatcher, FSObjectWatcherWMFOPool,
+                             FSObjectWatcherIOCPPool, BACKEND_WFMO,
+                             BACKEND_IOCP, default_notification_list,
+                             default_kernel)
+from .errors import DirectoryWatcherError, TimeoutError
+
+
+class WatchManagerError(DirectoryWatcherError):
+    pass
+
+
+class WatchManager(object):
+    def __init__(self, backend=BACKEND_WFMO, fair=True, kernel=None):
+        if backend not in (BACKEND_WFMO, BACKEND_IOCP):
+            raise WatchManagerError, "invalid backend %r" % (backend,)
+        self.backend = backend
+        self._kernel = kernel or default_kernel()
+        if backend == BACKEND_IOCP:
+            self._pool = FSObjectWatcherIOCPPool(self._kernel)
+        else:
+            self._pool = FSObjectWatcherWMFOPool(self._kernel, fair)
+        self._mutex = threading.Lock()
+        self._roots = {}
+        self._watch_roots = {}
+        #the roots with queued events, in the order they are served.
+        self._ready = deque()
+        self._coalescing = {}
+
+    def __len__(self):
+        return len(self._roots)
+
+    def __contains__(self, root):
+        return root in self._roots
+
+    @property
+    def roots(self):
+        return self._roots.keys()
+
+    def add_root(self, root, recursive=True,
+                 notify_atributes_list=default_notification_list,
+                 weight=1, **options):
+        """
+        start watching root, options are passed to WinDirectoryWatcher.
+        weight is used by the fair WFMO pool.
+        """
+        with self._mutex:
+            if root in self._roots:
+                raise WatchManagerError, "%s is already watched" % (root,)
+            watcher = WinDirectoryWatcher(root, recursive,
+                                          notify_atributes_list,
+                                          backend=self.backend,
+                                          kernel=self._kernel, **options)
+            self._roots[root] = watcher
+            self._watch_roots[watcher.watch_id] = root
+            if watcher._coalescer is not None:
+                self._coalescing[root] = watcher
+        try:
+            watcher.start_watching(self._pool, weight)
+        except:
+            with self._mutex:
+                del self._roots[root], self._watch_roots[watcher.watch_id]
+                self._coalescing.pop(root, None)
+            if watcher._watching:
+                watcher.stop_watching()
+            raise
+        return watcher
+
+    def remove_root(self, root):
+        """stop watching root, its events not pooled yet are dropped."""
+        with self._mutex:
+            if root not in self._roots:
+                raise WatchManagerError, "%s is not watched" % (root,)
+            watcher = self._roots.pop(root)
+            del self._watch_roots[watcher.watch_id]
+            self._coalescing.pop(root, None)
+            if root in self._ready:
+                self._ready.remove(root)
+        self._pool.unregister(watcher)
+        watcher.stop_watching()
+        watcher._queued_results.clear()
+
+    def _mark_ready(self, root, watcher):
+        if watcher._queued_results and root not in self._ready:
+            self._ready.append(root)
+
+    def _release_coalesced(self):
+        for root, watcher in self._coalescing.iteritems():
+            watcher._release_coalesced()
+            self._mark_ready(root, watcher)
+
+    def _next_deadline(self):
+        deadlines = [w._coalescer.next_deadline()
+                     for w in self._coalescing.itervalues()]
+        deadlines = [d for d in deadlines if d is not None]
+        return min(deadlines) if deadlines else None
+
+    def _fetch_events(self, timeout):
+        if not self._roots:
+            raise WatchManagerError, "there are no roots to watch"
+        #don't wait past the moment the held events are due.
+        wait = timeout
+        with self._mutex:
+            deadline = self._next_deadline()
+        if deadline is not None:
+            until_deadline = max(deadline - time.time(), 0)
+            if wait < 0 or until_deadline < wait:
+                wait = until_deadline
+        try:
+            handle, watcher = self._pool.pool(wait)
+        except TimeoutError, timed_out:
+            watcher = None
+        with self._mutex:
+            if watcher is not None:
+                root = self._watch_roots.get(watcher.watch_id)
+                #None if it was removed while it was signaled.
+                if root is not None:
+                    watcher._fetch_signaled()
+                    self._mark_ready(root, watcher)
+            self._release_coalesced()
+            ready = bool(self._ready)
+        #the held events may be due even when nothing completed.
+        if watcher is None and not ready and wait == timeout:
+            raise timed_out
+
+    def _take(self):
+        """the next (root, event) queued, None if there isn't."""
+        ready = self._ready
+        while ready:
+            root = ready.popleft()
+            watcher = self._roots[root]
+            queued = watcher._queued_results
+            if not queued:
+                continue
+            event = queued.popleft()
+            watcher._metrics.record_delivery((event,))
+            if queued:
+                ready.append(root)
+            return root, event
+        return None
+
+    def pool(self, timeout=-1):
+        """the next (root, event), TimeoutError if none came in timeout."""
+        #a coalescer can cut a wait short, the rest of timeout is kept.
+        deadline = time.time() + timeout if timeout >= 0 else None
+        while True:
+            with self._mutex:
+                item = self._take()
+            if item is not None:
+                return item
+            self._fetch_events(timeout)
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0)
+
+    poll = pool
+
+    def iter_events(self, timeout=-1):
+        """yield (root, event) as they come, until timeout without events."""
+        while True:
+            while True:
+                with self._mutex:
+                    item = self._take()
+                if item is None:
+                    break
+                yield item
+            try:
+                self._fetch_events(timeout)
+            except TimeoutError:
+                return
+
+    def close(self):
+        for root in self.roots:
+            self.remove_root(root)
+        self._pool.close()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+counters of the watcher pipeline, for watcher.stats().
+
+they are plain attributes bumped by the thread running the watcher, no
+locks, so they stay on under full load: a stats() taken from another
+thread may be a count behind. the events are counted by action when a
+completion is parsed, the latency goes from the completion to the delivery
+by pool, pool_batch or iter_events (observe for a DirWatcher), in the
+buckets of LATENCY_BUCKETS.
+
+StatsReporter calls a callback with the stats every interval seconds from
+a thread, the rates in them are over the last interval.
+"""
+
+from bisect import bisect_left
+import threading
+
+from .events import ACTION_NAMES, monotonic
+
+#upper bounds in seconds, the last bucket takes what is slower.
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+                   5.0)
+DEFAULT_STATS_INTERVAL = 10.0
+
+
+class WatcherMetrics(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.started = monotonic()
+        self.events = {}
+        self.completions = 0
+        self.wakes = 0
+        self.fill_total = 0.0
+        self.fill_max = 0.0
+        self.delivered = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_counts = [0] * (len(buckets) + 1)
+
+    def record_completion(self, bytes_read, buffer_size, results):
+        self.completions += 1
+        if buffer_size:
+            fill = float(bytes_read) / buffer_size
+            self.fill_total += fill
+            if fill > self.fill_max:
+                self.fill_max = fill
+        events = self.events
+        for event in results:
+            action = event.action
+            events[action] = events.get(action, 0) + 1
+
+    def record_delivery(self, events):
+        now = monotonic()
+        buckets = self.buckets
+        counts = self.latency_counts
+        total = 0.0
+        latency_max = self.latency_max
+        delivered = 0
+        for event in events:
+            timestamp = getattr(event, 'timestamp', None)
+            if timestamp is None:
+                continue
+            latency = now - timestamp
+            counts[bisect_left(buckets, latency)] += 1
+            total += latency
+            if latency > latency_max:
+                latency_max = latency
+            delivered += 1
+        self.delivered += delivered
+        self.latency_total += total
+        self.latency_max = latency_max
+
+    def snapshot(self, previous=None):
+        """
+        the counters as a dict, the rates are since previous (an older
+        snapshot) or since the start.
+        """
+        now = monotonic()
+        events = dict((ACTION_NAMES.get(a, a), n)
+                      for a, n in self.events.items())
+        if previous is None:
+            elapsed = now - self.started
+            before = {}
+        else:
+            elapsed = now - previous['time']
+            before = previous['events']
+        elapsed = max(elapsed, 1e-9)
+        completions = self.completions
+        delivered = self.delivered
+        return {
+            'time': now,
+            'uptime': now - self.started,
+            'events': events,
+            'events_per_second': dict(
+                    (name, (n - before.get(name, 0)) / elapsed)
+                    for name, n in events.items()),
+            'completions': completions,
+            'wakes': self.wakes,
+            'completions_per_wake': (float(completions) / self.wakes
+                                     if self.wakes else 0.0),
+            'buffer_fill': {
+                'average': (self.fill_total / completions
+                            if completions else 0.0),
+                'max': self.fill_max,
+            },
+            'latency': {
+                'count': delivered,
+                'average': (self.latency_total / delivered
+                            if delivered else 0.0),
+                'max': self.latency_max,
+                'histogram': zip(self.buckets + (None,),
+                                 self.latency_counts),
+            },
+        }
+
+
+class StatsReporter(object):
+    def __init__(self, stats, callback, interval=DEFAULT_STATS_INTERVAL):
+        self._stats = stats
+        self.callback = callback
+        self.interval = interval
+        self._stop = threading.Event()
+        self._previous = None
+        self.errors = 0
+        self._thread = threading.Thread(name='StatsReporter',
+                                        target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._previous = self._stats()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if (self._thread.ident is not None and
+            self._thread is not threading.current_thread()):
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stats = self._stats(self._previous)
+                self._previous = stats
+                self.callback(stats)
+            except Exception:
+                #a broken callback (or a stats() racing stop_watching)
+                #doesn't stop the reports, the next rates are since the
+                #last good one.
+                self.errors += 1
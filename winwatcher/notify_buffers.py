@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+rotation of the ReadDirectoryChangesW buffers.
+
+the kernel only keeps the changes for us while a read is pending, so instead
+of parsing and then issuing the next read, we keep more than one buffer (each
+one with its own OVERLAPPED) and issue the next read right after a
+completion, the filled buffer is parsed while the kernel is already writing
+on the other one.
+
+a completion of zero bytes means that the kernel overflowed and the changes
+were dropped. the kernel allocates its own buffer on the first read of a
+directory handle and keeps that size until the handle is closed, so a
+bigger user buffer alone changes nothing: after an overflow the buffers
+grow (up to max_size) and reopen is called to get a new directory handle,
+the next read is the first one of that handle. the changes between the
+two handles are lost, the consumer was told to rescan by the overflow
+anyway. the buffers don't shrink back, it would need a new handle too and
+lose changes silently. without reopen the size is fixed: start at the
+wanted size.
+
+kernel is any object with the interface of win32_objects.Win32Kernel,
+simkernel.SimulatedKernel can be used to test it without windows.
+"""
+
+DEFAULT_BUFFER_SIZE = 8192
+#ReadDirectoryChangesW fails with buffers bigger than 64k on network shares.
+MAX_BUFFER_SIZE = 65536
+
+
+class NotifyBufferRing(object):
+    def __init__(self, kernel, file_handle, recursive, flags,
+                 count=2, size=DEFAULT_BUFFER_SIZE,
+                 max_size=MAX_BUFFER_SIZE, reopen=None):
+        if count < 1:
+            raise ValueError, "the ring needs at least one buffer"
+        if max_size < size:
+            raise ValueError, "max_size should not be smaller than size"
+        self._kernel = kernel
+        self._file_handle = file_handle
+        self._recursive = recursive
+        self._flags = flags
+        self._slots = []
+        for i in range(count):
+            overlapped = kernel.CreateOverlapped(kernel.CreateEvent())
+            self._slots.append((kernel.CreateBuffer(size), overlapped))
+        self._current = 0
+        self._armed = False
+        self._reopen = reopen
+        self.max_size = max_size
+        self.size = size
+        self.overflows = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def event(self):
+        """the event that will be signaled by the pending read."""
+        return self._slots[self._current][1].hEvent
+
+    def arm(self):
+        if self._armed:
+            return
+        buf, overlapped = self._slots[self._current]
+        if len(buf) != self.size:
+            buf = self._kernel.CreateBuffer(self.size)
+            self._slots[self._current] = (buf, overlapped)
+        self._kernel.ReadDirectoryChangesW(self._file_handle, buf,
+                                           self._recursive, self._flags,
+                                           overlapped)
+        self._armed = True
+
+    def complete(self, wait=True):
+        """
+        wait for the pending read and return (buffer, bytes_read),
+        bytes_read is zero when the kernel overflowed. without wait
+        IoIncompleteError is raised while the read is pending, the ring is
+        left as it was.
+
+        when the ring has more than one buffer the next read is issued
+        before returning, with a single buffer the caller must call arm
+        after it is done with the returned buffer.
+        """
+        buf, overlapped = self._slots[self._current]
+        nbytes = self._kernel.GetOverlappedResult(self._file_handle,
+                                                  overlapped, wait)
+        self._armed = False
+        self._adapt(nbytes)
+        self._current = (self._current + 1) % len(self._slots)
+        if len(self._slots) > 1:
+            self.arm()
+        return buf, nbytes
+
+    def _adapt(self, nbytes):
+        if nbytes:
+            return
+        self.overflows += 1
+        if self._reopen is None or self.size >= self.max_size:
+            return
+        #nothing is pending, the read that overflowed just completed.
+        self.size = min(self.size * 2, self.max_size)
+        self._file_handle = self._reopen(self._file_handle)
+
+    def close(self):
+        for buf, overlapped in self._slots:
+            self._kernel.CloseHandle(overlapped.hEvent)
+        self._slots = []
+        self._armed = False
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+FILE_NOTIFY_INFORMATION decoding.
+
+this module doesn't touch the win32 api, so it can be used (and benchmarked)
+on any platform with synthetic buffers.
+"""
+
+import struct
+from codecs import utf_16_le_decode
+
+from .win32_constants import (FILE_NOTIFY_INFORMATION_STRUCT,
+                              FILE_ACTION_ADDED, FILE_ACTION_REMOVED,
+                              FILE_ACTION_RENAMED_OLD_NAME,
+                              FILE_ACTION_RENAMED_NEW_NAME)
+from .events import Event, ACTION_MOVED, monotonic
+
+
+NOTIFY_HEADER = struct.Struct(FILE_NOTIFY_INFORMATION_STRUCT)
+
+
+def decode_notify_buffer(buf, nbytes=None, offset=0, watch_id=None,
+                         timestamp=None, path_filter=None):
+    """
+    decode all FILE_NOTIFY_INFORMATION records in buf in one pass.
+
+    buf can be anything supporting the buffer protocol (a ctypes string
+    buffer, a bytearray or a str); it is walked through a memoryview so the
+    records are never copied, only the names are decoded from view slices.
+    nbytes is the number of bytes the kernel reported for the completion.
+
+    returns a list of events.Event, all with the same watch_id and
+    timestamp (the completion time), the renamed pairs are a single
+    ACTION_MOVED event.
+
+    the names not accepted by path_filter (a filters.PathFilter) are
+    skipped before any event is built, a rename across the filter becomes
+    the Added or Removed seen from this side.
+    """
+    view = memoryview(buf)
+    if nbytes is None:
+        nbytes = len(view)
+    if timestamp is None:
+        timestamp = monotonic()
+    unpack_from = NOTIFY_HEADER.unpack_from
+    header_size = NOTIFY_HEADER.size
+    results = []
+    append = results.append
+    renamed_old = None
+    pos = offset
+    accepts = path_filter.accepts if path_filter else None
+
+    while pos + header_size <= nbytes:
+        next_entry, action, namelen = unpack_from(view, pos)
+        str_pos = pos + header_size
+        name = utf_16_le_decode(view[str_pos:str_pos + namelen])[0]
+
+        if action == FILE_ACTION_RENAMED_OLD_NAME:
+            renamed_old = name
+            if accepts is not None and not accepts(name):
+                renamed_old = None
+        elif accepts is not None and not accepts(name):
+            if action == FILE_ACTION_RENAMED_NEW_NAME:
+                if renamed_old is not None:
+                    append(Event(FILE_ACTION_REMOVED, renamed_old, None,
+                                 watch_id, timestamp))
+                    renamed_old = None
+        elif action == FILE_ACTION_RENAMED_NEW_NAME:
+            if renamed_old is None:
+                append(Event(FILE_ACTION_ADDED, name, None, watch_id,
+                             timestamp))
+            else:
+                append(Event(ACTION_MOVED, name, renamed_old, watch_id,
+                             timestamp))
+                renamed_old = None
+        else:
+            append(Event(action, name, None, watch_id, timestamp))
+
+        if not next_entry:
+            break
+        pos += next_entry
+
+    if renamed_old is not None:
+        #the new name never came in this batch, the object left the tree.
+        append(Event(FILE_ACTION_REMOVED, renamed_old, None, watch_id,
+                     timestamp))
+
+    return results
+
+
+def encode_notify_records(records):
+    """
+    build a FILE_NOTIFY_INFORMATION buffer from (action, name) pairs,
+    the same layout the kernel writes. used for tests and benchmarks.
+    """
+    chunks = []
+    for index, (action, name) in enumerate(records):
+        encoded = name.encode('utf-16-le')
+        size = NOTIFY_HEADER.size + len(encoded)
+        size += -size % 4 #records are DWORD aligned
+        is_last = index == len(records) - 1
+        header = NOTIFY_HEADER.pack(0 if is_last else size, action,
+                                    len(encoded))
+        chunks.append((header + encoded).ljust(size, '\x00'))
+    return ''.join(chunks)
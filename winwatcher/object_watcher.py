@@ -1,16 +1,24 @@
 # -*- coding: utf-8 -*-
 
-from .win32_objects import (NOTIFY_CONSTANTS, FindNextChangeNotification,
-               FindCloseChangeNotification, FindFirstChangeNotification,
-               DirectoryWatcherError, WaitForMultipleObjectsPool,
-               CreateFileDirectory, ReadDirectoryChangesW, OVERLAPPED,
-               ACTION_DICT, FILE_NOTIFY_INFORMATION_STRUCT, CloseHandle,
-               GetOverlappedResult, IoCompletionPort, CreateEvent,
-               GetLastError, FormatError, FILE_ACTION_RENAMED_OLD_NAME,
-               FILE_ACTION_RENAMED_NEW_NAME)
-from ctypes import byref, create_string_buffer
-from ctypes.wintypes import DWORD
-import struct
+try:
+    from .win32_objects import Win32Kernel
+except ImportError:
+    #not on windows, only the simulated kernel can be used.
+    Win32Kernel = None
+from .errors import DirectoryWatcherError, TimeoutError
+from .win32_constants import NOTIFY_CONSTANTS
+from .wait_pool import WaitPool
+from .completion import CompletionPortEngine
+from .notify_buffers import (NotifyBufferRing, DEFAULT_BUFFER_SIZE,
+                             MAX_BUFFER_SIZE)
+from .notify_parser import decode_notify_buffer
+from .coalesce import EventCoalescer
+from .event_queue import BoundedEventQueue, QUEUE_DROP_OLDEST
+from .events import Event, ACTION_OVERFLOW, monotonic
+from .metrics import WatcherMetrics, StatsReporter, DEFAULT_STATS_INTERVAL
+from collections import deque
+from itertools import count
+import time
 import os
 
 
@@ -32,9 +40,34 @@ default_notification_list = ('ChangeSize',
                              'ChangeDirName',
                              'ChangeFileName')
 
+#under a constant load there is always another completion signaled,
+#pool_batch stops draining them after this many.
+MAX_COMPLETIONS_PER_BATCH = 64
+
+#how the completions are waited for: a WaitForMultipleObjects pool on the
+#change notifications or an I/O completion port on the directory handles.
+BACKEND_WFMO = 'wfmo'
+BACKEND_IOCP = 'iocp'
+
+_watch_ids = count(1)
+
+
+def default_kernel():
+    if Win32Kernel is None:
+        raise DirectoryWatcherError, ("kernel32 is not available, pass a "
+                                      "kernel (simkernel.SimulatedKernel)")
+    return Win32Kernel()
+
+
 class WinDirectoryWatcher(object):
     def __init__(self, path, recursive=True,
-                 notify_atributes_list=default_notification_list):
+                 notify_atributes_list=default_notification_list,
+                 buffer_count=2, buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_buffer_size=MAX_BUFFER_SIZE, coalesce_window=None,
+                 backend=BACKEND_WFMO, kernel=None, path_filter=None,
+                 max_queued_events=None, max_queued_bytes=None,
+                 queue_policy=QUEUE_DROP_OLDEST, spill_path=None,
+                 stats_callback=None, stats_interval=DEFAULT_STATS_INTERVAL):
         if type(path) is not unicode:
             try:
                 path = unicode(path)
@@ -52,134 +85,381 @@ class WinDirectoryWatcher(object):
                                  for i in notify_atributes_list))
         except KeyError:
             raise DirectoryWatcherError, "invalid notify_attributes_list"
+        if backend not in (BACKEND_WFMO, BACKEND_IOCP):
+            raise DirectoryWatcherError, "invalid backend %r" % (backend,)
 
         self._watching = False
         self.recursive = True
         self.path = path
-        self._queued_results = []
-
+        self.watch_id = next(_watch_ids)
+        if max_queued_events is None and max_queued_bytes is None:
+            self._queued_results = deque()
+        else:
+            self._queued_results = BoundedEventQueue(max_queued_events,
+                                                     max_queued_bytes,
+                                                     queue_policy, spill_path,
+                                                     self.watch_id)
+        self._buffer_count = buffer_count
+        self._buffer_size = buffer_size
+        self._max_buffer_size = max_buffer_size
+        self.backend = backend
+        self.path_filter = path_filter
+        self._kernel = kernel or default_kernel()
+        self._handle = None
+        self._file_handle = None
+        self._pool = None
+        self._weight = 1
+        self._buffers = None
+        self._coalescer = None
+        if coalesce_window is not None:
+            self._coalescer = EventCoalescer(coalesce_window)
+        self._metrics = WatcherMetrics()
+        self.stats_callback = stats_callback
+        self.stats_interval = stats_interval
+        self._reporter = None
 
     def _async_watch_directory(self):
-        overlapped = self._overlapped
-        overlapped.Internal = 0
-        overlapped.InternalHigh = 0
-        overlapped.Offset = 0
-        overlapped.OffsetHigh = 0
-        overlapped.Pointer = 0
-        overlapped.hEvent = 0
-        ReadDirectoryChangesW(self._file_handle, byref(self._result),
-                              len(self._result), self.recursive,
-                              self._flags, None, overlapped, None)
+        self._buffers.arm()
 
 
     def _watch(self):
-        self._handle = FindFirstChangeNotification(self.path, self._flags,
-                                                  self.recursive)
-
-    def start_watching(self):
+        self._handle = self._kernel.FindFirstChangeNotification(
+                self.path, self._flags, self.recursive)
+
+    def start_watching(self, pool=None, weight=1):
+        """
+        pool is a wait pool shared with other watchers (see WatchManager),
+        it is registered before the first read is issued.
+        """
         self._watching = True
-        self._watch()
-        self._file_handle = CreateFileDirectory(self.path)
-        #self._iocp = IoCompletionPort()
-        #self._iocp.attach_fsobject(self)
-        self._overlapped = OVERLAPPED()
-        self._overlapped.hEvent = CreateEvent()
-        self._result = create_string_buffer(8192)
-        self._async_watch_directory()
+        self._metrics = WatcherMetrics()
+        if self.stats_callback is not None:
+            self._reporter = StatsReporter(self.stats, self.stats_callback,
+                                           self.stats_interval).start()
+        self._file_handle = self._kernel.CreateFileDirectory(self.path)
+        if self.backend == BACKEND_WFMO:
+            self._watch()
+        self._buffers = NotifyBufferRing(self._kernel, self._file_handle,
+                                         self.recursive, self._flags,
+                                         self._buffer_count,
+                                         self._buffer_size,
+                                         self._max_buffer_size,
+                                         self._reopen)
+        #a completion port only gets the completions of the reads issued
+        #after the directory is associated to it.
+        self._pool, self._weight = pool, weight
+        if pool is not None:
+            pool.register(self, weight)
+        elif self.backend == BACKEND_IOCP:
+            self._auto_fetch_events()
+        try:
+            self._async_watch_directory()
+        except:
+            if pool is not None:
+                pool.unregister(self)
+            raise
+
+    def _reopen(self, file_handle):
+        """
+        a new directory handle for the grown buffers (the kernel keeps the
+        buffer size of the first read of a handle), see notify_buffers.
+        """
+        pool = self._pool
+        iocp = self.backend == BACKEND_IOCP and pool is not None
+        if iocp:
+            pool.unregister(self)
+        self._kernel.CloseHandle(file_handle)
+        self._file_handle = self._kernel.CreateFileDirectory(self.path)
+        if iocp:
+            pool.register(self, self._weight)
+        return self._file_handle
 
     def stop_watching(self):
-        if self._file_handle:
-            closed = CloseHandle(self._file_handle)
-            self._file_handle = None
+        if self._reporter is not None:
+            self._reporter.stop()
+            self._reporter = None
 
-        if hasattr(self, '_wfmo'):
-            self._watch._cancel_all_threads()
+        #the pool stops waiting for the handles before they are closed.
+        if hasattr(self, '_wmfo'):
+            self._wmfo.close()
             del self._wmfo
+        self._pool = None
+
+        if self._file_handle:
+            closed = self._kernel.CloseHandle(self._file_handle)
+            self._file_handle = None
 
         if self._handle:
-            closed = CloseHandle(self._handle)
+            closed = self._kernel.CloseHandle(self._handle)
             self._handle = None
 
-        CloseHandle(self._overlapped.hEvent)
-
-        self._overlapped = None
-        self._result = None
+        stream = getattr(self, '_stream', None)
+        if stream is not None:
+            del self._stream
+            stream.close(stop_watching=False)
+
+        self._buffers.close()
+        self._buffers = None
+        if self._coalescer is not None:
+            self._queued_results.extend(self._coalescer.flush())
+        if isinstance(self._queued_results, BoundedEventQueue):
+            #releases the spill file, the events left are dropped.
+            self._queued_results.close()
         self._watching = False
 
-        if hasattr(self, '_iocp'):
-            self._iocp.destroy()
-            del self._iocp
-
-
-    def _parse_read_directory_changes_result(self, location=0):
-        fmt = FILE_NOTIFY_INFORMATION_STRUCT
-        fmt_size = struct.calcsize(FILE_NOTIFY_INFORMATION_STRUCT)
-        next_entry = 1
-        pos = location
-        FindNextChangeNotification(self._handle)
-        bytes_read = DWORD()
-        old_overlapped = self._overlapped
-
-        while next_entry:
-            next_entry, action, namelen = struct.unpack_from(fmt, self._result[pos:])
-            str_pos = pos + fmt_size
-            str_len = namelen + str_pos
-            name = self._result[str_pos:str_len].decode('utf-16')
-            pos += next_entry
-            if action == FILE_ACTION_RENAMED_OLD_NAME:
-                renamed_old = name
-                continue
-            if action == FILE_ACTION_RENAMED_NEW_NAME:
-                yield ('Moved', renamed_old, name)
-                continue
-
-            yield (ACTION_DICT[action], name)
-
-        ret_value = GetOverlappedResult(self._handle, old_overlapped,
-                                        byref(bytes_read), True)
-        if not ret_value:
-            raise WinDirectoryWatcher, FormatError(GetLastError())
 
+    def _parse_read_directory_changes_result(self, wait=True):
+        if not wait:
+            #raises IoIncompleteError before the handle is re-armed, it
+            #stays signaled for the retry.
+            buf, bytes_read = self._buffers.complete(False)
+        if self._handle:
+            self._kernel.FindNextChangeNotification(self._handle)
+        #with more than one buffer the next read is already issued here,
+        #so the kernel keeps reporting while we decode.
+        if wait:
+            buf, bytes_read = self._buffers.complete()
+        completed_at = monotonic()
+        if not bytes_read:
+            #the kernel dropped the changes, the consumer should rescan.
+            results = [Event(ACTION_OVERFLOW, u'', None, self.watch_id,
+                             completed_at)]
+        else:
+            results = decode_notify_buffer(buf, bytes_read, 0, self.watch_id,
+                                           completed_at, self.path_filter)
         self._async_watch_directory()
+        self._metrics.record_completion(bytes_read, len(buf), results)
+        return results
+
+    @property
+    def overflows(self):
+        """how many times the kernel dropped events since start_watching."""
+        if not self._buffers:
+            return 0
+        return self._buffers.overflows
+
+    def stats(self, previous=None):
+        """
+        the pipeline counters (see metrics.WatcherMetrics) with the queues
+        and the wait pool, the rates are since previous (an older stats())
+        or since start_watching.
+        """
+        stats = self._metrics.snapshot(previous)
+        stats['overflows'] = self.overflows
+        stats['queue_depth'] = len(self._queued_results)
+        stats['coalescing'] = (len(self._coalescer)
+                               if self._coalescer is not None else 0)
+        stats['queue_counters'] = self.queue_counters
+        stats['pool_threads'] = getattr(getattr(self, '_wmfo', None),
+                                        'worker_threads', 0)
+        return stats
+
+    @property
+    def queue_counters(self):
+        """the events shed by the queue limits."""
+        queued = self._queued_results
+        return {'dropped': getattr(queued, 'dropped', 0),
+                'collapsed': getattr(queued, 'collapsed', 0),
+                'spilled': getattr(queued, 'spilled', 0)}
 
     def _auto_fetch_events(self):
-        self._wmfo = FSObjectWatcherWMFOPool()
+        if self.backend == BACKEND_IOCP:
+            self._wmfo = FSObjectWatcherIOCPPool(self._kernel)
+        else:
+            self._wmfo = FSObjectWatcherWMFOPool(self._kernel)
         self._wmfo.register(self)
+        self._pool = self._wmfo
 
-    def pool(self, timeout=-1):
+    def _fetch_events(self, timeout, draining=False):
         if not self._watching:
             raise DirectoryWatcherError, "Not Watching"
 
         if not hasattr(self, '_wmfo'):
             self._auto_fetch_events()
 
-        if self._queued_results:
-            return self._queued_results.pop(0)
+        coalescer = self._coalescer
+        if coalescer is None:
+            self._wmfo.pool(timeout)
+            if not draining:
+                self._metrics.wakes += 1
+            self._queued_results.extend(
+                    self._parse_read_directory_changes_result())
+            return
+
+        #don't wait past the moment the held events are due.
+        wait = timeout
+        deadline = coalescer.next_deadline()
+        if deadline is not None:
+            until_deadline = max(deadline - time.time(), 0)
+            if wait < 0 or until_deadline < wait:
+                wait = until_deadline
+        try:
+            self._wmfo.pool(wait)
+            if not draining:
+                self._metrics.wakes += 1
+            coalescer.extend(self._parse_read_directory_changes_result(),
+                             time.time())
+        except TimeoutError:
+            #the held events may be due even when nothing completed.
+            ready = coalescer.ready(time.time())
+            if not ready and wait == timeout:
+                raise
+            self._queued_results.extend(ready)
+            return
+        self._queued_results.extend(coalescer.ready(time.time()))
+
+    def _fetch_signaled(self, wait=True):
+        """
+        like _fetch_events, but without the wait pool, for a caller that
+        already waited for self._handle (the asyncio proactor). without
+        wait IoIncompleteError is raised if the read is still pending.
+        """
+        results = self._parse_read_directory_changes_result(wait)
+        self._metrics.wakes += 1
+        if self._coalescer is None:
+            self._queued_results.extend(results)
+        else:
+            self._coalescer.extend(results, time.time())
+
+    def _release_coalesced(self):
+        """move the held events that are due to the queue."""
+        if self._coalescer is not None:
+            self._queued_results.extend(self._coalescer.ready(time.time()))
+
+    def _take_queued(self):
+        """the queued events, without waiting."""
+        self._release_coalesced()
+        batch = list(self._queued_results)
+        self._queued_results.clear()
+        self._metrics.record_delivery(batch)
+        return batch
+
+    def _next_batch(self, timeout):
+        return self.pool_batch(None, timeout)
+
+    def events(self, loop=None, bridge=None):
+        """
+        an asyncio stream of the events: event = yield From(stream.get())
+        (see aio.AsyncEventStream for bridge).
+        """
+        from .aio import AsyncEventStream
+        return AsyncEventStream(self, loop, bridge)
+
+    def _async_stream(self, loop):
+        stream = getattr(self, '_stream', None)
+        if stream is None or stream.closed:
+            from .aio import AsyncEventStream
+            stream = self._stream = AsyncEventStream(self, loop)
+        return stream
+
+    def pool_async(self, loop=None):
+        """a future with the next event."""
+        return self._async_stream(loop).get()
+
+    def _wait_queued(self, timeout):
+        """
+        fetch until an event is queued, TimeoutError after timeout. the
+        coalescer can cut a wait short, the rest of timeout is kept.
+        """
+        queued = self._queued_results
+        deadline = time.time() + timeout if timeout >= 0 else None
+        while not queued:
+            self._fetch_events(timeout)
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0)
 
-        self._wmfo.pool(timeout)
-        self._queued_results = [i for i in
-                                self._parse_read_directory_changes_result()]
-        return self.pool(timeout)
+    def pool(self, timeout=-1):
+        queued = self._queued_results
+        self._wait_queued(timeout)
+        event = queued.popleft()
+        self._metrics.record_delivery((event,))
+        return event
+
+    def pool_batch(self, max_events=None, timeout=-1):
+        """
+        return a list with the queued events, waiting up to timeout for
+        the first completion. the completions already signaled are decoded
+        too (up to MAX_COMPLETIONS_PER_BATCH), until max_events is reached.
+        """
+        queued = self._queued_results
+        self._wait_queued(timeout)
+
+        for i in xrange(MAX_COMPLETIONS_PER_BATCH):
+            if max_events is not None and len(queued) >= max_events:
+                break
+            try:
+                self._fetch_events(0, draining=True)
+            except TimeoutError:
+                break
+
+        if max_events is None or len(queued) <= max_events:
+            batch = list(queued)
+            queued.clear()
+        else:
+            popleft = queued.popleft
+            batch = [popleft() for i in xrange(max_events)]
+        self._metrics.record_delivery(batch)
+        return batch
+
+    def iter_events(self, timeout=-1):
+        """yield the events as they come, until timeout without events."""
+        queued = self._queued_results
+        popleft = queued.popleft
+        while True:
+            while queued:
+                event = popleft()
+                self._metrics.record_delivery((event,))
+                yield event
+            try:
+                self._wait_queued(timeout)
+            except TimeoutError:
+                return
 
 
-class FSObjectWatcherWMFOPool(WaitForMultipleObjectsPool):
+class FSObjectWatcherWMFOPool(WaitPool):
 
-    def __init__(self):
+    def __init__(self, kernel=None, fair=False):
         self._handle_fs_object_watcher = {}
         self._fs_object_watcher_handle = {}
-        WaitForMultipleObjectsPool.__init__(self)
+        WaitPool.__init__(self, kernel or default_kernel(), fair)
 
-    def register(self, object_watcher):
+    def register(self, object_watcher, weight=1):
         handle = object_watcher._handle
-        WaitForMultipleObjectsPool.register_handle(self, handle)
+        WaitPool.register_handle(self, handle, weight)
         self._handle_fs_object_watcher[handle] = object_watcher
+        self._fs_object_watcher_handle[object_watcher] = handle
 
     def unregister(self, object_watcher):
-        for handle in self._fs_object_watcher_handle[object_watcher]:
-            WaitForMultipleObjectsPool.unregister_handle(self, handle)
-            del self._handle_fs_object_watcher[handle]
+        handle = self._fs_object_watcher_handle.pop(object_watcher)
+        WaitPool.unregister_handle(self, handle)
+        del self._handle_fs_object_watcher[handle]
 
     def pool(self, timeout=-1):
-        ret_val = WaitForMultipleObjectsPool.pool(self, timeout)
+        ret_val = WaitPool.pool(self, timeout)
         obj = self._handle_fs_object_watcher[ret_val]
         return (ret_val, obj)
+
+
+class FSObjectWatcherIOCPPool(CompletionPortEngine):
+    """
+    the FSObjectWatcherWMFOPool interface on a completion port, the
+    directory handles are registered instead of the change notifications.
+    """
+
+    def __init__(self, kernel=None):
+        self._fs_object_watcher_key = {}
+        CompletionPortEngine.__init__(self, kernel or default_kernel())
+
+    def register(self, object_watcher, weight=1):
+        #the completions come in order, weight is not used.
+        handle = object_watcher._file_handle
+        key = CompletionPortEngine.register(self, handle, object_watcher)
+        self._fs_object_watcher_key[object_watcher] = key
+
+    def unregister(self, object_watcher):
+        key = self._fs_object_watcher_key.pop(object_watcher)
+        CompletionPortEngine.unregister(self, key)
+
+    def pool(self, timeout=-1):
+        obj = CompletionPortEngine.pool(self, timeout)
+        return (obj._file_handle, obj)
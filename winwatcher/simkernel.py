@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+a pure python stand-in for the kernel32 calls used by the watchers.
+
+it exposes the same interface as win32_objects.Win32Kernel, but the
+directories are fed by hand with queue_changes, so the watcher logic can
+be tested (and load tested) on any platform.
+"""
+
+import threading
+import time
+from collections import deque
+
+from .errors import (WaitForMultipleObjectsError, IoCompletionPortError,
+                     IoIncompleteError)
+from .notify_parser import encode_notify_records
+from .win32_constants import WAIT_OBJECT_0, WAIT_TIMEOUT
+
+
+class SimulatedKernelError(EnvironmentError):
+    pass
+
+
+class SimulatedOverlapped(object):
+    """the fields we use from OVERLAPPED."""
+
+    def __init__(self, event=0):
+        self.Internal = 0
+        self.InternalHigh = 0
+        self.hEvent = event
+        self.completed = False
+
+
+class _SimulatedDirectory(object):
+    def __init__(self, path):
+        self.path = path
+        self.changes = []
+        self.pending = None
+        #the size of the kernel buffer, set by the first read.
+        self.buffer_size = None
+        self.port = None
+
+
+class SimulatedKernel(object):
+    def __init__(self):
+        self._mutex = threading.Condition(threading.RLock())
+        self._next_handle = 0x100
+        self._events = {}
+        self._manual_reset = set()
+        self._directories = {}
+        self._notifications = {}
+        self._watched_paths = {}
+        #the notifications with changes after they were signaled.
+        self._recorded = set()
+        self._ports = {}
+        self.reads = 0
+        self.waits = 0
+
+    def _new_handle(self):
+        self._next_handle += 4
+        return self._next_handle
+
+    def _check_handle(self, mapping, handle):
+        if handle not in mapping:
+            raise SimulatedKernelError, "invalid handle %r" % (handle,)
+        return mapping[handle]
+
+    #events
+
+    def CreateEvent(self):
+        with self._mutex:
+            handle = self._new_handle()
+            self._events[handle] = False
+            return handle
+
+    def SetEvent(self, event):
+        with self._mutex:
+            self._check_handle(self._events, event)
+            self._events[event] = True
+            self._mutex.notify_all()
+            return True
+
+    def ResetEvent(self, event):
+        with self._mutex:
+            self._check_handle(self._events, event)
+            self._events[event] = False
+            return True
+
+    def is_signaled(self, event):
+        with self._mutex:
+            return self._check_handle(self._events, event)
+
+    def CloseHandle(self, handle):
+        with self._mutex:
+            if handle in self._notifications:
+                path = self._notifications.pop(handle)
+                self._watched_paths[path].discard(handle)
+                self._recorded.discard(handle)
+            if handle in self._events:
+                del self._events[handle]
+                self._manual_reset.discard(handle)
+            elif handle in self._directories:
+                directory = self._directories.pop(handle)
+                directory.pending = None
+            elif handle in self._ports:
+                del self._ports[handle]
+            else:
+                return False
+            self._mutex.notify_all()
+            return True
+
+    #directories
+
+    def CreateFileDirectory(self, path):
+        with self._mutex:
+            handle = self._new_handle()
+            self._directories[handle] = _SimulatedDirectory(path)
+            return handle
+
+    def FindFirstChangeNotification(self, path, flags, recursive):
+        """
+        a change notification for path, signaled by queue_changes on any
+        directory handle opened on path with CreateFileDirectory.
+        """
+        with self._mutex:
+            handle = self.CreateEvent()
+            self._manual_reset.add(handle)
+            self._notifications[handle] = path
+            self._watched_paths.setdefault(path, set()).add(handle)
+            return handle
+
+    def FindNextChangeNotification(self, handle):
+        """
+        like the kernel, a change recorded while the handle was signaled
+        signals it again at once.
+        """
+        with self._mutex:
+            self._check_handle(self._notifications, handle)
+            if handle in self._recorded:
+                self._recorded.discard(handle)
+                return True
+            return self.ResetEvent(handle)
+
+    def FindCloseChangeNotification(self, handle):
+        return self.CloseHandle(handle)
+
+    def WaitForMultipleObjects(self, handles, timeout):
+        """
+        WaitForMultipleObjects without wait_all: the lowest signaled index
+        is returned, auto reset events are reset. timeout in milliseconds,
+        negative waits forever. a handle closed while it is waited for
+        fails the wait (it is undefined on windows).
+        """
+        deadline = None
+        if timeout >= 0:
+            deadline = time.time() + timeout / 1000.0
+        with self._mutex:
+            self.waits += 1
+            while True:
+                for handle in handles:
+                    if handle not in self._events:
+                        raise WaitForMultipleObjectsError, (
+                            "invalid handle %r" % (handle,))
+                for index, handle in enumerate(handles):
+                    if self._events[handle]:
+                        if handle not in self._manual_reset:
+                            self._events[handle] = False
+                        return WAIT_OBJECT_0 + index
+                if deadline is None:
+                    self._mutex.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return WAIT_TIMEOUT
+                self._mutex.wait(remaining)
+
+    def CreateBuffer(self, size):
+        return bytearray(size)
+
+    def CreateOverlapped(self, event):
+        return SimulatedOverlapped(event)
+
+    def ReadDirectoryChangesW(self, handle, buf, recursive, flags,
+                              overlapped):
+        with self._mutex:
+            directory = self._check_handle(self._directories, handle)
+            if directory.pending is not None:
+                raise SimulatedKernelError, "a read is already pending"
+            if directory.buffer_size is None:
+                directory.buffer_size = len(buf)
+            overlapped.Internal = 0
+            overlapped.InternalHigh = 0
+            overlapped.completed = False
+            directory.pending = (buf, overlapped)
+            self.reads += 1
+            self._flush(directory)
+            return True
+
+    def queue_changes(self, handle, changes):
+        """
+        simulate changes on the directory, changes is a list of
+        (action, name) pairs, as the kernel would report them.
+        """
+        with self._mutex:
+            directory = self._check_handle(self._directories, handle)
+            directory.changes.extend(changes)
+            self._notify(directory)
+            self._flush(directory)
+
+    def queue_overflow(self, handle):
+        """replay an overflow: the pending read completes with zero bytes."""
+        with self._mutex:
+            directory = self._check_handle(self._directories, handle)
+            directory.changes.append(None)
+            self._notify(directory)
+            self._flush(directory)
+
+    def _notify(self, directory):
+        for handle in self._watched_paths.get(directory.path, ()):
+            if self._events[handle]:
+                self._recorded.add(handle)
+            self._events[handle] = True
+        self._mutex.notify_all()
+
+    def _flush(self, directory):
+        if directory.pending is None or not directory.changes:
+            return
+        buf, overlapped = directory.pending
+        directory.pending = None
+        changes = directory.changes
+        directory.changes = []
+        if None in changes:
+            self._complete(directory, overlapped, 0)
+            return
+        data = encode_notify_records(changes)
+        if len(data) > min(len(buf), directory.buffer_size):
+            #like the kernel, the changes that don't fit are lost, its
+            #buffer keeps the size of the first read of the handle.
+            self._complete(directory, overlapped, 0)
+            return
+        buf[:len(data)] = data
+        self._complete(directory, overlapped, len(data))
+
+    def _complete(self, directory, overlapped, nbytes):
+        overlapped.InternalHigh = nbytes
+        overlapped.completed = True
+        if overlapped.hEvent in self._events:
+            self._events[overlapped.hEvent] = True
+        if directory.port is not None:
+            port, key = directory.port
+            if port in self._ports:
+                self._ports[port].append((nbytes, key, overlapped))
+        self._mutex.notify_all()
+
+    def GetOverlappedResult(self, handle, overlapped, wait):
+        with self._mutex:
+            while not overlapped.completed:
+                if not wait:
+                    raise IoIncompleteError, "overlapped I/O incomplete"
+                if handle not in self._directories:
+                    raise SimulatedKernelError, "the operation was aborted"
+                self._mutex.wait()
+            if overlapped.hEvent in self._events:
+                self._events[overlapped.hEvent] = False
+            return overlapped.InternalHigh
+
+    #completion ports
+
+    def CreateIoCompletionPort(self, handle, port, key):
+        with self._mutex:
+            if port is None:
+                port = self._new_handle()
+                self._ports[port] = deque()
+                return port
+            self._check_handle(self._ports, port)
+            directory = self._check_handle(self._directories, handle)
+            if directory.port is not None:
+                raise IoCompletionPortError, "handle already has a port"
+            directory.port = (port, key)
+            return port
+
+    def GetQueuedCompletionStatus(self, port, timeout):
+        """
+        (bytes, key, overlapped) of the next completion, or None on
+        timeout. timeout in milliseconds, negative waits forever.
+        """
+        deadline = None
+        if timeout >= 0:
+            deadline = time.time() + timeout / 1000.0
+        with self._mutex:
+            self.waits += 1
+            while True:
+                if port not in self._ports:
+                    raise IoCompletionPortError, "invalid port %r" % (port,)
+                packets = self._ports[port]
+                if packets:
+                    return packets.popleft()
+                if deadline is None:
+                    self._mutex.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._mutex.wait(remaining)
+
+    def PostQueuedCompletionStatus(self, port, nbytes, key, overlapped=None):
+        with self._mutex:
+            self._check_handle(self._ports, port).append(
+                    (nbytes, key, overlapped))
+            self._mutex.notify_all()
+            return True
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+the DirWatcher tree saved to a file, for a warm restart.
+
+the snapshot holds the tree state (every directory with its mtime and the
+names of its subdirectories and files) of a root and path filter. it is
+memory mapped and parsed in place when loaded, then the tree is brought up
+to date with rescan_tree_state: every known directory is stat'ed, only the
+ones whose mtime changed are listed again, and the events missed while
+nobody was watching come out of it.
+
+a file modified in place doesn't change its directory mtime, so only the
+additions and removals are found this way.
+
+layout, little endian, the strings are a uint32 length and utf-8 bytes:
+
+    magic, version (uint16), root, path filter signature,
+    directories (uint32), then for each one:
+    relpath, mtime (double, NaN if unknown), dirs (uint32), files (uint32),
+    the names of the dirs, the names of the files
+"""
+
+import errno
+import mmap
+import os
+import struct
+
+from .fs_tree import DirectoryState, TreeState
+
+SNAPSHOT_MAGIC = 'WWTS'
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('<4sH')
+_UINT = struct.Struct('<I')
+_RECORD = struct.Struct('<dII')
+_NAN = float('nan')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _root_key(root):
+    return os.path.normcase(os.path.abspath(root))
+
+
+def _signature(path_filter):
+    return path_filter.signature if path_filter else u''
+
+
+def _pack_string(out, value):
+    data = value.encode('utf-8')
+    out.append(_UINT.pack(len(data)))
+    out.append(data)
+
+
+def encode_snapshot(tree, root, path_filter=None):
+    """the snapshot of tree as a str."""
+    out = [_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION)]
+    _pack_string(out, _root_key(root))
+    _pack_string(out, _signature(path_filter))
+    out.append(_UINT.pack(len(tree)))
+    pack_string = _pack_string
+    pack_record = _RECORD.pack
+    for relpath, state in tree.iteritems():
+        pack_string(out, relpath)
+        mtime = state.mtime if state.mtime is not None else _NAN
+        out.append(pack_record(mtime, len(state.dirs), len(state.files)))
+        for name in state.dirs:
+            pack_string(out, name)
+        for name in state.files:
+            pack_string(out, name)
+    return ''.join(out)
+
+
+def decode_snapshot(data, root=None, path_filter=None):
+    """
+    the tree in data (a str or a mmap), SnapshotError if it is not a
+    snapshot or it was taken for another root or path filter.
+    """
+    unpack_uint = _UINT.unpack_from
+    unpack_record = _RECORD.unpack_from
+    uint_size = _UINT.size
+    record_size = _RECORD.size
+
+    try:
+        magic, version = _HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError, "not a tree snapshot"
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError, "unknown snapshot version %d" % (version,)
+        offset = _HEADER.size
+        strings = []
+        for i in range(2):
+            length, = unpack_uint(data, offset)
+            offset += uint_size
+            strings.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+        saved_root, signature = strings
+        if root is not None and saved_root != _root_key(root):
+            raise SnapshotError, "the snapshot is of %s" % (saved_root,)
+        if signature != _signature(path_filter):
+            raise SnapshotError, "the snapshot has another path filter"
+
+        count, = unpack_uint(data, offset)
+        offset += uint_size
+        tree = TreeState()
+        for i in xrange(count):
+            length, = unpack_uint(data, offset)
+            offset += uint_size
+            relpath = data[offset:offset + length].decode('utf-8')
+            offset += length
+            mtime, dirs, files = unpack_record(data, offset)
+            offset += record_size
+            names = []
+            for j in xrange(dirs + files):
+                length, = unpack_uint(data, offset)
+                offset += uint_size
+                names.append(data[offset:offset + length].decode('utf-8'))
+                offset += length
+            if mtime != mtime:
+                mtime = None
+            tree[relpath] = DirectoryState(mtime, set(names[:dirs]),
+                                           set(names[dirs:]))
+    except (struct.error, UnicodeDecodeError), error:
+        raise SnapshotError, "corrupted snapshot: %s" % (error,)
+    if offset != len(data):
+        raise SnapshotError, "corrupted snapshot: trailing data"
+    if u'' not in tree:
+        raise SnapshotError, "corrupted snapshot: the root is missing"
+    return tree
+
+
+def save_snapshot(snapshot_path, tree, root, path_filter=None):
+    """write the snapshot of tree, replacing the old one at once."""
+    data = encode_snapshot(tree, root, path_filter)
+    temp_path = snapshot_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.rename(temp_path, snapshot_path)
+    except OSError:
+        #windows doesn't rename over an existing file.
+        os.remove(snapshot_path)
+        os.rename(temp_path, snapshot_path)
+
+
+def load_snapshot(snapshot_path, root=None, path_filter=None):
+    """the tree saved in snapshot_path, None if there is no snapshot."""
+    try:
+        f = open(snapshot_path, 'rb')
+    except IOError, error:
+        if error.errno == errno.ENOENT:
+            return None
+        raise
+    with f:
+        if not os.fstat(f.fileno()).st_size:
+            raise SnapshotError, "corrupted snapshot: empty file"
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return decode_snapshot(mapped, root, path_filter)
+        finally:
+            mapped.close()
@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""
+the WaitForMultipleObjects pool.
+
+WaitForMultipleObjects can only wait for MAX_OBJECTS handles (plus our
+wake event), so the handles are kept in groups of MAX_OBJECTS slots and
+every group has a long lived worker thread waiting for it. a signaled
+handle is put on a queue and returned by pool.
+
+a handle keeps its slot while it is registered, registering and
+unregistering take a free slot or give it back, and only the worker of
+that group is woken up to wait for its new set of handles.
+unregister_handle returns once the worker waits without the handle, the
+caller can close it then.
+
+a change notification handle stays signaled until FindNextChangeNotification
+is called on it, so the worker stops waiting for a handle after reporting
+it, the handle is waited for again on the next call to pool (the caller
+must have called FindNextChangeNotification by then).
+
+WaitForMultipleObjects always reports the lowest signaled index, so with
+fair set a worker gathers every signaled handle after a wake (waiting again
+with a zero timeout on the handles after the reported one) and pool serves
+the ready handles by stride scheduling: the handle with the lowest pass is
+returned and its pass grows by 1/weight. with the same weight for every
+handle it is a round-robin, a busy handle can't starve the others.
+service_counts tells how many times each handle was returned.
+
+a handle the kernel fails to wait for (closed or recycled by its owner
+while registered) is reported once by pool, with the error, and not waited
+for anymore until it is unregistered: the other handles of its group are
+still waited for.
+
+kernel is any object with the interface of win32_objects.Win32Kernel,
+simkernel.SimulatedKernel can be used to test it without windows.
+"""
+
+from Queue import Queue, Empty
+from itertools import count
+import threading
+import time
+
+from .errors import WaitForMultipleObjectsError, TimeoutError
+from .win32_constants import (MAX_OBJECTS, WAIT_OBJECT_0,
+                              WAIT_OBJECT_ABANDONED_0, WAIT_INFINITE)
+
+#a failed wait with no broken handle found is retried after this delay.
+ERROR_RETRY_DELAY = 0.1
+
+
+class _Group(object):
+    __slots__ = ('id', 'slots', 'free', 'listed', 'thread', 'wake',
+                 'stopped', 'changes', 'seen')
+
+    def __init__(self, group_id):
+        self.id = group_id
+        self.slots = [None] * MAX_OBJECTS
+        self.free = range(MAX_OBJECTS - 1, -1, -1)
+        self.listed = False
+        self.thread = None
+        self.wake = None
+        self.stopped = False
+        #how many times the handles changed, and up to which change the
+        #worker waits for.
+        self.changes = 0
+        self.seen = 0
+
+    def handles(self):
+        return [h for h in self.slots if h is not None]
+
+
+class WaitPool(object):
+    def __init__(self, kernel, fair=False):
+        self._kernel = kernel
+        self.fair = fair
+        self._queue = Queue()
+        self._mutex = threading.Lock()
+        self._seen = threading.Condition(self._mutex)
+        self._group_ids = count()
+        self._groups = []
+        self._free_groups = []
+        self._slots = {}
+        self._started = False
+        self._in_flight = set()
+        self._broken = set()
+        self._returned = []
+        self._ready = set()
+        self._weights = {}
+        self._passes = {}
+        self._virtual_time = 0.0
+        self._served = {}
+
+    @property
+    def _handles(self):
+        return [h for group in self._groups for h in group.handles()]
+
+    @property
+    def _lphandles(self):
+        return [group.handles() for group in self._groups]
+
+    @property
+    def worker_threads(self):
+        """the threads waiting, one per group of MAX_OBJECTS handles."""
+        return sum(1 for group in self._groups if group.thread is not None)
+
+    def _free_group(self):
+        free_groups = self._free_groups
+        while free_groups:
+            group = free_groups[-1]
+            if group.free and not group.stopped:
+                return group
+            free_groups.pop()
+            group.listed = False
+
+        group = _Group(next(self._group_ids))
+        self._groups.append(group)
+        group.listed = True
+        free_groups.append(group)
+        return group
+
+    def register_handle(self, handle, weight=1):
+        with self._mutex:
+            if handle in self._slots:
+                return
+            group = self._free_group()
+            slot = group.free.pop()
+            group.slots[slot] = handle
+            self._slots[handle] = (group, slot)
+            self._weights[handle] = weight
+            self._passes[handle] = self._virtual_time
+            self._served[handle] = 0
+            new_worker = self._started and group.thread is None
+        if new_worker:
+            self._start_worker(group)
+        else:
+            self._wake(group)
+
+    def unregister_handle(self, handle):
+        with self._mutex:
+            group, slot = self._slots.pop(handle)
+            group.slots[slot] = None
+            group.free.append(slot)
+            self._in_flight.discard(handle)
+            self._broken.discard(handle)
+            self._ready.discard(handle)
+            del self._weights[handle], self._passes[handle]
+            del self._served[handle]
+            group.changes += 1
+            empty = len(group.free) == MAX_OBJECTS
+            if empty:
+                #stopped under the mutex, so register won't pick it.
+                group.stopped = True
+                self._groups.remove(group)
+            elif not group.listed:
+                group.listed = True
+                self._free_groups.append(group)
+        if empty:
+            self._stop_worker(group)
+        else:
+            self._wake(group)
+            self._wait_seen(group)
+
+    def _wait_seen(self, group):
+        """
+        wait until the worker of group waits without the handles removed,
+        so they can be closed (closing a handle being waited for is
+        undefined).
+        """
+        with self._mutex:
+            target = group.changes
+            while group.seen < target and not group.stopped:
+                thread = group.thread
+                if (thread is None or thread is threading.current_thread()
+                    or not thread.is_alive()):
+                    return
+                self._seen.wait()
+
+    def set_weight(self, handle, weight):
+        """with fair set, handle is served weight times as often."""
+        if weight <= 0:
+            raise ValueError, "weight should be positive"
+        with self._mutex:
+            if handle not in self._slots:
+                raise WaitForMultipleObjectsError, "handle is not registered"
+            self._weights[handle] = weight
+
+    def service_counts(self):
+        """{handle: times it was returned by pool}"""
+        with self._mutex:
+            return dict(self._served)
+
+    def _wake(self, group):
+        if group.wake is not None:
+            self._kernel.SetEvent(group.wake)
+
+    def _start_worker(self, group):
+        group.wake = self._kernel.CreateEvent()
+        group.thread = threading.Thread(name='WFMO-Worker-%d' % group.id,
+                                        target=self._WaitForMultipleObjectsWorker,
+                                        args=(group,))
+        group.thread.daemon = True
+        group.thread.start()
+
+    def _start_workers(self):
+        if self._started:
+            return
+        with self._mutex:
+            self._started = True
+            groups = [g for g in self._groups if g.thread is None]
+        for group in groups:
+            self._start_worker(group)
+
+    def _stop_worker(self, group):
+        group.stopped = True
+        if group.thread is None:
+            return
+        self._kernel.SetEvent(group.wake)
+        if group.thread is not threading.current_thread():
+            group.thread.join()
+        self._kernel.CloseHandle(group.wake)
+        group.thread = group.wake = None
+
+    def _release_returned(self):
+        """the handles returned by the last pool are waited for again."""
+        if not self._returned:
+            return
+        returned = self._returned
+        self._returned = []
+        if self.fair:
+            returned = self._still_signaled(returned)
+        groups = set()
+        with self._mutex:
+            for handle in returned:
+                self._in_flight.discard(handle)
+                if handle in self._slots:
+                    groups.add(self._slots[handle][0])
+        for group in groups:
+            self._wake(group)
+
+    def _report(self, handle):
+        with self._mutex:
+            if handle in self._in_flight or handle not in self._slots:
+                return False
+            self._in_flight.add(handle)
+        self._queue.put(handle)
+        return True
+
+    def _active_handles(self, group, worker=False):
+        with self._mutex:
+            if worker:
+                group.seen = group.changes
+                self._seen.notify_all()
+            in_flight, broken = self._in_flight, self._broken
+            return [h for h in group.slots
+                    if h is not None and h not in in_flight and
+                    h not in broken]
+
+    def _signaled_handle(self, lphandles, result):
+        if WAIT_OBJECT_0 <= result < WAIT_OBJECT_0 + len(lphandles):
+            return lphandles[result - WAIT_OBJECT_0]
+        if (WAIT_OBJECT_ABANDONED_0 <= result <
+            WAIT_OBJECT_ABANDONED_0 + len(lphandles)):
+            return lphandles[result - WAIT_OBJECT_ABANDONED_0]
+        return None
+
+    def _gather(self, lphandles, handle):
+        """
+        handle and the other signaled handles after it in lphandles,
+        found by waiting again with a zero timeout.
+        """
+        signaled = [handle]
+        rest = lphandles[lphandles.index(handle) + 1:]
+        while rest:
+            result = self._kernel.WaitForMultipleObjects(rest, 0)
+            handle = self._signaled_handle(rest, result)
+            if handle is None:
+                break
+            signaled.append(handle)
+            rest = rest[rest.index(handle) + 1:]
+        return signaled
+
+    def _poll_now(self):
+        """zero timeout: check every group from the calling thread."""
+        for group in self._groups[:]:
+            lphandles = self._active_handles(group)
+            if not lphandles:
+                continue
+            result = self._kernel.WaitForMultipleObjects(lphandles, 0)
+            handle = self._signaled_handle(lphandles, result)
+            if handle is None:
+                continue
+            if self.fair:
+                for handle in self._gather(lphandles, handle):
+                    self._report(handle)
+            else:
+                self._report(handle)
+
+    def pool(self, timeout=-1):
+        self._release_returned()
+
+        if not self._slots and timeout > 0:
+            raise TimeoutError
+
+        elif not self._slots:
+            raise WaitForMultipleObjectsError, "can't pool an empty list"
+
+        self._start_workers()
+
+        while True:
+            try:
+                if self.fair:
+                    handle = self._next_fair(timeout)
+                else:
+                    handle = self._parse_wfmo_result(
+                            self._next_result(timeout))
+            except Empty:
+                raise TimeoutError, "WFMO timeout expired"
+            if handle is not None:
+                with self._mutex:
+                    if handle in self._served:
+                        self._served[handle] += 1
+                return handle
+
+    def _next_fair(self, timeout):
+        ready = self._ready
+        if not ready:
+            self._mark_ready(self._next_result(timeout))
+        #everything already reported competes for this turn.
+        try:
+            while True:
+                self._mark_ready(self._queue.get_nowait())
+        except Empty:
+            pass
+
+        with self._mutex:
+            if not ready:
+                #only stale handles came, wait again.
+                return None
+            passes, slots = self._passes, self._slots
+            handle = min(ready, key=lambda h: (passes[h], slots[h][0].id,
+                                               slots[h][1]))
+            ready.remove(handle)
+            self._virtual_time = passes[handle]
+            passes[handle] += 1.0 / self._weights[handle]
+        self._returned.append(handle)
+        return handle
+
+    def _still_signaled(self, returned):
+        """
+        the returned handles that are signaled again are ready right away,
+        a busy handle would miss its turn waiting for the worker to report
+        it. return the others.
+        """
+        with self._mutex:
+            lphandles = [h for h in returned if h in self._slots]
+        if not lphandles:
+            return returned
+        result = self._kernel.WaitForMultipleObjects(lphandles, 0)
+        handle = self._signaled_handle(lphandles, result)
+        if handle is None:
+            return returned
+        signaled = self._gather(lphandles, handle)
+        for handle in signaled:
+            self._mark_ready(handle)
+        return [h for h in returned if h not in signaled]
+
+    def _mark_ready(self, ret_value):
+        if type(ret_value) is tuple:
+            self._parse_wfmo_result(ret_value)
+        with self._mutex:
+            if ret_value not in self._slots:
+                return
+            #an idle handle doesn't bank turns while it is not signaled.
+            if self._passes[ret_value] < self._virtual_time:
+                self._passes[ret_value] = self._virtual_time
+            self._ready.add(ret_value)
+
+    def _next_result(self, timeout):
+        if timeout == 0:
+            try:
+                return self._queue.get_nowait()
+            except Empty:
+                self._poll_now()
+            return self._queue.get_nowait()
+
+        elif timeout > 0:
+            return self._queue.get(True, timeout)
+
+        return self._queue.get()
+
+    def close(self):
+        with self._mutex:
+            groups = self._groups[:]
+            self._started = False
+        for group in groups:
+            self._stop_worker(group)
+            group.stopped = False
+
+    _cancel_all_threads = close
+
+    def _WaitForMultipleObjectsWorker(self, group):
+        try:
+            self._wait_group(group)
+        finally:
+            #an unregister waiting for this worker doesn't wait forever.
+            with self._mutex:
+                self._seen.notify_all()
+
+    def _wait_group(self, group):
+        kernel = self._kernel
+        wake = group.wake
+        while not group.stopped:
+            lphandles = [wake] + self._active_handles(group, True)
+            try:
+                result = kernel.WaitForMultipleObjects(lphandles,
+                                                       WAIT_INFINITE)
+            except WaitForMultipleObjectsError, error:
+                if group.stopped:
+                    return
+                self._wait_failed(group, lphandles[1:], error)
+                continue
+
+            handle = self._signaled_handle(lphandles, result)
+            if handle is None or handle == wake:
+                #woken up to stop or to wait for a new set of handles.
+                continue
+            if self.fair:
+                for handle in self._gather(lphandles, handle):
+                    self._report(handle)
+            else:
+                self._report(handle)
+
+    def _wait_failed(self, group, lphandles, error):
+        """
+        find the handles the kernel can't wait for and stop waiting for
+        them, the error is reported by pool unless they were unregistered
+        meanwhile.
+        """
+        broken = []
+        for handle in lphandles:
+            try:
+                result = self._kernel.WaitForMultipleObjects([handle], 0)
+            except WaitForMultipleObjectsError:
+                broken.append(handle)
+                continue
+            #an auto reset event was reset by the probe.
+            if self._signaled_handle([handle], result) is not None:
+                self._report(handle)
+        with self._mutex:
+            registered = [h for h in broken if h in self._slots]
+            self._broken.update(registered)
+        if registered:
+            error = type(error)('%s, not waiting for %s anymore' % (
+                    error, ', '.join('%r' % (h,) for h in registered)))
+        elif broken:
+            #closed after it was unregistered, the set is already right.
+            return
+        self._queue.put((group.id, error))
+        if not broken:
+            #nothing to drop, don't spin on a failing kernel.
+            time.sleep(ERROR_RETRY_DELAY)
+
+    def _parse_wfmo_result(self, ret_value):
+        if type(ret_value) is tuple:
+            group_id, error = ret_value
+            raise type(error), ('Thread(%d) %s' % (group_id, error))
+        with self._mutex:
+            if ret_value not in self._slots:
+                #unregistered after it was reported.
+                return None
+        self._returned.append(ret_value)
+        return ret_value
@@ -1,14 +1,37 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
+from collections import deque
 
-from .object_watcher import WinDirectoryWatcher, DirectoryWatcherError
+from .object_watcher import (WinDirectoryWatcher, DirectoryWatcherError,
+                             BACKEND_WFMO)
+from .event_queue import QUEUE_RESCAN_MARKER
+from .notify_buffers import DEFAULT_BUFFER_SIZE
+from .errors import TimeoutError
+from .fs_tree import (DirectoryState, TreeState, BackgroundTreeBuilder,
+                      build_tree_state_parallel, rescan_tree_state,
+                      rescan_directories, move_subtree, remove_subtree,
+                      index_is_dir, DEFAULT_TREE_WORKERS)
+from .metrics import DEFAULT_STATS_INTERVAL
+from .classify import EntryCache, DEFAULT_CACHE_TTL
+from .snapshot import save_snapshot, load_snapshot, SnapshotError
+from .events import ACTION_MOVED, ACTION_OVERFLOW
+from .win32_constants import (FILE_ACTION_ADDED, FILE_ACTION_REMOVED,
+                              FILE_ACTION_MODIFIED)
+
+DEFAULT_RESCAN_INTERVAL = 5.0
 
 
 class DirWatcherError(DirectoryWatcherError):
    pass
 
-def get_directory_tree(path):
+def get_directory_tree(path, path_filter=None, workers=DEFAULT_TREE_WORKERS,
+                       progress=None):
+   """
+   the relative paths of the directories, pruned by path_filter, listed by
+   workers threads (see fs_tree.build_tree_state_parallel for progress).
+   """
    if type(path) is not unicode:
       raise TypeError, "path should be unicode."
 
@@ -17,19 +40,10 @@ def get_directory_tree(path):
 
    if not os.path.isdir(path):
       raise OSError, "path is not a directory."
-   fs_tree = set()
-
-   for root, dirs, files in os.walk(path):
-      relative_root = root[len(path):]
-
-      while relative_root.endswith(os.path.sep):
-         relative_root = relative_root[:-1]
-      while relative_root.startswith(os.path.sep):
-         relative_root = relative_root[1:]
-
-      for d in dirs:
-         fs_tree.add(os.path.join(relative_root, d))
-
+   tree = build_tree_state_parallel(path, path_filter=path_filter,
+                                    workers=workers, progress=progress)
+   fs_tree = set(tree)
+   fs_tree.discard(u'')
    return fs_tree
 
 
@@ -39,68 +53,421 @@ class DirWatcher(WinDirectoryWatcher):
    but the events are more especifics:
    Moved will be DirectoryMoved or FileMoved and etc.
 
-   this happens by maintaning an internal tree in memory,
-   it could be a little slow to start watching in a bigger directory tree
+   this happens by maintaning an internal tree in memory, listed by
+   tree_workers threads, tree_progress(directories, files) tells how far
+   it is. with background_tree the directory is watched at once and the
+   tree is built by a thread meanwhile (tree_progress is called from it),
+   the events coming before it is done are classified by what is listed so
+   far or a stat, when it is done the directories those events changed
+   are listed again to bring it up to date (wait_for_tree waits for it).
+   if the background build fails the tree is built again on the observing
+   thread, then the error is raised once by the call that found it.
+   otherwise start_watching returns when the tree is built.
+   the tree tells the files from the directories. the paths it doesn't
+   know are looked up in the listings of their directories, made once per
+   directory for a batch of events and kept for entry_cache_ttl seconds
+   (see classify.EntryCache), or stat'ed. stat_calls and directory_scans
+   count them.
+
+   when the kernel drops events (Overflow) the tree is rescanned and the
+   missed DirectoryAdded, FileAdded, DirectoryRemoved and FileRemoved are
+   delivered after the Overflow event. rescans happen at most once every
+   rescan_interval seconds. the tree needs every event, so a full queue
+   (max_queued_events, max_queued_bytes) collapses into an Overflow by
+   default (QUEUE_RESCAN_MARKER), with the drop policies the whole tree
+   is rescanned after events were dropped.
+
+   with snapshot_path the tree is saved there by stop_watching (and
+   checkpoint), the next start_watching loads it instead of listing the
+   whole tree, only the directories whose mtime changed are listed and the
+   DirectoryAdded, FileAdded, DirectoryRemoved and FileRemoved missed
+   meanwhile are delivered first. a snapshot that can't be used is ignored,
+   a stop before the background tree is built saves nothing.
    """
 
-   def __init__(self, path, recursive=True):
-      super(DirWatcher, self).__init__(path, recursive)
+   def __init__(self, path, recursive=True,
+                rescan_interval=DEFAULT_RESCAN_INTERVAL, coalesce_window=None,
+                backend=BACKEND_WFMO, path_filter=None,
+                max_queued_events=None, max_queued_bytes=None,
+                queue_policy=QUEUE_RESCAN_MARKER, spill_path=None,
+                tree_workers=DEFAULT_TREE_WORKERS, tree_progress=None,
+                snapshot_path=None, entry_cache_ttl=DEFAULT_CACHE_TTL,
+                background_tree=True, stats_callback=None,
+                stats_interval=DEFAULT_STATS_INTERVAL,
+                buffer_size=DEFAULT_BUFFER_SIZE, kernel=None):
+      super(DirWatcher, self).__init__(path, recursive,
+                                       buffer_size=buffer_size,
+                                       coalesce_window=coalesce_window,
+                                       backend=backend, kernel=kernel,
+                                       path_filter=path_filter,
+                                       max_queued_events=max_queued_events,
+                                       max_queued_bytes=max_queued_bytes,
+                                       queue_policy=queue_policy,
+                                       spill_path=spill_path,
+                                       stats_callback=stats_callback,
+                                       stats_interval=stats_interval)
       self._evt_processor = {
-               'Added': self._added_event,
-               'Removed': self._removed_event,
-               'Modified': self._modified_event,
-               'Moved': self._moved_event
+               FILE_ACTION_ADDED: self._added_event,
+               FILE_ACTION_REMOVED: self._removed_event,
+               FILE_ACTION_MODIFIED: self._modified_event,
+               ACTION_MOVED: self._moved_event,
+               ACTION_OVERFLOW: self._overflow_event
          }
+      self.rescan_interval = rescan_interval
+      self.tree_workers = tree_workers
+      self.tree_progress = tree_progress
+      self.snapshot_path = snapshot_path
+      self.background_tree = background_tree
+      self._tree_builder = None
+      self._fs_tree = None
+      self._synthesized = deque()
+      self._rescans_pending = set()
+      #the directories changed while the tree is built in the background.
+      self._touched = set()
+      self._last_rescan = None
+      #the events dropped by the queue so far.
+      self._dropped = 0
+      self._entries = EntryCache(self.path, entry_cache_ttl)
+
+   def stats(self, previous=None):
+      """WinDirectoryWatcher.stats with the tree and its classification."""
+      stats = WinDirectoryWatcher.stats(self, previous)
+      builder = self._tree_builder
+      tree = builder.tree if builder is not None else self._fs_tree
+      stats['tree_size'] = len(tree) if tree is not None else 0
+      stats['tree_building'] = builder is not None and not builder.done
+      stats['stat_calls'] = self.stat_calls
+      stats['directory_scans'] = self.directory_scans
+      stats['synthesized'] = len(self._synthesized)
+      stats['rescans_pending'] = len(self._rescans_pending)
+      return stats
+
+   @property
+   def stat_calls(self):
+      return self._entries.stats
+
+   @property
+   def directory_scans(self):
+      return self._entries.scans
 
    def start_watching(self):
-      self._fs_tree = get_directory_tree(self.path)
-      return WinDirectoryWatcher.start_watching(self)
+      self._dropped = self.queue_counters['dropped']
+      tree = self._load_snapshot()
+      if tree is None and self.background_tree:
+         self._fs_tree = TreeState()
+         self._touched = set()
+         result = WinDirectoryWatcher.start_watching(self)
+         self._tree_builder = BackgroundTreeBuilder(
+                  self.path, self.path_filter, self.tree_workers,
+                  self.tree_progress)
+         self._tree_builder.start()
+         return result
+      if tree is None:
+         self._fs_tree = build_tree_state_parallel(
+                  self.path, path_filter=self.path_filter,
+                  workers=self.tree_workers, progress=self.tree_progress)
+         return WinDirectoryWatcher.start_watching(self)
 
-   def observe(self, timeout=-1):
-      obj = self.pool(timeout)
+      self._fs_tree = tree
+      #watching before the diff, a change in between is reported twice
+      #rather than lost.
+      result = WinDirectoryWatcher.start_watching(self)
+      self._synthesized.extend(rescan_tree_state(self.path, tree, u'',
+                                                 self.path_filter))
+      return result
+
+   def stop_watching(self):
+      WinDirectoryWatcher.stop_watching(self)
+      self._entries.clear()
+      builder = self._tree_builder
+      if builder is not None:
+         self._tree_builder = None
+         if not builder.done or builder.error is not None:
+            #a half built tree is no use for a snapshot.
+            builder.cancel()
+            self._fs_tree = None
+            return
+         #the snapshot diff catches what it missed since it was listed.
+         self._fs_tree = builder.tree
+      if self.snapshot_path is not None:
+         self.checkpoint()
+
+   def checkpoint(self):
+      """
+      save the tree to snapshot_path now. call it from the thread observing
+      the events, they change the tree.
+      """
+      if self.snapshot_path is None:
+         raise DirWatcherError, "there is no snapshot_path"
+      if self._tree_builder is not None:
+         raise DirWatcherError, "the tree is still being built"
+      if self._fs_tree is None:
+         raise DirWatcherError, "the tree was not built"
+      save_snapshot(self.snapshot_path, self._fs_tree, self.path,
+                    self.path_filter)
 
-      if len(obj) == 2:
-         evt, obj = obj
-         return self._evt_processor[evt](obj)
+   def wait_for_tree(self, timeout=None):
+      """
+      wait for the tree built in the background, True when it is in use.
+      call it from the thread observing the events. raises the error of a
+      failed build, once the tree was built again.
+      """
+      builder = self._tree_builder
+      if builder is not None and builder.wait(timeout):
+         self._adopt_tree()
+      return self._tree_builder is None
 
+   def _adopt_tree(self):
+      builder = self._tree_builder
+      if builder is None or not builder.done:
+         return
+      if builder.error is None:
+         tree = builder.tree
       else:
-         evt, oldobj, newobj = obj
-         return self._evt_processor[evt](oldobj, newobj)
+         #not going on with the empty tree, a failed build is left in
+         #place and tried again by the next call.
+         tree = build_tree_state_parallel(
+                  self.path, path_filter=self.path_filter,
+                  workers=self.tree_workers, progress=self.tree_progress)
+      self._tree_builder = None
+      self._fs_tree = tree
+      #the overflows while it was built, their changes are delivered.
+      roots = self._rescans_pending
+      self._rescans_pending = set()
+      for root in roots:
+         self._synthesized.extend(rescan_tree_state(self.path, tree, root,
+                                                    self.path_filter))
+      #the kernel delivered the rest already, the tree only catches up
+      #with the directories listed before they changed.
+      touched = self._touched
+      self._touched = set()
+      rescan_directories(self.path, tree, touched, self.path_filter)
+      if builder.error is not None:
+         raise builder.error
 
-   def __is_dir(self, obj):
-      return os.path.isdir(os.path.join(self.path, obj))
+   def _load_snapshot(self):
+      if self.snapshot_path is None:
+         return None
+      try:
+         return load_snapshot(self.snapshot_path, self.path,
+                              self.path_filter)
+      except (SnapshotError, EnvironmentError):
+         return None
 
-   def _added_event(self, obj):
+   def _wait_events(self, timeout, take):
+      """
+      wait for events like observe does, take(timeout) takes the kernel
+      events. returns None when synthesized events are ready instead.
+      """
+      deadline = time.time() + timeout if timeout >= 0 else None
+
+      while True:
+         self._rescan_if_due()
+         if self._synthesized:
+            return None
+
+         pool_timeout = timeout
+         if deadline is not None:
+            pool_timeout = max(deadline - time.time(), 0)
+         if self._rescans_pending:
+            until_rescan = max(self._next_rescan() - time.time(), 0)
+            if pool_timeout < 0 or until_rescan < pool_timeout:
+               pool_timeout = until_rescan
+
+         try:
+            return take(pool_timeout)
+         except TimeoutError:
+            if not self._rescans_pending or (deadline is not None and
+                                             time.time() >= deadline):
+               raise
+
+   def observe(self, timeout=-1):
+      obj = self._wait_events(timeout, self.pool)
+      if obj is None:
+         return self._synthesized.popleft()
+      return self._process_event(obj)
+
+   def observe_batch(self, max_events=None, timeout=-1):
+      """
+      like pool_batch, but with the DirWatcher events. max_events limits
+      the events taken from the kernel, the events synthesized by a rescan
+      are delivered right after the Overflow that caused them. the paths
+      of the whole batch are classified together (see EntryCache).
+      """
+      raw_events = self._wait_events(
+            timeout, lambda t: self.pool_batch(max_events, t))
+      synthesized = self._synthesized
+      batch = []
+      if raw_events is None:
+         batch.extend(synthesized)
+         synthesized.clear()
+         if max_events is not None and len(batch) >= max_events:
+            return batch
+         remaining = None
+         if max_events is not None:
+            remaining = max_events - len(batch)
+         try:
+            raw_events = self.pool_batch(remaining, 0)
+         except TimeoutError:
+            return batch
+
+      self._prefetch_entries(raw_events)
+      process = self._process_event
+      for obj in raw_events:
+         batch.append(process(obj))
+         while synthesized:
+            batch.append(synthesized.popleft())
+      return batch
+
+   def iter_observe(self, timeout=-1):
+      """yield the DirWatcher events until timeout without events."""
+      while True:
+         try:
+            batch = self.observe_batch(None, timeout)
+         except TimeoutError:
+            return
+         for evt in batch:
+            yield evt
+
+   def _take_queued(self):
+      self._rescan_if_due()
+      synthesized = self._synthesized
+      batch = list(synthesized)
+      synthesized.clear()
+      raw_events = WinDirectoryWatcher._take_queued(self)
+      self._prefetch_entries(raw_events)
+      for obj in raw_events:
+         batch.append(self._process_event(obj))
+         batch.extend(synthesized)
+         synthesized.clear()
+      return batch
+
+   def _next_batch(self, timeout):
+      return self.observe_batch(None, timeout)
+
+   def observe_async(self, loop=None):
+      """
+      a future with the next DirWatcher event, for asyncio:
+      event = yield From(watcher.observe_async())
+      """
+      return self._async_stream(loop).get()
+
+   def _prefetch_entries(self, raw_events):
+      known = self._index_is_dir
+      unknown = [e.path for e in raw_events
+                 if e.action in (FILE_ACTION_ADDED, FILE_ACTION_MODIFIED,
+                                 ACTION_MOVED) and known(e.path) is None]
+      if unknown:
+         self._entries.prefetch(unknown)
+
+   def _process_event(self, event):
+      if self._tree_builder is not None:
+         touched = self._touched
+         touched.add(os.path.dirname(event.path))
+         if event.old_path is not None:
+            touched.add(os.path.dirname(event.old_path))
+      return self._evt_processor[event.action](event)
+
+   def _next_rescan(self):
+      if self._tree_builder is not None:
+         #checking the build meanwhile.
+         return time.time() + self.rescan_interval
+      if self._last_rescan is None:
+         return 0
+      return self._last_rescan + self.rescan_interval
+
+   def _rescan_if_due(self):
+      if self._tree_builder is not None:
+         self._adopt_tree()
+      dropped = self.queue_counters['dropped']
+      if dropped != self._dropped:
+         #the queue shed events the tree needed.
+         self._dropped = dropped
+         self._rescans_pending.add(u'')
+      if not self._rescans_pending or time.time() < self._next_rescan():
+         return
+      self._last_rescan = time.time()
+      roots = self._rescans_pending
+      self._rescans_pending = set()
+      for root in roots:
+         self._synthesized.extend(rescan_tree_state(self.path, self._fs_tree,
+                                                    root, self.path_filter))
+
+   def __is_dir(self, obj, stat_obj=None):
+      """
+      answered by the tree, the unknown paths are stat'ed (stat_obj in
+      place of obj, for the old name of a move that is gone).
+      """
+      isdir = self._index_is_dir(obj)
+      if isdir is None:
+         isdir = self._entries.is_dir(stat_obj or obj)
+      return isdir
+
+   def _index_is_dir(self, obj):
+      isdir = index_is_dir(self._fs_tree, obj)
+      if isdir is None and self._tree_builder is not None:
+         #what the builder listed so far.
+         isdir = index_is_dir(self._tree_builder.tree, obj)
+      return isdir
+
+   def _parent_state(self, obj):
+      return self._fs_tree.get(os.path.dirname(obj))
+
+   def _added_event(self, event):
+      obj = event.path
       isdir = self.__is_dir(obj)
+      parent = self._parent_state(obj)
       if isdir:
-         self._fs_tree.add(obj)
+         self._fs_tree.setdefault(obj, DirectoryState())
+         if parent is not None:
+            parent.dirs.add(os.path.basename(obj))
+      elif parent is not None:
+         parent.files.add(os.path.basename(obj))
       evt = 'DirectoryAdded' if isdir else 'FileAdded'
       return (evt, obj)
 
-   def _moved_event(self, old_obj, new_obj):
-      isdir = self.__is_dir(old_obj)
-      if isdir:
-         self._fs_tree.remove(old_obj)
-         self._fs_tree.add(new_obj)
+   def _moved_event(self, event):
+      old_obj, new_obj = event.old_path, event.path
+      isdir = self.__is_dir(old_obj, new_obj)
+      self._entries.forget(old_obj)
+      if not move_subtree(self._fs_tree, old_obj, new_obj):
+         old_parent = self._parent_state(old_obj)
+         if old_parent is not None:
+            names = old_parent.dirs if isdir else old_parent.files
+            names.discard(os.path.basename(old_obj))
+         new_parent = self._parent_state(new_obj)
+         if new_parent is not None:
+            names = new_parent.dirs if isdir else new_parent.files
+            names.add(os.path.basename(new_obj))
       evt = 'DirectoryMoved' if isdir else 'FileMoved'
       return (evt, old_obj, new_obj)
 
-   def _removed_event(self, obj):
+   def _removed_event(self, event):
+      obj = event.path
+      self._entries.forget(obj)
       if obj in self._fs_tree:
          isdir = True
-         self._fs_tree.remove(obj)
+         remove_subtree(self._fs_tree, obj)
       else:
-         isdir = False
+         #it is gone, an unknown path can't be stat'ed.
+         isdir = bool(self._index_is_dir(obj))
+         parent = self._parent_state(obj)
+         if parent is not None:
+            names = parent.dirs if isdir else parent.files
+            names.discard(os.path.basename(obj))
       evt = 'DirectoryRemoved' if isdir else 'FileRemoved'
 
       return (evt, obj)
 
-   def _modified_event(self, obj):
+   def _modified_event(self, event):
+      obj = event.path
       isdir = self.__is_dir(obj)
       evt = 'DirectoryModified' if isdir else 'FileModified'
       return (evt, obj)
 
-
-
-
-
+   def _overflow_event(self, event):
+      obj = event.path
+      #the tree under obj is stale, it is rescanned as soon as allowed.
+      self._rescans_pending.add(obj)
+      self._rescan_if_due()
+      return ('Overflow', obj)
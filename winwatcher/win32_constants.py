@@ -0,0 +1,72 @@
+# -*- coding:utf-8 -*-
+
+#constants
+INVALID_HANDLE_VALUE = ~0
+FILE_NOTIFY_CHANGE_FILE_NAME = 0x00000001
+FILE_NOTIFY_CHANGE_DIR_NAME = 0x00000002
+FILE_NOTIFY_CHANGE_ATTRIBUTES = 0x00000004
+FILE_NOTIFY_CHANGE_SIZE = 0x00000008
+FILE_NOTIFY_CHANGE_LAST_WRITE = 0x00000010
+FILE_NOTIFY_CHANGE_SECURITY = 0x00000100
+
+
+MAX_OBJECTS = 0x3F
+WAIT_OBJECT_0 = 0x00000000
+WAIT_OBJECT_ABANDONED_0 = 0x00000080
+WAIT_TIMEOUT = 0x00000102L
+WAIT_FAILED = ~0 # -1
+WAIT_INFINITE = ~0 # -1
+
+ERROR_IO_INCOMPLETE = 996
+
+THREAD_ACCESS_DELETE = 0x00010000L
+THREAD_ACCESS_READ_CONTROL = 0x00020000L
+THREAD_ACCESS_SYNCHRONIZE = 0x00100000L
+THREAD_ACCESS_DAC = 0x00040000L
+THREAD_ACCESS_WRITE_OWNER = 0x00080000L
+
+
+FILE_ACTION_ADDED = 0x1
+FILE_ACTION_REMOVED = 0x2
+FILE_ACTION_MODIFIED = 0x3
+FILE_ACTION_RENAMED_OLD_NAME = 0x4
+FILE_ACTION_RENAMED_NEW_NAME = 0x5
+
+FILE_LIST_DIRECTORY = 0x01
+FILE_SHARE_READ = 0x01
+FILE_SHARE_WRITE = 0x02
+OPEN_EXISTING = 3
+FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+FILE_FLAG_OVERLAPPED = 0x40000000
+
+FILE_ATTRIBUTE_REPARSE_POINT = 0x400
+
+
+FILE_NOTIFY_CHANGE_ALL_BUT_SECURITY = (FILE_NOTIFY_CHANGE_FILE_NAME |
+                                       FILE_NOTIFY_CHANGE_ATTRIBUTES |
+                                       FILE_NOTIFY_CHANGE_DIR_NAME |
+                                       FILE_NOTIFY_CHANGE_LAST_WRITE |
+                                       FILE_NOTIFY_CHANGE_SIZE)
+
+
+FILE_NOTIFY_CHANGE_ALL = (FILE_NOTIFY_CHANGE_ALL_BUT_SECURITY |
+                          FILE_NOTIFY_CHANGE_SECURITY)
+
+NOTIFY_CONSTANTS = {'ChangeFileName': FILE_NOTIFY_CHANGE_FILE_NAME,
+                    'ChangeDirName' : FILE_NOTIFY_CHANGE_DIR_NAME,
+                    'ChangeAttributes' : FILE_NOTIFY_CHANGE_ATTRIBUTES,
+                    'ChangeSize' : FILE_NOTIFY_CHANGE_SIZE,
+                    'LastWrite' : FILE_NOTIFY_CHANGE_LAST_WRITE,
+                    'ChangeSecurity' : FILE_NOTIFY_CHANGE_SECURITY
+                   }
+
+
+ACTION_DICT = {
+        FILE_ACTION_ADDED: "Added",
+        FILE_ACTION_REMOVED: "Removed",
+        FILE_ACTION_MODIFIED: "Modified",
+        FILE_ACTION_RENAMED_OLD_NAME: "RenamedOld",
+        FILE_ACTION_RENAMED_NEW_NAME: "RenamedNew"
+    }
+
+FILE_NOTIFY_INFORMATION_STRUCT = "iii"
@@ -2,61 +2,16 @@
 
 from ctypes import (windll, c_wchar_p, c_long, c_int, c_uint, c_void_p,
                     c_int32,  Structure, wstring_at, c_wchar, c_wchar_p,
-                    POINTER, c_ulong)
+                    POINTER, c_ulong, c_size_t)
 from ctypes.wintypes import (DWORD, HANDLE, BOOL, LPWSTR, LPVOID, GetLastError,
                              FormatError, WCHAR, LPCWSTR)
 from ctypes import byref
 
+from .win32_constants import *
+
 #kernel endpoint
 kernel32 = windll.kernel32
 
-#constants
-INVALID_HANDLE_VALUE = ~0
-FILE_NOTIFY_CHANGE_FILE_NAME = 0x00000001
-FILE_NOTIFY_CHANGE_DIR_NAME = 0x00000002
-FILE_NOTIFY_CHANGE_ATTRIBUTES = 0x00000004
-FILE_NOTIFY_CHANGE_SIZE = 0x00000008
-FILE_NOTIFY_CHANGE_LAST_WRITE = 0x00000010
-FILE_NOTIFY_CHANGE_SECURITY = 0x00000100
-
-
-MAX_OBJECTS = 0x3F
-WAIT_OBJECT_0 = 0x00000000
-WAIT_OBJECT_ABANDONED_0 = 0x00000080
-WAIT_TIMEOUT = 0x00000102L
-WAIT_FAILED = ~0 # -1
-WAIT_INFINITE = ~0 # -1
-
-THREAD_ACCESS_DELETE = 0x00010000L
-THREAD_ACCESS_READ_CONTROL = 0x00020000L
-THREAD_ACCESS_SYNCHRONIZE = 0x00100000L
-THREAD_ACCESS_DAC = 0x00040000L
-THREAD_ACCESS_WRITE_OWNER = 0x00080000L
-
-
-FILE_ACTION_ADDED = 0x1
-FILE_ACTION_REMOVED = 0x2
-FILE_ACTION_MODIFIED = 0x3
-FILE_ACTION_RENAMED_OLD_NAME = 0x4
-FILE_ACTION_RENAMED_NEW_NAME = 0x5
-
-FILE_LIST_DIRECTORY = 0x01
-FILE_SHARE_READ = 0x01
-FILE_SHARE_WRITE = 0x02
-OPEN_EXISTING = 3
-FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
-FILE_FLAG_OVERLAPPED = 0x40000000
-
-
-FILE_NOTIFY_CHANGE_ALL_BUT_SECURITY = (FILE_NOTIFY_CHANGE_FILE_NAME |
-                                       FILE_NOTIFY_CHANGE_ATTRIBUTES |
-                                       FILE_NOTIFY_CHANGE_DIR_NAME |
-                                       FILE_NOTIFY_CHANGE_LAST_WRITE |
-                                       FILE_NOTIFY_CHANGE_SIZE)
-
-
-FILE_NOTIFY_CHANGE_ALL = (FILE_NOTIFY_CHANGE_ALL_BUT_SECURITY |
-                          FILE_NOTIFY_CHANGE_SECURITY)
 
 #structs
 
@@ -180,9 +135,17 @@ GetOverlappedResult.argtypes = (HANDLE, LPOVERLAPPED, POINTER(DWORD), BOOL)
 
 CreateIoCompletionPort = kernel32.CreateIoCompletionPort
 
-CreateIoCompletionPort.argtypes = (HANDLE, HANDLE, POINTER(c_ulong), DWORD)
+#the completion key is pointer sized
+ULONG_PTR = c_size_t
+
+CreateIoCompletionPort.argtypes = (HANDLE, HANDLE, ULONG_PTR, DWORD)
 CreateIoCompletionPort.restype = HANDLE
 
 GetQueuedCompletionStatus = kernel32.GetQueuedCompletionStatus
-GetQueuedCompletionStatus.argtypes = (HANDLE, POINTER(DWORD), POINTER(c_ulong),
-                                      LPOVERLAPPED, DWORD)
+GetQueuedCompletionStatus.argtypes = (HANDLE, POINTER(DWORD), POINTER(ULONG_PTR),
+                                      POINTER(LPOVERLAPPED), DWORD)
+GetQueuedCompletionStatus.restype = BOOL
+
+PostQueuedCompletionStatus = kernel32.PostQueuedCompletionStatus
+PostQueuedCompletionStatus.argtypes = (HANDLE, DWORD, ULONG_PTR, LPOVERLAPPED)
+PostQueuedCompletionStatus.restype = BOOL
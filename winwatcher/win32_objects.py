@@ -3,43 +3,18 @@
 import os
 import sys
 import struct
-from Queue import Queue, Empty
 import threading, thread
+from ctypes import create_string_buffer
 
 
 from .win32_defs import *
 from .win32_defs import (_CreateEvent, _FindFirstChangeNotification,
                          _WaitForMultipleObjects)
-
-
-class DirectoryWatcherError(WindowsError):
-    pass
-
-class WaitForMultipleObjectsError(WindowsError):
-    pass
-
-class TimeoutError(WaitForMultipleObjectsError):
-    pass
-
-
+from .errors import (DirectoryWatcherError, WaitForMultipleObjectsError,
+                     TimeoutError, IoCompletionPortError, IoIncompleteError)
+from .wait_pool import WaitPool
 
-NOTIFY_CONSTANTS = {'ChangeFileName': FILE_NOTIFY_CHANGE_FILE_NAME,
-                    'ChangeDirName' : FILE_NOTIFY_CHANGE_DIR_NAME,
-                    'ChangeAttributes' : FILE_NOTIFY_CHANGE_ATTRIBUTES,
-                    'ChangeSize' : FILE_NOTIFY_CHANGE_SIZE,
-                    'LastWrite' : FILE_NOTIFY_CHANGE_LAST_WRITE,
-                    'ChangeSecurity' : FILE_NOTIFY_CHANGE_SECURITY
-                   }
 
-
-ACTION_DICT = {
-        FILE_ACTION_ADDED: "Added",
-        FILE_ACTION_REMOVED: "Removed",
-        FILE_ACTION_MODIFIED: "Modified",
-        FILE_ACTION_RENAMED_OLD_NAME: "RenamedOld",
-        FILE_ACTION_RENAMED_NEW_NAME: "RenamedNew"
-    }
-
 def CreateEvent():
     return _CreateEvent(None, False, False, None)
 
@@ -60,14 +35,11 @@ def CreateFileDirectory(path):
                          None)
     return handle
 
-class IoCompletionPortError(WindowsError):
-    pass
-
 class IoCompletionPort(object):
     def __init__(self):
         self._fsobjects = {}
         self._iocp_key = CreateIoCompletionPort(INVALID_HANDLE_VALUE,
-                                                None, None, 0)
+                                                None, 0, 0)
         if self._iocp_key is None:
             raise IoCompletionPortError, ("cannot create io "
                                           "completion port in this system")
@@ -75,19 +47,19 @@ class IoCompletionPort(object):
     def attach_fsobject(self, fsobject):
         if fsobject in self._fsobjects:
             return
-        completion_key = c_ulong()
+        completion_key = id(fsobject)
 
         self._fsobjects[fsobject] = completion_key
         CreateIoCompletionPort(fsobject._handle, self._iocp_key,
-                               byref(completion_key), 0)
+                               completion_key, 0)
 
     def fsobject_get_status(self, fsobject):
         if not fsobject in self._fsobjects:
             raise IoCompletionPortError, ("object is not attached to "
                                           "io completion port")
         bytes_to_read = DWORD()
-        completion_key = self._fsobjects[fsobject]
-        over = OVERLAPPED()
+        completion_key = ULONG_PTR()
+        over = LPOVERLAPPED()
 
         res = GetQueuedCompletionStatus(self._iocp_key, byref(bytes_to_read),
                                         byref(completion_key),
@@ -101,130 +73,118 @@ class IoCompletionPort(object):
 
 
 
-FILE_NOTIFY_INFORMATION_STRUCT = "iii"
-
+class Win32Kernel(object):
+    """
+    the kernel32 calls used by the watchers behind a small interface,
+    simkernel.SimulatedKernel implements the same one without windows.
+    """
 
-class WaitForMultipleObjectsPool(object):
-    def __init__(self):
-        self._queue = Queue()
-        self._mutex = threading.Lock()
-        self._handles = []
-        self._lphandles = []
-        self._threads = []
-
-    def register_handle(self, handle):
-        self._handles.append(handle)
-        with self._mutex:
-            self._update_lphandles()
-
-    def _update_lphandles(self):
-        handles = self._handles[:]
-        self._lphandles = []
-        while handles:
-            handle_slice = handles[:MAX_OBJECTS]
-            handles = handles[MAX_OBJECTS:]
-            lphandles = handle_slice
-            self._lphandles.append(lphandles)
-
-    def unregister_handle(self, handle):
-        self._handles.remove(handle)
-        with self._mutex:
-            self._update_lphandles()
-
-    def __start_workers(self, timeout):
-
-        for index, handles in enumerate(self._lphandles):
-            event = CreateEvent()
-
-            count = len(handles) + 1
-            lphandles = [event] + handles
-            thread = threading.Thread(name='WFMO-Worker-%d' % index,
-                                      target=self._WaitForMultipleObjectsWorker,
-                                      args=(index, lphandles, timeout))
-            self._threads.append((thread, event))
-            thread.start()
-
-
-    def pool(self, timeout=-1):
-
-        try:
-            handle_id = self._queue.get_nowait()
-            return self._parse_wfmo_result(handle_id)
-        except Empty:
-            pass
-
-        self._cancel_all_threads()
-
-        if len(self._lphandles) > 0:
-            self.__start_workers(timeout)
-
-        elif not self._lphandles and timeout > 0:
-            raise TimeoutError
-
-        elif not self._lphandles:
-            raise WaitForMultipleObjectsError, "can't pool an empty list"
-
-        return self._parse_wfmo_result(self._queue.get())
-
-    def _cancel_all_threads(self):
-        for thread, event in self._threads:
-            SetEvent(event)
-            try:
-                thread.join()
-            except RuntimeError:
-                pass
-            CloseHandle(event)
-        self._threads = []
-
-    def _WaitForMultipleObjectsWorker(self, index, lphandles,
-                                      timeout=-1):
-
-        #NOTE: we can't put the WaitForMultipleEvents on a while just waiting
-        #      for next event, because sometimes the user needs to signal
-        #      the event as seen. so, it will fail.
-        wait_all = False
-        with self._mutex:
-            lphandles = (HANDLE * len(lphandles))(*lphandles)
-
-        if timeout > 0:
-            timeout = int(timeout * 1000)
-
-        result = _WaitForMultipleObjects(len(lphandles),
-                                         lphandles, False,
-                                         timeout)
+    def CreateEvent(self):
+        return CreateEvent()
 
-        if result == WAIT_FAILED:
-            self._queue.put(index, GetLastError(), FormatError(GetLastError()))
+    def SetEvent(self, event):
+        return SetEvent(event)
 
-        elif result in (WAIT_OBJECT_ABANDONED_0, WAIT_OBJECT_0):
-            #used when we got the first event.
-            #we don't need the first event because it is used to cancel
-            return
+    def ResetEvent(self, event):
+        return ResetEvent(event)
+
+    def CloseHandle(self, handle):
+        return CloseHandle(handle)
+
+    def CreateFileDirectory(self, path):
+        return CreateFileDirectory(path)
+
+    def CreateBuffer(self, size):
+        return create_string_buffer(size)
 
-        elif result == WAIT_TIMEOUT:
-            self._queue.put((index, TimeoutError, "WFMO timeout expired"))
+    def CreateOverlapped(self, event):
+        overlapped = OVERLAPPED()
+        overlapped.hEvent = event
+        return overlapped
 
-        elif result > WAIT_OBJECT_ABANDONED_0:
-            obj = (WAIT_OBJECT_ABANDONED_0 - result - 1) + (MAX_OBJECTS * index)
-            self._queue.put(obj)
+    def ReadDirectoryChangesW(self, handle, buf, recursive, flags,
+                              overlapped):
+        overlapped.Internal = 0
+        overlapped.InternalHigh = 0
+        overlapped.Offset = 0
+        overlapped.OffsetHigh = 0
+        overlapped.Pointer = 0
+        ret_value = ReadDirectoryChangesW(handle, byref(buf), len(buf),
+                                          recursive, flags, None,
+                                          overlapped, None)
+        if not ret_value:
+            raise DirectoryWatcherError, FormatError(GetLastError())
+        return ret_value
 
-        else:
-            obj = result - 1 + (MAX_OBJECTS * index)
-            self._queue.put(obj)
+    def FindFirstChangeNotification(self, path, flags, recursive):
+        return FindFirstChangeNotification(path, flags, recursive)
 
-    def _parse_wfmo_result(self, ret_value):
-        if type(ret_value) is tuple:
-            index, error, desc = ret_value
-            if type(error) is int:
-                raise WaitForMultipleObjectsError, (
-                    "Thread(%d): Failed %d: %s" % (ret_value)
-                )
-            else:
-                raise error, ('Thread(%d) %s' % (index, error))
-        try:
-            return self._handles[ret_value]
-        except:
-            raise DirectoryWatcherError, "unhandled error, trying to get an event that doesn't exists, race condition?"
+    def FindNextChangeNotification(self, handle):
+        return FindNextChangeNotification(handle)
 
+    def FindCloseChangeNotification(self, handle):
+        return FindCloseChangeNotification(handle)
+
+    def WaitForMultipleObjects(self, handles, timeout):
+        lphandles = (HANDLE * len(handles))(*handles)
+        result = _WaitForMultipleObjects(len(handles), lphandles, False,
+                                         timeout)
+        if result == WAIT_FAILED:
+            raise WaitForMultipleObjectsError, FormatError(GetLastError())
+        return result
+
+    def GetOverlappedResult(self, handle, overlapped, wait):
+        """without wait IoIncompleteError is raised while it is pending."""
+        bytes_read = DWORD()
+        ret_value = GetOverlappedResult(handle, overlapped,
+                                        byref(bytes_read), wait)
+        if not ret_value:
+            error = GetLastError()
+            if error == ERROR_IO_INCOMPLETE:
+                raise IoIncompleteError, FormatError(error)
+            raise DirectoryWatcherError, FormatError(error)
+        return bytes_read.value
+
+    def CreateIoCompletionPort(self, handle, port, key):
+        """
+        with port None a new completion port is created, otherwise handle
+        is associated to port and its completions are queued with key.
+        """
+        if port is None:
+            handle = INVALID_HANDLE_VALUE
+        ret_value = CreateIoCompletionPort(handle, port, key, 0)
+        if not ret_value:
+            raise IoCompletionPortError, FormatError(GetLastError())
+        return ret_value
+
+    def GetQueuedCompletionStatus(self, port, timeout):
+        """
+        (bytes, key, overlapped) of the next completion or None on timeout,
+        overlapped is None for the packets posted by
+        PostQueuedCompletionStatus.
+        """
+        nbytes = DWORD()
+        key = ULONG_PTR()
+        overlapped = LPOVERLAPPED()
+        ret_value = GetQueuedCompletionStatus(port, byref(nbytes), byref(key),
+                                              byref(overlapped), timeout)
+        if not overlapped:
+            if ret_value:
+                return (nbytes.value, key.value, None)
+            error = GetLastError()
+            if error == WAIT_TIMEOUT:
+                return None
+            raise IoCompletionPortError, FormatError(error)
+        #a failed read dequeues a packet too, GetOverlappedResult reports it.
+        return (nbytes.value, key.value, overlapped.contents)
+
+    def PostQueuedCompletionStatus(self, port, nbytes, key, overlapped=None):
+        ret_value = PostQueuedCompletionStatus(port, nbytes, key, overlapped)
+        if not ret_value:
+            raise IoCompletionPortError, FormatError(GetLastError())
+        return ret_value
 
 
+class WaitForMultipleObjectsPool(WaitPool):
+    def __init__(self, kernel=None, fair=False):
+        WaitPool.__init__(self, kernel or Win32Kernel(), fair)